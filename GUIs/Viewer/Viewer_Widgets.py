@@ -80,14 +80,16 @@ class Img(pg.GraphicsView):
         # variable to store the different image shms
         #   (can be switched by changing the value of self.Img_Shm)
         self.raw_im  = "/tmp/Track_Cam/RAWIMG.im.shm"
-        try: self.raw_im = Shm(self.raw_im)
+        try: self.raw_im = Shm(self.raw_im, seqlock = True)
         except: pass
         self.proc_im = "/tmp/Vis_Process/PROCIMG.im.shm"
-        try: self.proc_im = Shm(self.proc_im)
+        try: self.proc_im = Shm(self.proc_im, seqlock = True)
         except: pass
 
         # connect to shm
         self.Img_shm = self.proc_im
+        # buffer that frames are copied into (reused between frames)
+        self.img_buf = None
 
         # create Label to display current coordinates
         self.cur_pix = pg.TextItem(color = "w", fill = pg.mkBrush(color="k"))
@@ -163,18 +165,22 @@ class Img(pg.GraphicsView):
         # set new image
         try:
             if type(self.Img_shm) is str:
-                try: self.raw_im = Shm(self.raw_im)
+                try: self.raw_im = Shm(self.raw_im, seqlock = True)
                 except: pass
-                try: self.proc_im = Shm(self.proc_im)
+                try: self.proc_im = Shm(self.proc_im, seqlock = True)
                 except: pass
 
-                self.Img_shm = Shm(self.Img_shm)
+                self.Img_shm = Shm(self.Img_shm, seqlock = True)
 
             self.Img_shm.read_meta_data()
             # if image is at least two minutes old, use placeholder
             if time() - self.Img_shm.mtdata["atime_sec"] > 120: assert 0 == 1
 
-            img = self.Img_shm.get_data(reform = True)
+            # reuse frame buffer unless the shm has grown or changed type
+            if self.img_buf is None or self.img_buf.dtype != self.Img_shm.npdtype \
+                or self.img_buf.size < self.Img_shm.mtdata["nel"]:
+                self.img_buf = np.empty(self.Img_shm.mtdata["nel"], self.Img_shm.npdtype)
+            img = self.Img_shm.copy_into(self.img_buf)
             # if getting a raw image, overwrite the first four pixels (tags)
             try:
                 if self.Img_shm.fname == self.raw_im.fname:
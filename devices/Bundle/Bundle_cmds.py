@@ -148,12 +148,10 @@ class Bundle_cmds:
 
             # update position counter
             p_cnt = self.Pos_D.get_counter()
-            # wait for no longer than 10 seconds
-            cnt = 0
             # touch Stat_P so that D shms get updated
             self.Stat_P.set_data(self.Stat_D.get_data())
             # wait until Pos_D is updated
-            while cnt < 10 and p_cnt == self.Pos_D.get_counter(): sleep(1); cnt+=1
+            self.Pos_D.wait_for_update(p_cnt, timeout = 10)
         # otherwise we just need to check if the control script is alive
         else: self._checkAlive()
 
@@ -288,11 +286,8 @@ class Bundle_cmds:
         # if we don't block, return
         if not block: return
 
-        # create a counter to wait no more than 10 seconds
-        cnt = 0
-
         # if we are blocking, wait until Pos_D is updated
-        while cnt < 20 and  d_cnt == self.Pos_D.get_counter(): sleep(.5); cnt += 1
+        self.Pos_D.wait_for_update(d_cnt, timeout = 10)
 
         # check to see if we timed out
         if d_cnt == self.Pos_D.get_counter():
@@ -126,12 +126,10 @@ class Coronagraph_cmds:
 
             # update Position counter
             p_cnt = self.Pos_D.get_counter()
-            # wait for no longer than 10 seconds
-            cnt = 0
             # touch Stat_P so that D shms get updated
             self.Stat_P.set_data(self.Stat_D.get_data())
             # wait until Pos_D is updated
-            while p_cnt == self.Pos_D.get_counter(): sleep(1)
+            self.Pos_D.wait_for_update(p_cnt)
         # otherwise we just need to check if the control script is alive
         else: self._checkAlive()
 
@@ -258,7 +256,7 @@ class Coronagraph_cmds:
         if not block: return
 
         # if we are blocking, wait until Pos_D is updated
-        while self.Pos_D.mtdata["cnt0"] == self.Pos_D.get_counter(): sleep(.5)
+        self.Pos_D.wait_for_update()
 
         # raise an error if there is an error
         err = self.Error.get_data()[0]
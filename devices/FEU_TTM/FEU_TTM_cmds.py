@@ -181,8 +181,6 @@ class FEU_TTM_cmds:
 
         # get current counter for Pos_D so we know when it updates
         p_cnt = self.Pos_D.get_counter()
-        # wait no more than 10 seconds
-        cnt = 0
 
 
         # if a preset was given, translate it to a position
@@ -199,7 +197,7 @@ class FEU_TTM_cmds:
         if not block: return
 
         # if we are blocking, wait until Pos_D is updated
-        while cnt < 20 and p_cnt == self.Pos_D.get_counter(): sleep(.5); cnt += 1
+        self.Pos_D.wait_for_update(p_cnt, timeout = 10)
 
         if p_cnt == self.Pos_D.get_counter():
             raise MovementTimeout("Movement is taking too long. Check for blocks.")
@@ -124,7 +124,7 @@ class FIU_TTM_cmds:
             # this will throw an Attribute error if Stat_P is a string
             self.Stat_P.set_data(self.Stat_P.get_data())
             # wait for TTM position to update
-            while self.Pos_D.mtdata["cnt0"] == self.Pos_D.get_counter(): sleep(.5)
+            self.Pos_D.wait_for_update()
         #otherwise, we just need Pos_D
         elif type(self.Pos_D) is str: 
             self._handleShms()
@@ -249,7 +249,7 @@ class FIU_TTM_cmds:
 
         if not block: return
 
-        while self.Stat_D.mtdata["cnt0"] == self.Stat_D.get_counter(): sleep(.5)
+        self.Stat_D.wait_for_update()
 
         while self.Stat_D.get_data()[0] & 4: sleep(.5)
 
@@ -129,7 +129,7 @@ class Filter_Wh_cmds:
             # touch Stat_P so that D shms get updated
             self.Stat_P.set_data(self.Stat_D.get_data())
             # wait until Pos_D is updated
-            while d_cnt == self.Pos_D.get_counter(): sleep(1)
+            self.Pos_D.wait_for_update(d_cnt)
         # otherwise we just need to check if the control script is alive
         else: self._checkAlive()
 
@@ -237,7 +237,7 @@ class Filter_Wh_cmds:
             self.Pos_P.set_data(pos)
 
             # if we are blocking, wait until Pos_D is updated
-            while d_cnt == self.Pos_D.get_counter(): sleep(2)
+            self.Pos_D.wait_for_update(d_cnt)
 
         # get current counter for Pos_D so we know when it updates
         d_cnt = self.Pos_D.get_counter()
@@ -251,7 +251,7 @@ class Filter_Wh_cmds:
         if not block: return
 
         # if we are blocking, wait until Pos_D is updated
-        while d_cnt == self.Pos_D.get_counter(): sleep(2)
+        self.Pos_D.wait_for_update(d_cnt)
 
         # raise an error if there is an error
         err = self.Error.get_data()[0]
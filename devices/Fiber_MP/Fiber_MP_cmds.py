@@ -124,7 +124,7 @@ class Fiber_MP_cmds:
             # touch Stat_P so that D shms get updated
             self.Stat_P.set_data(self.Stat_D.get_data())
             # wait until Pos_D is updated
-            while p_cnt == self.Pos_D.get_counter(): sleep(1)
+            self.Pos_D.wait_for_update(p_cnt)
         # otherwise we just need to check if the control script is alive
         else: self._checkAlive()
 
@@ -226,7 +226,7 @@ class Fiber_MP_cmds:
         if not block: return
 
         # if we are blocking, wait until Pos_D is updated
-        while p_cnt == self.Pos_D.get_counter(): sleep(.5)
+        self.Pos_D.wait_for_update(p_cnt)
 
         # raise an error if there is an error
         err = self.Error.get_data()[0]
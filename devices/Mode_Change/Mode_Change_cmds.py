@@ -153,7 +153,7 @@ class Mode_Change_cmds:
 
         # if blocking, wait for update
         if block:
-            while self.Pos_D.mtdata["cnt0"] == self.Pos_D.get_counter(): sleep(.1)
+            self.Pos_D.wait_for_update()
 
     def load_presets(self):
         """Loads the presets that are currently written into the config file"""
@@ -1,5 +1,4 @@
 # inherent python libraries
-from time import sleep
 from configparser import ConfigParser
 from subprocess import Popen, PIPE
 import os
@@ -134,7 +133,7 @@ class Mode_Change_cmds:
             # touch Stat_P so that D shms get updated
             self.Stat_P.set_data(self.Stat_D.get_data())
             # wait until Pos_D is updated
-            while d_cnt == self.Pos_D.get_counter(): sleep(1)
+            self.Pos_D.wait_for_update(d_cnt)
         # otherwise we just need to check if the control script is alive
         else: self._checkAlive()
 
@@ -265,7 +264,7 @@ class Mode_Change_cmds:
         if not block: return
 
         # if we are blocking, wait until Pos_D is updated
-        while d_cnt == self.Pos_D.get_counter(): sleep(2)
+        self.Pos_D.wait_for_update(d_cnt)
 
         # raise an error if there is an error
         err = self.Error.get_data()[0]
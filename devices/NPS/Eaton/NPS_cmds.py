@@ -69,7 +69,7 @@ class NPS_cmds:
             #   any ports
             self.Shm_P.set_data(self.Shm_D.get_data())
             # wait for Shm D to be updated
-            while self.Shm_D.mtdata["cnt0"] == self.Shm_D.get_counter(): sleep(.1)
+            self.Shm_D.wait_for_update()
         # otherwise, check that Shm D exists
         else:
             if type(self.Shm_D) is str: self._handle_shms()
@@ -1,7 +1,6 @@
 # inherent python libraries
 from configparser import ConfigParser
 from subprocess import Popen
-from time import sleep
 import os
 
 # nfiuserver libraries
@@ -86,7 +85,7 @@ class NPS_cmds:
             self.Shm_P.set_data(self.Shm_P.get_data())
 
             # wait for Shm D counter to increment
-            while self.Shm_D.mtdata["cnt0"] == self.Shm_D.get_counter(): sleep(.5)
+            self.Shm_D.wait_for_update()
         # otherwise, make sure we're attached to shm
         else:
             # attach to shm if we haven't yet
@@ -126,7 +126,7 @@ class PIAA_cmds:
             # touch Stat_P so that D shms get updated
             self.Stat_P.set_data(self.Stat_D.get_data())
             # wait until Pos_D is updated (control script has a timeout)
-            while p_cnt == self.Pos_D.get_counter(): sleep(1)
+            self.Pos_D.wait_for_update(p_cnt)
         # otherwise we just need to check if the control script is alive
         else: self._checkAlive()
 
@@ -228,7 +228,7 @@ class PIAA_cmds:
         if not block: return
 
         # if we are blocking, wait until Pos_D is updated
-        while p_cnt == self.Pos_D.get_counter(): sleep(.5)
+        self.Pos_D.wait_for_update(p_cnt)
 
         if p_cnt == self.Pos_D.get_counter():
             raise MovementTimeout("Movement is taking too long. Check for blocks.")
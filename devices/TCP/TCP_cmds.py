@@ -1,6 +1,5 @@
 
 # inherent python libraries
-from time import sleep
 from configparser import ConfigParser
 from subprocess import Popen, PIPE
 import os
@@ -134,7 +133,7 @@ class TCP_cmds:
             # touch Stat_P so that D shms get updated
             self.Stat_P.set_data(self.Stat_D.get_data())
             # wait until Pos_D is updated
-            while p_cnt == self.Pos_D.get_counter(): sleep(1)
+            self.Pos_D.wait_for_update(p_cnt)
         # otherwise we just need to check if the control script is alive
         else: self._checkAlive()
 
@@ -236,7 +235,7 @@ class TCP_cmds:
         if not block: return
 
         # if we are blocking, wait until Pos_D is updated
-        while p_cnt == self.Pos_D.get_counter(): sleep(.5)
+        self.Pos_D.wait_for_update(p_cnt)
 
         # raise an error if there is an error
         err = self.Error.get_data()[0]
@@ -17,6 +17,7 @@
 KPIC_FliObserver::KPIC_FliObserver(){
     // prepare strings to store info from config file
     std::string img_cf;
+    std::string ring_cf;
     std::string fps_cf;
     std::string exp_cf;
     std::string ndr_cf;
@@ -45,6 +46,7 @@ KPIC_FliObserver::KPIC_FliObserver(){
     std::string word;
     while (conf >> word){
         if (strncmp("IMG:", word.c_str(), 4) == 0){ conf >> img_cf; }
+        else if(strncmp("IMG_RING:", word.c_str(), 9) == 0){ conf >> ring_cf; }
         else if(strncmp("FPS_D:", word.c_str(), 6) == 0){ conf >> fps_cf; }
         else if(strncmp("Exp_D:", word.c_str(), 6) == 0){ conf >> exp_cf; }
         else if(strncmp("NDR_D:", word.c_str(), 6) == 0){ conf >> ndr_cf; }
@@ -63,6 +65,17 @@ KPIC_FliObserver::KPIC_FliObserver(){
         exit(EXIT_FAILURE);
     } else { img_cf.erase(idx, std::string::npos); }
  
+    // the number of slots in the ring is after the last comma
+    uint32_t nslots;
+    idx = ring_cf.find(",");
+    if (idx == std::string::npos) { 
+        perror("Config file unreadable.");
+        exit(EXIT_FAILURE);
+    } else { 
+        nslots = std::stoul(ring_cf.substr(ring_cf.rfind(",") + 1));
+        ring_cf.erase(idx, std::string::npos); 
+    }
+ 
     idx = fps_cf.find(",");
     if (idx == std::string::npos) { 
         perror("Config file unreadable.");
@@ -95,6 +108,16 @@ KPIC_FliObserver::KPIC_FliObserver(){
         uint16_t size[3] = {640, 512, 0};
         img = new Shm(img_cf, size, 3, 4, &data, true, false, true); 
     }
+
+    // a ring that doesn't hold full frames is recreated
+    try { 
+        ring = new RingShm(ring_cf); 
+        if (ring->mtdata.nel < 640*512) { delete ring; throw MissingSharedMemory(); }
+    }
+    catch (MissingSharedMemory& ex) {
+        uint16_t size[3] = {640, 512, 0};
+        ring = new RingShm(ring_cf, size, 3, 4, nslots, true);
+    }
  
     try { fps = new Shm(fps_cf); }
     catch (MissingSharedMemory& ex) {
@@ -142,6 +165,7 @@ uint16_t KPIC_FliObserver::fpsTrigger(){ return 0; }
 void KPIC_FliObserver::imageReceived(const uint8_t* image){
     if (sem_trywait(&shm_res) != -1){
         img->set_data(image);
+        ring->set_data(image);
         sem_post(&shm_res);
     } 
 }
@@ -191,6 +215,7 @@ void KPIC_FliObserver::onCroppingChanged(bool enabled, uint16_t col1,
     if (enabled){
         // resize the image in shm
         img->resize(col2 - col1+1, row2 - row1+1, 0);
+        ring->resize(col2 - col1+1, row2 - row1+1, 0);
 
         // set crop_d shm
         uint16_t data[4] = {col1, col2, row1, row2};
@@ -199,6 +224,7 @@ void KPIC_FliObserver::onCroppingChanged(bool enabled, uint16_t col1,
     } else {
         // resize the image in shm to max
         img->resize(640, 512, 0);
+        ring->resize(640, 512, 0);
 
         // set crop_d shm to "no crop"
         uint16_t data[4] = {0, 0, 0, 0};
@@ -211,6 +237,7 @@ void KPIC_FliObserver::onCroppingChanged(bool enabled, uint16_t col1,
  */
 KPIC_FliObserver::~KPIC_FliObserver(){
     delete img;
+    delete ring;
     delete fps;
     delete exp;
     delete ndr;
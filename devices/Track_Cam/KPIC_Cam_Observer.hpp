@@ -52,6 +52,8 @@ class KPIC_FliObserver : public IFliCameraObserver, public IRawImageReceivedObse
 
     // To store the image
     Shm *img;
+    // To store the last few images
+    RingShm *ring;
     // To store D_FPS
     Shm *fps;
     // to store D_Exp
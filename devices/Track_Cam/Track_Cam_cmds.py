@@ -11,7 +11,7 @@ import numpy as np
 from astropy.io import fits
 
 # nfiuserver libraries
-from KPIC_shmlib import Shm
+from KPIC_shmlib import Shm, RingShm, ShmGroup
 from dev_Exceptions import *
 
 ######## Camera interface class ########
@@ -30,6 +30,7 @@ class TC_cmds:
         get_ndr
         get_crop
         get_temp
+        get_state
         grab_n
     Commands:
         save_dark
@@ -47,6 +48,7 @@ class TC_cmds:
         _check_alive
         _check_alive_and_connected
         _handle_shms
+        _grab_frames
         _get_header
     """
 
@@ -65,6 +67,7 @@ class TC_cmds:
         self.Stat_P = config.get("Shm Info", "Stat_P").split(",")[0]
         self.Error  = config.get("Shm Info", "Error").split(",")[0]
         self.Img    = config.get("Shm Info", "IMG").split(",")[0]
+        self.Ring   = config.get("Shm Info", "IMG_RING").split(",")[0]
         self.Crop_D = config.get("Shm Info", "Crop_D").split(",")[0]
         self.Crop_P = config.get("Shm Info", "Crop_P").split(",")[0]
         self.NDR_D  = config.get("Shm Info", "NDR_D").split(",")[0]
@@ -75,6 +78,10 @@ class TC_cmds:
         self.Exp_P  = config.get("Shm Info", "Exp_P").split(",")[0]
         self.Temp_D = config.get("Shm Info", "Temp_D").split(",")[0]
         self.Temp_P = config.get("Shm Info", "Temp_P").split(",")[0]
+        # group used to read camera parameters together (see _get_header)
+        self.Header = None
+        # camera parameters as of their last change (see get_state)
+        self.State = CamState()
 
         # get bias directory
         self.b_dir = config.get("Data", "bias_dir")
@@ -232,6 +239,47 @@ class TC_cmds:
             else: return float(self.Temp_D.get_data()[3])
         except: raise ShmError("Temp D shm may be corrupted. Please kill control script, delete shm, and start again.")
 
+    def get_state(self):
+        """Method to get the camera parameters, cheap enough to call every frame
+
+        Only the counters of the parameter shms (FPS_D, Exp_D, NDR_D, Crop_D
+            and Temp_P, plus Stat_D to catch reconnects) are read, unless
+            one of them changed since the last call. Compare the version of
+            the state to know if the parameters changed, rather than
+            comparing headers.
+
+        Returns:
+            CamState = the parameters (the same object every call, updated in place)
+        """
+
+        state = self.State
+        if state.group is not None:
+            try:
+                cnts = {name:shm.get_counter() for (name, shm) in state.group.shms.items()}
+                if cnts == state.cnts: return state
+            # a shm was deleted, reconnect below
+            except (OSError, ValueError): pass
+
+        # something changed, so check the camera and reread everything
+        self._check_alive_and_connected()
+
+        shms = {"stat":self.Stat_D, "fps":self.FPS_D, "tint":self.Exp_D, "ndr":self.NDR_D,
+            "temp_sp":self.Temp_P, "crop":self.Crop_D}
+        if state.group is None or state.group.shms != shms:
+            try: state.group = ShmGroup(shms)
+            except: raise ShmError("A shm may be missing. Please restart python session.")
+
+        try:
+            # counters from before the snapshot, so a write during it shows up next call
+            cnts = {name:shm.get_counter() for (name, shm) in shms.items()}
+            snap = state.group.snapshot()
+        except: raise ShmError("A D or P shm may be corrupted. Please kill control script, delete shm, and start again.")
+
+        state.update(float(snap["fps"][0]), float(snap["tint"][0]), int(snap["ndr"][0]),
+            snap["temp_sp"][0], [int(val) for val in snap["crop"]])
+        state.cnts = cnts
+        return state
+
     def grab_n(self, n:int, path:str=None, overwrite:bool=False):
         """Grabs a block of images.
 
@@ -254,7 +302,7 @@ class TC_cmds:
 
         # grab N images with a header on either side
         head_start = self._get_header()
-        images = [self.Img.get_data(True, reform=True) for x in range(0, n)]
+        images = self._grab_frames(n)
         if n > 1: head_end  = self._get_header()
 
         # format numpy arrays as fits
@@ -733,13 +781,52 @@ class TC_cmds:
                     except: raise ShmError("Please restart python session. If issue persists, restart control script.")
             if os.path.isfile(self.Img):
                 try:
-                    self.Img    = Shm(self.Img)
+                    self.Img    = Shm(self.Img, seqlock = True)
                     self.FPS_D  = Shm(self.FPS_D)
                     self.Exp_D  = Shm(self.Exp_D)
                     self.NDR_D  = Shm(self.NDR_D)
                     self.Crop_D = Shm(self.Crop_D)
                 except: raise ShmError("Please restart python session. If issue persists, restart control script.")
 
+        # ring buffer created in observer (when camera connects)
+        if type(self.Ring) is str and os.path.isfile(self.Ring):
+            try: self.Ring = RingShm(self.Ring)
+            except: pass
+
+    def _grab_frames(self, n:int, new:bool=True):
+        """Grabs n consecutive raw frames
+
+        If the ring buffer shm is available, frames are pulled from it so that no
+            frames are missed as long as the caller keeps up with the ring. Otherwise,
+            frames are pulled from the raw image shm one at a time.
+
+        Args:
+            n   = the number of frames to grab
+            new = if True, only frames taken after this call are returned. If False,
+                frames continue from the last one returned by the previous call
+                (when still in the ring)
+        Returns:
+            list = the frames as np.arrays
+        """
+
+        self._handle_shms()
+
+        if type(self.Ring) is str:
+            return [self.Img.get_data(True, reform=True) for x in range(0, n)]
+
+        # move past any frames already in the ring
+        if new: self.Ring.get_counter()
+
+        images, cnts = [], []
+        while len(images) < n:
+            frames, cnt, _ = self.Ring.get_since(check=True)
+            images += frames
+            cnts += list(cnt)
+
+        # keep the ring's counter on the last frame we returned
+        if len(images) > n: self.Ring.mtdata["cnt0"] = int(cnts[n-1])
+        return images[:n]
+
     def _get_header(self):
         """Returns a dictionary of camera parameters that can be used as a fits header
         
@@ -762,17 +849,70 @@ class TC_cmds:
 
         self._check_alive_and_connected()
 
-        fps     = self.get_fps()
-        tint    = self.get_tint()
-        ndr     = self.get_ndr()
-        temps   = self.get_temp(True)
-        temp_sp = self.Temp_P.get_data()[0]
-        crop    = self.get_crop()
+        # (re)build the group if any of the shms were reconnected to
+        shms = {"fps":self.FPS_D, "tint":self.Exp_D, "ndr":self.NDR_D, "temps":self.Temp_D,
+            "temp_sp":self.Temp_P, "crop":self.Crop_D}
+        if self.Header is None or self.Header.shms != shms:
+            try: self.Header = ShmGroup(shms)
+            except: raise ShmError("A shm may be missing. Please restart python session.")
+
+        try: snap = self.Header.snapshot()
+        except: raise ShmError("A D or P shm may be corrupted. Please kill control script, delete shm, and start again.")
+
+        fps     = float(snap["fps"][0])
+        tint    = float(snap["tint"][0])
+        ndr     = int(snap["ndr"][0])
+        temps   = list(snap["temps"])
+        temp_sp = snap["temp_sp"][0]
+        crop    = list(snap["crop"])
 
         return fits.Header({"fps":fps, "tint":tint, "ndr":ndr, "temp_MB":temps[0], "temp_FE":temps[1],
             "temp_PB":temps[2], "temp_se":temps[3], "temp_pe":temps[4], "temp_he":temps[5], "t_setp":temp_sp,
             "crop_LB":crop[0], "crop_RB":crop[1], "crop_UB":crop[2], "crop_BB":crop[3]})
 
+######## Camera state ########
+
+class CamState:
+    """The camera parameters that processing depends on, as of their last change
+        (see TC_cmds.get_state)
+
+    Fields can be read as attributes or with the keys of TC_cmds._get_header
+        (e.g. state["crop_LB"]), so a state can be used in place of a header.
+
+    Attributes:
+        version = a number that increments each time any parameter changes
+        fps     = the fps of the camera
+        tint    = the exposure time (in s) of the camera
+        ndr     = the number of non-destructive reads of the camera
+        t_setp  = the sensor temperature setpoint
+        crop    = the crop window as in TC_cmds.get_crop
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.fps = None
+        self.tint = None
+        self.ndr = None
+        self.t_setp = None
+        self.crop = None
+        # the shms read and their counters as of the last read
+        self.group = None
+        self.cnts = None
+
+    def update(self, fps:float, tint:float, ndr:int, t_setp:float, crop:list):
+        """Sets the parameters, incrementing version if any of them changed"""
+
+        new = (fps, tint, ndr, t_setp, list(crop))
+        if new != (self.fps, self.tint, self.ndr, self.t_setp, self.crop):
+            self.fps, self.tint, self.ndr, self.t_setp, self.crop = new
+            self.version += 1
+
+    def __getitem__(self, key:str):
+        fields = {"fps":self.fps, "tint":self.tint, "ndr":self.ndr, "t_setp":self.t_setp,
+            "crop_LB":self.crop[0], "crop_RB":self.crop[1], "crop_UB":self.crop[2],
+            "crop_BB":self.crop[3]}
+        return fields[key]
+
 ######## Errors ########
 
 class CameraOff(Exception):
@@ -0,0 +1,202 @@
+/*
+ * Layout of KPIC shared memory files.
+ *
+ * GENERATED by Python/KPIC_shm_schema.py, do not edit. Change the
+ *   schema there and regenerate this file with 'make schema'.
+ */
+
+#ifndef KPIC_SHM_SCHEMA_INCLUDE
+#define KPIC_SHM_SCHEMA_INCLUDE
+
+#include <cstddef>
+#include <time.h>
+#include <stdint.h>
+
+/*
+ * Defines a complex number with float precision
+ */
+typedef struct{
+    float re;
+    float im;
+} complex_float;
+
+/*
+ * Defines a complex number with double precision
+ */
+typedef struct{
+    double re;
+    double im;
+} complex_double;
+
+/*
+ * Defines a structure to hold the image's metadata
+ */
+typedef struct
+{
+
+    // image name
+    char name[80] = "";
+
+    // the time this memory was created
+    struct timespec crtime;
+
+    // the time that the image was acquired from the frame grabber
+    struct timespec atime;
+
+    /* keeps track of the number of times this image has been updated since
+     *    creation
+     */
+    uint64_t cnt0 = 0;
+
+    // the number of elements (product of non-zero elements of size)
+    uint32_t nel = 0;
+
+    // size should have 3 elements, 0 if an axis doesn't exist
+    uint16_t size[3] = {0,0,0};
+
+    // 1, 2, and 3 axis images are supported
+    uint8_t naxis = 0;
+
+    // the data type stored in the picture (see get_size)
+    uint8_t dtype = 0;
+
+    // whether this shm should be mmapped
+    uint8_t mmap = 1;
+
+    // keeps track of whether this data is croppable
+    uint8_t croppable = 0;
+
+    /* sequence word for lock-free (seqlock) reads of mmapped shms. Writers
+     *    make it odd before writing and even when done, skipping 0 so that a
+     *    seq of 0 with a non-zero cnt0 identifies a writer without support
+     */
+    uint16_t seq = 0;
+
+} im_metadata;
+
+static_assert(sizeof(im_metadata) == 136, "im_metadata layout changed");
+static_assert(offsetof(im_metadata, name) == 0, "im_metadata layout changed");
+static_assert(offsetof(im_metadata, crtime) == 80, "im_metadata layout changed");
+static_assert(offsetof(im_metadata, atime) == 96, "im_metadata layout changed");
+static_assert(offsetof(im_metadata, cnt0) == 112, "im_metadata layout changed");
+static_assert(offsetof(im_metadata, nel) == 120, "im_metadata layout changed");
+static_assert(offsetof(im_metadata, size) == 124, "im_metadata layout changed");
+static_assert(offsetof(im_metadata, naxis) == 130, "im_metadata layout changed");
+static_assert(offsetof(im_metadata, dtype) == 131, "im_metadata layout changed");
+static_assert(offsetof(im_metadata, mmap) == 132, "im_metadata layout changed");
+static_assert(offsetof(im_metadata, croppable) == 133, "im_metadata layout changed");
+static_assert(offsetof(im_metadata, seq) == 134, "im_metadata layout changed");
+
+/*
+ * Defines the header of a ring buffer shm, which follows im_metadata
+ */
+typedef struct
+{
+
+    // identifies the file as a ring buffer
+    char magic[4] = {'R', 'I', 'N', 'G'};
+
+    // the number of frames the ring holds
+    uint32_t nslots = 0;
+
+    // the number of bytes between the starts of two slots
+    uint64_t stride = 0;
+
+} ring_metadata;
+
+static_assert(sizeof(ring_metadata) == 16, "ring_metadata layout changed");
+static_assert(offsetof(ring_metadata, magic) == 0, "ring_metadata layout changed");
+static_assert(offsetof(ring_metadata, nslots) == 4, "ring_metadata layout changed");
+static_assert(offsetof(ring_metadata, stride) == 8, "ring_metadata layout changed");
+
+/*
+ * Defines the metadata of a single frame in a ring buffer shm
+ */
+typedef struct
+{
+
+    // the counter of the frame in this slot (0 while being written)
+    uint64_t cnt0 = 0;
+
+    // the time that the frame was acquired
+    struct timespec atime;
+
+    // the number of elements in the frame
+    uint32_t nel = 0;
+
+    // size of the frame, 0 if an axis doesn't exist
+    uint16_t size[3] = {0,0,0};
+
+    // the number of axes of the frame
+    uint8_t naxis = 0;
+
+} slot_metadata;
+
+static_assert(sizeof(slot_metadata) == 40, "slot_metadata layout changed");
+static_assert(offsetof(slot_metadata, cnt0) == 0, "slot_metadata layout changed");
+static_assert(offsetof(slot_metadata, atime) == 8, "slot_metadata layout changed");
+static_assert(offsetof(slot_metadata, nel) == 24, "slot_metadata layout changed");
+static_assert(offsetof(slot_metadata, size) == 28, "slot_metadata layout changed");
+static_assert(offsetof(slot_metadata, naxis) == 34, "slot_metadata layout changed");
+
+/*
+ * Sets size to the number of bytes in one element of a data type
+ *
+ * Inputs:
+ *   size = where to store the size
+ *   enc  = the data type (im_metadata.dtype), one of:
+ *          1:  uint8_t
+ *          2:  int8_t
+ *          3:  uint16_t
+ *          4:  int16_t
+ *          5:  uint32_t
+ *          6:  int32_t
+ *          7:  uint64_t
+ *          8:  int64_t
+ *          9:  IEEE 754 single-precision binary floating-point format: binary32
+ *          10: IEEE 754 double-precision binary floating-point format: binary64
+ *          11: complex_float
+ *          12: complex_double
+ *          13: UTF-32 string, one char per element (nel is the length)
+ *          14: UTF-8 string, one byte per element (nel is the length)
+ * Returns:
+ *   int = 0 on success, -1 if enc isn't a known data type
+ */
+inline int get_size(size_t* size, int enc)
+{
+    switch (enc) {
+
+    case 1: *size = sizeof(uint8_t);
+            return 0;
+    case 2: *size = sizeof(int8_t);
+            return 0;
+    case 3: *size = sizeof(uint16_t);
+            return 0;
+    case 4: *size = sizeof(int16_t);
+            return 0;
+    case 5: *size = sizeof(uint32_t);
+            return 0;
+    case 6: *size = sizeof(int32_t);
+            return 0;
+    case 7: *size = sizeof(uint64_t);
+            return 0;
+    case 8: *size = sizeof(int64_t);
+            return 0;
+    case 9: *size = sizeof(float);
+            return 0;
+    case 10: *size = sizeof(double);
+            return 0;
+    case 11: *size = sizeof(complex_float);
+            return 0;
+    case 12: *size = sizeof(complex_double);
+            return 0;
+    case 13: *size = sizeof(char32_t);
+            return 0;
+    case 14: *size = sizeof(char);
+            return 0;
+    default: return -1;
+
+    }
+}
+
+#endif
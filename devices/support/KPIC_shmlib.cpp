@@ -5,7 +5,6 @@
 #include <semaphore.h>  // adds POSIX semaphores
 #include <unistd.h>     // adds sysconf to find page size
 #include <fcntl.h>      // adds O POSIX tags (O_CREAT)
-#include <thread>       // adds threading
 #include <sys/mman.h>   // adds mmap
 #include <sys/stat.h>   // adds mmap tags
 #include <sys/types.h>  // with stat, adds directory checking
@@ -19,86 +18,59 @@
 
 #include "KPIC_shmlib.hpp"
 
-/*
- * Posts all alive semaphores. 
- *   (can be slow, meant to be used in a thread)
- *
- * The point of opening and closing semaphores for every post is to ensure that
- *   we update semaphores that were destroyed and recreated between posts.
- *   the cost of creating a semaphore, while not non-existant, shouldn't slow
- *   down things too much. But, this function is still best used in a thread.
- *
- * Inputs:
- *    sem_fnm = the file name for a semaphore of the shm that was updated
- *    skip    = the name of a semaphore to skip
- * Returns:
- *    int = -1 if SEM_DIR isn't found, else 0
- */
-int postSems(std::string sem_fnm, std::string skip){
+void SemSubscribers::post(const std::string &sem_fnm, const std::string &skip){
+    struct stat dir_stat;
+    if (stat(SEM_DIR, &dir_stat) == 0) {
+        struct timespec now;
+        clock_gettime(CLOCK_REALTIME, &now);
+        long long age = (now.tv_sec - dir_stat.st_mtim.tv_sec) * 1000000000LL
+                        + now.tv_nsec - dir_stat.st_mtim.tv_nsec;
+        // rescan if SEM_DIR changed (or may have) since the last scan
+        if (!scanned || skip != skipped || age < SEM_DIR_SETTLE_NS ||
+            dir_stat.st_mtim.tv_sec != mtime.tv_sec || 
+            dir_stat.st_mtim.tv_nsec != mtime.tv_nsec) {
+            scan(sem_fnm, skip);
+            mtime = dir_stat.st_mtim;
+        }
+    }
+
+    for (sem_t *sem : sems) { sem_post(sem); }
+}
+
+void SemSubscribers::scan(const std::string &sem_fnm, const std::string &skip){
+    for (sem_t *sem : sems) { sem_close(sem); }
+    sems.clear();
+    scanned = true;
+    skipped = skip;
+
     // format skip to be file name of the semaphore based on its name
-    if (skip.length() != 0) {
-        skip.insert(1, "sem.");
-        skip = skip.substr(1, skip.length());
+    std::string skip_fnm = skip;
+    if (skip_fnm.length() != 0) {
+        skip_fnm.insert(1, "sem.");
+        skip_fnm = skip_fnm.substr(1, skip_fnm.length());
     }
     DIR *dir;
     struct dirent *ent;
     if ((dir = opendir(SEM_DIR)) != NULL) {
-        /* print all the files and directories within directory */
         while ((ent = readdir(dir)) != NULL) {
             if (strncmp(sem_fnm.c_str(), ent->d_name, sem_fnm.length()) == 0 &&
-                (skip.length() == 0 || strncmp(skip.c_str(), ent->d_name, skip.length()))) {
+                (skip_fnm.length() == 0 || 
+                 strncmp(skip_fnm.c_str(), ent->d_name, skip_fnm.length()))) {
                 // replace 'sem.' in file name with '/' to get semaphore name
                 std::string sem_nm = ent->d_name;
                 sem_nm.erase(0, 4);
                 sem_nm = "/" + sem_nm;
-                // open the semaphore
-                sem_t *sem = sem_open(sem_nm.c_str(), O_CREAT, 0644, 0);   
-                // increment the semaphore
-                sem_post(sem);
-                // close the semaphore
-                sem_close(sem);
+                // open the semaphore, unless it was removed since readdir
+                sem_t *sem = sem_open(sem_nm.c_str(), 0);
+                if (sem != SEM_FAILED) { sems.push_back(sem); }
             }
         }
         closedir (dir);
-
-        return 0;
-    } else {
-        // could not open directory
-        return -1;
     }
 }
 
-int get_size(size_t* size, int enc)
-{
-    switch (enc) {
-
-    case 1: *size = sizeof(uint8_t);
-            return 0; 
-    case 2: *size = sizeof(int8_t);
-            return 0; 
-    case 3: *size = sizeof(uint16_t);
-            return 0; 
-    case 4: *size = sizeof(int16_t);
-            return 0; 
-    case 5: *size = sizeof(uint32_t);
-            return 0; 
-    case 6: *size = sizeof(int32_t);
-            return 0; 
-    case 7: *size = sizeof(uint64_t);
-            return 0; 
-    case 8: *size = sizeof(int64_t);
-            return 0; 
-    case 9: *size = sizeof(float);
-            return 0; 
-    case 10: *size = sizeof(double);
-            return 0; 
-    case 11: *size = sizeof(complex_float);
-            return 0; 
-    case 12: *size = sizeof(complex_double);
-            return 0; 
-    default: return -1;
-    
-    }
+SemSubscribers::~SemSubscribers(){
+    for (sem_t *sem : sems) { sem_close(sem); }
 }
 
 
@@ -112,9 +84,10 @@ class CorruptSharedMemory: public std::exception{
     }
 } CorruptShm;
 
-Shm::Shm(std::string filepath, bool has_sem)
+Shm::Shm(std::string filepath, bool has_sem, bool seqlock)
 {
     fname = filepath;
+    this->seqlock = seqlock;
 
     // open file
     FILE* backing = fopen(fname.c_str(), "rb+");
@@ -278,10 +251,8 @@ Shm::Shm(std::string filepath, uint16_t size[], uint8_t dims, uint8_t dtype,
     // connect to a semaphore if one was requested
     if (has_sem){ get_sem(); }
 
-    // start a thread to post semaphores
-    std::thread post(postSems, sem_fnm, sem_nm);
-    
-    post.detach();
+    // post the subscribers' semaphores
+    subs.post(sem_fnm, sem_nm);
 }
 
 void Shm::getMetaData(){
@@ -299,6 +270,9 @@ void Shm::getMetaData(){
 }
 
 uint64_t Shm::getCounter(){
+    // try to read without the lock if requested
+    if (buf && seqlock && seq_read(NULL, 0, 0)) { return mtdata.cnt0; }
+
     // grab the lock
     sem_wait(lock);
 
@@ -333,10 +307,14 @@ void Shm::set_data(const void *new_data){
     sem_wait(lock);
 
     if (buf) {
+        // tell seqlock readers that a write is in progress
+        uint16_t seq = seq_begin();
         // copy the data to the shared memory
         memcpy(buf+DATA_OFFSET, new_data, DATA_SIZE);
         // copy new metadata to shm
         memcpy(buf+ATIME_OFFSET, &mtdata.atime, edit);
+        // tell seqlock readers that the write is done
+        seq_end(seq);
     } else {
         FILE* backing = fopen(fname.c_str(), "rb+");
         if (!backing){ throw MissingSharedMemory(); }
@@ -352,10 +330,8 @@ void Shm::set_data(const void *new_data){
     // release the lock
     sem_post(lock);
 
-    // start a thread to post semaphores
-    std::thread post(postSems, sem_fnm, sem_nm);
-    
-    post.detach();
+    // post the subscribers' semaphores
+    subs.post(sem_fnm, sem_nm);
 }
 
 void Shm::get_data(void *loc, bool wait){
@@ -368,6 +344,8 @@ void Shm::get_data(void *loc, bool wait){
         sem_wait(sem); 
     }
 
+    // try to read without the lock if requested
+    if (buf && seqlock && seq_read(loc, DATA_OFFSET, DATA_SIZE)) { return; }
 
     // grab lock
     sem_wait(lock);
@@ -410,7 +388,9 @@ void Shm::resize(uint16_t dim1, uint16_t dim2, uint16_t dim3){
 
     size_t len = sizeof(mtdata.nel)+sizeof(mtdata.size);
     if (buf){
+        uint16_t seq = seq_begin();
         memcpy(buf+NEL_OFFSET, &mtdata.nel, len);
+        seq_end(seq);
     } else {
         FILE* backing = fopen(fname.c_str(), "rb+");
         if(!backing){ throw MissingSharedMemory(); }
@@ -424,6 +404,46 @@ void Shm::resize(uint16_t dim1, uint16_t dim2, uint16_t dim3){
     sem_post(lock);
 }
 
+uint16_t Shm::seq_begin(){
+    uint16_t *seq = (uint16_t*) (buf + SEQ_OFFSET);
+    uint16_t val = __atomic_load_n(seq, __ATOMIC_RELAXED);
+    // make seq odd (it may already be odd if a writer died mid-write)
+    if (!(val & 1)) { val++; }
+    __atomic_store_n(seq, val, __ATOMIC_RELAXED);
+    // make sure seq is visible before any of the data is changed
+    __atomic_thread_fence(__ATOMIC_RELEASE);
+    return val;
+}
+
+void Shm::seq_end(uint16_t val){
+    uint16_t *seq = (uint16_t*) (buf + SEQ_OFFSET);
+    // even again, skipping 0 so readers know this writer bumps seq
+    val++;
+    if (val == 0) { val = 2; }
+    __atomic_store_n(seq, val, __ATOMIC_RELEASE);
+}
+
+bool Shm::seq_read(void *loc, size_t off, size_t len){
+    uint16_t *seq = (uint16_t*) (buf + SEQ_OFFSET);
+    uint64_t cnt0;
+    for (int i = 0; i < SEQ_RETRIES; i++){
+        uint16_t before = __atomic_load_n(seq, __ATOMIC_ACQUIRE);
+        // a write is in progress
+        if (before & 1) { continue; }
+        memcpy(&cnt0, buf + CNT0_OFFSET, sizeof(cnt0));
+        // writer doesn't bump seq so we can't trust it
+        if (before == 0 && cnt0 != 0) { return false; }
+        if (len > 0) { memcpy(loc, buf + off, len); }
+        // make sure the copies are done before seq is checked again
+        __atomic_thread_fence(__ATOMIC_ACQUIRE);
+        if (__atomic_load_n(seq, __ATOMIC_RELAXED) == before){
+            mtdata.cnt0 = cnt0;
+            return true;
+        }
+    }
+    return false;
+}
+
 void Shm::get_sem(){
     // connect to an unused semaphore if we don't already have one
     if (!has_sem){
@@ -463,3 +483,198 @@ Shm::~Shm(){
     // close lock
     sem_close(lock);
 }
+
+/*
+ * Builds the name shared by a shm's lock and semaphores from its file path
+ *   (e.g. /tmp/dir/Module.im.shm -> /dirModule)
+ */
+static std::string semPrefix(std::string fname){
+    std::string sempref = fname;
+    // remove root-level directory
+    size_t cut = sempref.find("/", 1);
+    if (cut != std::string::npos) { 
+        sempref = sempref.substr(cut, sempref.length());
+    }
+    // remove any other '/'
+    while ((cut = sempref.find("/")) != std::string::npos){ 
+        sempref.erase(cut, 1); 
+    }
+    // add '/' to beginning and remove extension
+    sempref = "/" + sempref;
+    sempref.erase(sempref.find("."), sempref.length());
+
+    return sempref;
+}
+
+RingShm::RingShm(std::string filepath)
+{
+    fname = filepath;
+
+    // open file
+    FILE* backing = fopen(fname.c_str(), "rb+");
+    if (!backing) { throw MissingSharedMemory(); }
+    // read in metadata and ring header
+    fread(&mtdata, sizeof(mtdata), 1, backing);
+    fread(&rgdata, sizeof(rgdata), 1, backing);
+    fclose(backing);
+
+    if (strncmp(rgdata.magic, "RING", 4) != 0) { throw CorruptShm; }
+    if (get_size(&UNIT_SIZE, mtdata.dtype) == -1) { throw CorruptShm; } 
+
+    // frames are full size until resized
+    frame.nel = mtdata.nel;
+    frame.naxis = mtdata.naxis;
+    for (int i=0; i < 3; i++){ frame.size[i] = mtdata.size[i]; }
+    DATA_SIZE = UNIT_SIZE*frame.nel;
+    DATA_OFFSET = SLOT_OFFSET + rgdata.nslots*sizeof(slot_metadata);
+
+    std::string sempref = semPrefix(fname);
+    lock = sem_open((sempref + "_lock").c_str(), O_CREAT, 0644, 1);
+    if (lock == SEM_FAILED){
+        perror("lock opening failed.");
+        exit(EXIT_FAILURE);
+    }
+    sem_fnm = sempref + "_sem";
+    sem_fnm.erase(0, 1);
+    sem_fnm = "sem." + sem_fnm;
+
+    map();
+}
+
+RingShm::RingShm(std::string filepath, uint16_t size[], uint8_t dims, 
+        uint8_t dtype, uint32_t nslots, bool croppable)
+{
+    fname = filepath;
+
+    mtdata.dtype = dtype;
+    if (get_size(&UNIT_SIZE, mtdata.dtype) == -1) { throw CorruptShm; } 
+
+    std::string sempref = semPrefix(fname);
+    lock = sem_open((sempref + "_lock").c_str(), O_CREAT, 0644, 1);
+    if (lock == SEM_FAILED){
+        perror("lock opening failed.");
+        exit(EXIT_FAILURE);
+    }
+    sem_fnm = sempref + "_sem";
+    sem_fnm.erase(0, 1);
+    sem_fnm = "sem." + sem_fnm;
+
+    // set times and name in metadata
+    timespec_get(&mtdata.crtime, TIME_UTC);
+    mtdata.atime = mtdata.crtime;
+    sempref.erase(0, 1);
+    strcpy(mtdata.name, sempref.c_str());
+
+    // the metadata describes the largest frame
+    mtdata.naxis = 0;
+    mtdata.nel = 1;
+    for (int i=0; i < 3; i++){
+        if (i < dims && size[i] > 0) {
+            mtdata.naxis++;
+            mtdata.nel *= size[i];
+            mtdata.size[i] = size[i];
+        } else { mtdata.size[i] = 0; }
+    }
+    // ring buffers are always mmapped
+    mtdata.mmap = 1;
+    mtdata.croppable = (uint8_t) croppable;
+
+    frame.nel = mtdata.nel;
+    frame.naxis = mtdata.naxis;
+    for (int i=0; i < 3; i++){ frame.size[i] = mtdata.size[i]; }
+    DATA_SIZE = UNIT_SIZE*frame.nel;
+
+    // keep slots 8-byte aligned
+    rgdata.nslots = nslots;
+    rgdata.stride = ((DATA_SIZE + 7) / 8) * 8;
+    DATA_OFFSET = SLOT_OFFSET + rgdata.nslots*sizeof(slot_metadata);
+
+    // write the headers and size the file for the empty slots
+    FILE* backing = fopen(fname.c_str(), "wb+");
+    if (!backing){ throw MissingSharedMemory(); }
+    fwrite(&mtdata, sizeof(mtdata), 1, backing);
+    fwrite(&rgdata, sizeof(rgdata), 1, backing);
+    fclose(backing);
+    if (truncate(fname.c_str(), DATA_OFFSET + rgdata.stride*rgdata.nslots) != 0){
+        perror("Could not size ring buffer");
+        exit(EXIT_FAILURE);
+    }
+
+    map();
+}
+
+void RingShm::map(){
+    FILE* backing = fopen(fname.c_str(), "rb+");
+    if (!backing){ throw MissingSharedMemory(); }
+    buf_sz = DATA_OFFSET + rgdata.stride*rgdata.nslots;
+    buf = (char*) mmap(0, buf_sz, PROT_READ | PROT_WRITE, MAP_SHARED,
+        fileno(backing), 0);
+    if (buf == MAP_FAILED){ perror("mmap"); exit(EXIT_FAILURE); }
+    fclose(backing);
+}
+
+void RingShm::set_data(const void *new_data){
+    timespec_get(&frame.atime, TIME_UTC);
+
+    // grab the lock
+    sem_wait(lock);
+
+    uint64_t cnt0;
+    memcpy(&cnt0, buf + ATIME_OFFSET + sizeof(mtdata.atime), sizeof(cnt0));
+    cnt0++;
+    size_t idx = (cnt0 - 1) % rgdata.nslots;
+    slot_metadata *slot = (slot_metadata*) (buf + SLOT_OFFSET) + idx;
+
+    // invalidate the slot so readers know it's being overwritten
+    __atomic_store_n(&slot->cnt0, (uint64_t) 0, __ATOMIC_RELAXED);
+    __atomic_thread_fence(__ATOMIC_RELEASE);
+    // copy the frame and its metadata
+    memcpy(buf + DATA_OFFSET + idx*rgdata.stride, new_data, DATA_SIZE);
+    slot->atime = frame.atime;
+    slot->nel = frame.nel;
+    memcpy(slot->size, frame.size, sizeof(frame.size));
+    slot->naxis = frame.naxis;
+    // the slot is valid again
+    __atomic_store_n(&slot->cnt0, cnt0, __ATOMIC_RELEASE);
+
+    // update the header, bumping seq for seqlock readers
+    uint16_t *seq = (uint16_t*) (buf + SEQ_OFFSET);
+    uint16_t val = __atomic_load_n(seq, __ATOMIC_RELAXED);
+    if (!(val & 1)) { val++; }
+    __atomic_store_n(seq, val, __ATOMIC_RELAXED);
+    __atomic_thread_fence(__ATOMIC_RELEASE);
+    mtdata.atime = frame.atime;
+    mtdata.cnt0 = cnt0;
+    memcpy(buf + ATIME_OFFSET, &mtdata.atime, sizeof(mtdata.atime) + sizeof(mtdata.cnt0));
+    val++;
+    if (val == 0) { val = 2; }
+    __atomic_store_n(seq, val, __ATOMIC_RELEASE);
+
+    // release the lock
+    sem_post(lock);
+
+    // post the subscribers' semaphores
+    subs.post(sem_fnm, "");
+}
+
+void RingShm::resize(uint16_t dim1, uint16_t dim2, uint16_t dim3){
+    uint16_t size[3] = {dim1, dim2, dim3};
+
+    uint32_t nel = 1;
+    uint8_t naxis = 0;
+    for (int i=0; i<3; i++){
+        if (size[i] > 0){ nel *= size[i]; naxis++; }
+    }
+    // frames bigger than the slots can't be stored
+    if (nel > mtdata.nel) { throw CorruptShm; }
+
+    memcpy(frame.size, size, sizeof(size));
+    frame.nel = nel;
+    frame.naxis = naxis;
+    DATA_SIZE = nel * UNIT_SIZE;
+}
+
+RingShm::~RingShm(){
+    munmap(buf, buf_sz);
+    sem_close(lock);
+}
@@ -4,29 +4,21 @@
  */
 
 #include <exception>
+#include <cstddef>
 #include <time.h>
 #include <semaphore.h>
 #include <stdint.h>
 #include <string>
+#include <vector>
+
+// shm file layout (generated from Python/KPIC_shm_schema.py)
+#include "KPIC_shm_schema.hpp"
 
 // the directory where semaphores are stored
 #define SEM_DIR "/dev/shm"
-
-/*
- * Defines a complex number with float precision
- */
-typedef struct{
-    float re;
-    float im;
-} complex_float;
-
-/*
- * Defines a complex number with double precision
- */
-typedef struct{
-    double re;
-    double im;
-} complex_double;
+// file timestamps only change once per kernel tick, so subscriber lists are
+//   rescanned until SEM_DIR has been unchanged for this long (nanoseconds)
+#define SEM_DIR_SETTLE_NS 20000000
 
 /*
  * an exception to be thrown when a shm that doesn't exist is attached to
@@ -38,57 +30,42 @@ class MissingSharedMemory: public std::exception{
     }
 }; 
 
-/*
- * Defines a structure to hold the image's metadata
- */ 
-typedef struct
-{
-
-    // image name
-    char name[80] = "";
-
-    // the time this memory was created
-    struct timespec crtime;
+// number of times a seqlock read is retried before falling back to the lock
+#define SEQ_RETRIES 100
 
-    // the time that the image was acquired from the frame grabber
-    struct timespec atime;
-
-    // keeps track of the number of times this image has been updated since
-    //    creation
-    uint64_t cnt0 = 0;
-
-    // the number of elements (product of non-zero elements of size)
-    uint32_t nel = 0;
-
-    // size should have 3 elements, 0 if an axis doesn't exist
-    uint16_t size[3] = {0,0,0};
-
-    // 1, 2, and 3 axis images are supported
-    uint8_t naxis = 0;
-
-    /* the data type stored in the picture
-     *    1:  uint8_t
-     *    2:  int8_t
-     *    3:  uint16_t
-     *    4:  int16_t
-     *    5:  uint32_t
-     *    6:  int32_t
-     *    7:  uint64_t
-     *    8:  int64_t
-     *    9:  IEEE 754 single-precision binary floating-point format: binary32
-     *    10: IEEE 754 double-precision binary floating-point format: binary64
-     *    11: complex_float
-     *    12: complex_double
-     */
-    uint8_t dtype = 0;
+/*
+ * The semaphores of a shm's subscribers, kept open between posts. Creating or
+ *   unlinking a semaphore changes the modification time of SEM_DIR, so the
+ *   directory is only rescanned when that changes.
+ */
+class SemSubscribers{
 
-    // keeps track of the last updated slice in the buffer
-    uint8_t mmap = 1;
+    public:
+        /*
+         * Posts the semaphores of all subscribers
+         *
+         * Inputs:
+         *    sem_fnm = the file name beginning of the shm's semaphores
+         *    skip    = the name of a semaphore not to post ("" for none)
+         */
+        void post(const std::string &sem_fnm, const std::string &skip);
 
-    // keeps track of whether this data is croppable
-    uint8_t croppable = 0;
+        // destructor
+        ~SemSubscribers();
 
-} im_metadata;
+    private:
+        // closes the cached semaphores and opens the ones in SEM_DIR
+        void scan(const std::string &sem_fnm, const std::string &skip);
+
+        // the open semaphores
+        std::vector<sem_t *> sems;
+        // modification time of SEM_DIR when it was last scanned
+        struct timespec mtime = {0, 0};
+        // the semaphore skipped by the last scan
+        std::string skipped;
+        // whether a scan has been done
+        bool scanned = false;
+};
 
 class Shm{
 
@@ -103,8 +80,10 @@ class Shm{
          *             Should be of the form '/tmp/dir/shmName.im.shm'
          *   has_sem   = whether this shm should take a semaphore for listening
          *              purposes (note, this can be decided later with get_data)
+         *   seqlock   = whether reads should use the sequence word instead of
+         *              the lock (only affects mmapped shms)
          */
-        Shm(std::string filepath, bool has_sem=false);
+        Shm(std::string filepath, bool has_sem=false, bool seqlock=false);
 
         /*
          * Constructor to create a shared memory
@@ -185,10 +164,18 @@ class Shm{
         size_t DATA_SIZE;
         // shm file name
         std::string fname;
+        // whether reads skip the lock and use the sequence word (mmap only)
+        bool seqlock = false;
 
     private:
         // private methods
         void get_sem();
+        // marks the start/end of a write for seqlock readers (lock must be held)
+        uint16_t seq_begin();
+        void seq_end(uint16_t seq);
+        // reads len bytes at offset off of the mmap into loc, as well as cnt0,
+        //   without the lock. returns false if a consistent read couldn't be made
+        bool seq_read(void *loc, size_t off, size_t len);
 
         // private parameters
 
@@ -203,13 +190,101 @@ class Shm{
          *    sem_fnm will be sem.dirModule_sem in this case
          */
         std::string sem_fnm;
+        // semaphores to post when the shm is updated
+        SemSubscribers subs;
         // mmap location
         char *buf;
         // offsets for quick access
         const uint8_t ATIME_OFFSET = sizeof(mtdata.name)+sizeof(mtdata.crtime);
         const uint8_t CNT0_OFFSET = ATIME_OFFSET + sizeof(mtdata.atime);
         const uint8_t NEL_OFFSET = CNT0_OFFSET + sizeof(mtdata.cnt0);
+        const uint8_t SEQ_OFFSET = offsetof(im_metadata, seq);
         const uint8_t DATA_OFFSET = sizeof(im_metadata);
         // size of a single piece of data
         size_t UNIT_SIZE;
 };
+
+class RingShm{
+
+    public:
+        // public methods
+
+        /*
+         * Constructor to open a ring buffer shared memory
+         *
+         * Inputs:
+         *   filepath = path to the shared memory file backing 
+         */
+        RingShm(std::string filepath);
+
+        /*
+         * Constructor to create a ring buffer shared memory
+         *
+         * Inputs:
+         *   filepath  = path where the shared memory backing should be stored
+         *   size []   = dimensions of the largest frame to be stored
+         *   dims      = the number of dimensions of the data.
+         *   dtype     = the type of data to be stored
+         *              Should be an encoding defined by im_metadata
+         *   nslots    = the number of frames to keep
+         *   croppable = whether frames smaller than size can be stored
+         */
+        RingShm(std::string filepath, uint16_t size[], uint8_t dims, 
+            uint8_t dtype, uint32_t nslots, bool croppable);
+
+        /*
+         * Writes a frame to the next slot in the ring. The frame should be 
+         *   of the size set by the constructor or by resize.
+         *
+         * Inputs:
+         *   new_data = a pointer to the start of the frame to be written.
+         */
+        void set_data(const void *new_data);
+
+        /*
+         * Sets the size of the frames that will be written from now on. 
+         *   The frames can't have more elements than the ring was created
+         *   with.
+         */
+        void resize(uint16_t dim1, uint16_t dim2, uint16_t dim3);
+
+        // destructor
+        ~RingShm();
+
+        // public parameters
+
+        // metadata structure (size is that of the largest frame)
+        im_metadata mtdata;
+        // ring header
+        ring_metadata rgdata;
+        // metadata of the frames being written
+        slot_metadata frame;
+        // size of the frames being written
+        size_t DATA_SIZE;
+        // shm file name
+        std::string fname;
+
+    private:
+        // private methods
+        void map();
+
+        // private parameters
+
+        // lock to protect the shm
+        sem_t *lock;
+        // file name beginning of a sempahore for this shm (see Shm)
+        std::string sem_fnm;
+        // semaphores to post when the shm is updated
+        SemSubscribers subs;
+        // mmap location
+        char *buf;
+        // size of the mmapping
+        size_t buf_sz;
+        // offsets for quick access
+        const uint8_t ATIME_OFFSET = sizeof(mtdata.name)+sizeof(mtdata.crtime);
+        const uint8_t SEQ_OFFSET = offsetof(im_metadata, seq);
+        const size_t SLOT_OFFSET = sizeof(im_metadata) + sizeof(ring_metadata);
+        size_t DATA_OFFSET;
+        // size of a single piece of data
+        size_t UNIT_SIZE;
+};
@@ -0,0 +1,251 @@
+'''---------------------------------------------------------------------------
+Layout of KPIC shared memory files
+
+This is the one definition of the shm file layout used by both KPIC_shmlib.py
+and KPIC_shmlib.hpp. KPIC_shmlib.py builds its struct formats and data type
+tables from the definitions below, and the C++ structures and get_size in
+KPIC_shm_schema.hpp are generated from them:
+
+    python KPIC_shm_schema.py > ../KPIC_shm_schema.hpp    (make schema)
+
+After changing anything here, regenerate the header and run
+shm_conformance.py, which writes shms with each library and reads them back
+with the other.
+---------------------------------------------------------------------------'''
+
+import struct
+
+import numpy as np
+
+# ------------------------------------------------------
+#                  available data types
+# ------------------------------------------------------
+# atype in the header : (numpy dtype, C type, description)
+DTYPES = { 1 : ("uint8", "uint8_t", None),
+           2 : ("int8", "int8_t", None),
+           3 : ("uint16", "uint16_t", None),
+           4 : ("int16", "int16_t", None),
+           5 : ("uint32", "uint32_t", None),
+           6 : ("int32", "int32_t", None),
+           7 : ("uint64", "uint64_t", None),
+           8 : ("int64", "int64_t", None),
+           9 : ("float32", "float",
+                "IEEE 754 single-precision binary floating-point format: binary32"),
+           10 : ("float64", "double",
+                "IEEE 754 double-precision binary floating-point format: binary64"),
+           11 : ("complex64", "complex_float", None),
+           12 : ("complex128", "complex_double", None),
+           13 : ("<U1", "char32_t",
+                "UTF-32 string, one char per element (nel is the length)"),
+           14 : ("S1", "char",
+                "UTF-8 string, one byte per element (nel is the length)") }
+
+# ------------------------------------------------------
+#                  structure definitions
+# ------------------------------------------------------
+# Each structure is a list of its C members, in order:
+#   (C type, C name, python keys, struct format, C default, description)
+# A member can unpack to several python keys (e.g. the two halves of a
+#   timespec), in which case the struct format has one part per key.
+# Structures use native alignment, so formats must not have a byte order.
+
+# Metadata at the start of every shm
+HEADER = [
+    ("char", "name[80]", ["imname"], "80s", '""', "image name"),
+    ("struct timespec", "crtime", ["crtime_sec", "crtime_nsec"], "Q Q", None,
+        "the time this memory was created"),
+    ("struct timespec", "atime", ["atime_sec", "atime_nsec"], "Q Q", None,
+        "the time that the image was acquired from the frame grabber"),
+    ("uint64_t", "cnt0", ["cnt0"], "Q", "0",
+        "keeps track of the number of times this image has been updated since"
+        " creation"),
+    ("uint32_t", "nel", ["nel"], "I", "0",
+        "the number of elements (product of non-zero elements of size)"),
+    ("uint16_t", "size[3]", ["size"], "3H", "{0,0,0}",
+        "size should have 3 elements, 0 if an axis doesn't exist"),
+    ("uint8_t", "naxis", ["naxis"], "B", "0",
+        "1, 2, and 3 axis images are supported"),
+    ("uint8_t", "dtype", ["atype"], "B", "0",
+        "the data type stored in the picture (see get_size)"),
+    ("uint8_t", "mmap", ["mmap"], "B", "1", "whether this shm should be mmapped"),
+    ("uint8_t", "croppable", ["croppable"], "B", "0",
+        "keeps track of whether this data is croppable"),
+    ("uint16_t", "seq", ["seq"], "H", "0",
+        "sequence word for lock-free (seqlock) reads of mmapped shms. Writers"
+        " make it odd before writing and even when done, skipping 0 so that a"
+        " seq of 0 with a non-zero cnt0 identifies a writer without support")]
+
+# A ring buffer shm has the usual header (describing the largest frame it can
+#   hold), then a ring header, then one slot header per slot, then the slots.
+RING_HEADER = [
+    ("char", "magic[4]", ["magic"], "4s", "{'R', 'I', 'N', 'G'}",
+        "identifies the file as a ring buffer"),
+    ("uint32_t", "nslots", ["nslots"], "I", "0", "the number of frames the ring holds"),
+    ("uint64_t", "stride", ["stride"], "Q", "0",
+        "the number of bytes between the starts of two slots")]
+
+SLOT_HEADER = [
+    ("uint64_t", "cnt0", ["cnt0"], "Q", "0",
+        "the counter of the frame in this slot (0 while being written)"),
+    ("struct timespec", "atime", ["atime_sec", "atime_nsec"], "Q Q", None,
+        "the time that the frame was acquired"),
+    ("uint32_t", "nel", ["nel"], "I", "0", "the number of elements in the frame"),
+    ("uint16_t", "size[3]", ["size"], "3H", "{0,0,0}",
+        "size of the frame, 0 if an axis doesn't exist"),
+    ("uint8_t", "naxis", ["naxis"], "B", "0", "the number of axes of the frame")]
+
+RING_MAGIC = b"RING"
+
+# ------------------------------------------------------
+#          tables derived from the definitions
+# ------------------------------------------------------
+def _fmt(members:list) -> str:
+    ''' ------------------------------------------------------------------
+    Returns the struct format of a structure, with the padding a C compiler
+    adds at its end so that the format's size matches sizeof
+    ------------------------------------------------------------------ '''
+
+    fmt = " ".join(member[3] for member in members)
+    # a structure is aligned like its most aligned member
+    align = max(struct.calcsize(part.lstrip("0123456789")) for part in fmt.split())
+    pad = -struct.calcsize(fmt) % align
+    return fmt + (" {}x".format(pad) if pad else "")
+
+def _offsets(members:list) -> dict:
+    ''' ------------------------------------------------------------------
+    Returns the offset of each C member of a structure
+    ------------------------------------------------------------------ '''
+
+    offsets = {}
+    fmt = ""
+    for member in members:
+        # the member starts after any padding needed to align its first part
+        start = struct.calcsize(fmt + member[3].split()[0]) - \
+            struct.calcsize(member[3].split()[0])
+        offsets[member[1].split("[")[0]] = start
+        fmt += member[3] + " "
+    return offsets
+
+# Dictionaries to translate between metadata type and numpy type
+atod = { atype : np.dtype(dtype) for (atype, (dtype, _, _)) in DTYPES.items() }
+dtoa = { value : key for (key, value) in atod.items() }
+
+# metadata keys for the shm structure, in the order they're unpacked
+mtkeys = [key for member in HEADER for key in member[2]]
+
+# strings used to decode the binary structures
+hdr_fmt = _fmt(HEADER)
+ring_fmt = _fmt(RING_HEADER)
+slot_fmt = _fmt(SLOT_HEADER)
+
+# ------------------------------------------------------
+#                  C++ header generation
+# ------------------------------------------------------
+def _comment(text:str, indent:str) -> list:
+    ''' ------------------------------------------------------------------
+    Wraps text into lines of a C++ comment
+    ------------------------------------------------------------------ '''
+
+    lines = [""]
+    for word in text.split():
+        if len(indent) + len(lines[-1]) + len(word) + 7 > 79: lines.append("")
+        lines[-1] += (" " if lines[-1] else "") + word
+
+    if len(lines) == 1: return [indent + "// " + lines[0]]
+    return [indent + "/* " + lines[0]] + [indent + " *    " + line
+        for line in lines[1:]] + [indent + " */"]
+
+def _struct(name:str, members:list, doc:str) -> list:
+    ''' ------------------------------------------------------------------
+    Returns the lines of the C++ definition of a structure
+    ------------------------------------------------------------------ '''
+
+    lines = ["/*", " * " + doc, " */", "typedef struct", "{"]
+    for (ctype, cname, _, _, default, desc) in members:
+        lines += [""] + _comment(desc, "    ")
+        init = "" if default is None else " = " + default
+        lines.append("    {} {}{};".format(ctype, cname, init))
+    lines += ["", "}} {};".format(name), ""]
+
+    # the python formats are the reference, so make the compiler check them
+    size = struct.calcsize(_fmt(members))
+    lines.append("static_assert(sizeof({}) == {}, \"{} layout changed\");".format(
+        name, size, name))
+    for (cname, offset) in _offsets(members).items():
+        lines.append("static_assert(offsetof({}, {}) == {}, \"{} layout changed\");"
+            .format(name, cname, offset, name))
+    return lines + [""]
+
+def cpp_header() -> str:
+    ''' ------------------------------------------------------------------
+    Returns the text of KPIC_shm_schema.hpp
+    ------------------------------------------------------------------ '''
+
+    lines = ["/*",
+             " * Layout of KPIC shared memory files.",
+             " *",
+             " * GENERATED by Python/KPIC_shm_schema.py, do not edit. Change the",
+             " *   schema there and regenerate this file with 'make schema'.",
+             " */",
+             "",
+             "#ifndef KPIC_SHM_SCHEMA_INCLUDE",
+             "#define KPIC_SHM_SCHEMA_INCLUDE",
+             "",
+             "#include <cstddef>",
+             "#include <time.h>",
+             "#include <stdint.h>",
+             "",
+             "/*",
+             " * Defines a complex number with float precision",
+             " */",
+             "typedef struct{",
+             "    float re;",
+             "    float im;",
+             "} complex_float;",
+             "",
+             "/*",
+             " * Defines a complex number with double precision",
+             " */",
+             "typedef struct{",
+             "    double re;",
+             "    double im;",
+             "} complex_double;",
+             ""]
+
+    lines += _struct("im_metadata", HEADER, "Defines a structure to hold the "
+        "image's metadata")
+    lines += _struct("ring_metadata", RING_HEADER, "Defines the header of a ring "
+        "buffer shm, which follows im_metadata")
+    lines += _struct("slot_metadata", SLOT_HEADER, "Defines the metadata of a "
+        "single frame in a ring buffer shm")
+
+    lines += ["/*",
+              " * Sets size to the number of bytes in one element of a data type",
+              " *",
+              " * Inputs:",
+              " *   size = where to store the size",
+              " *   enc  = the data type (im_metadata.dtype), one of:"]
+    for (atype, (_, ctype, desc)) in DTYPES.items():
+        lines.append(" *          {:<3} {}".format(str(atype)+":", desc or ctype))
+    lines += [" * Returns:",
+              " *   int = 0 on success, -1 if enc isn't a known data type",
+              " */",
+              "inline int get_size(size_t* size, int enc)",
+              "{",
+              "    switch (enc) {",
+              ""]
+    for (atype, (_, ctype, _)) in DTYPES.items():
+        lines += ["    case {}: *size = sizeof({});".format(atype, ctype),
+                  "            return 0;"]
+    lines += ["    default: return -1;",
+              "",
+              "    }",
+              "}",
+              "",
+              "#endif",
+              ""]
+
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    print(cpp_header(), end = "")
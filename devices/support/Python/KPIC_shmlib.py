@@ -4,48 +4,194 @@ Read and write access to shared memory (SHM) structures used by KPIC
 ---------------------------------------------------------------------------'''
 
 import os, sys, struct
-from mmap import mmap as Mmap, MAP_SHARED
-from time import time
+from mmap import mmap as Mmap, MAP_SHARED, PROT_READ, PROT_WRITE
+from time import time, time_ns, monotonic
 from logging import info
 from atexit import register, unregister
-from signal import signal, SIGHUP, SIGTERM
+from signal import signal, getsignal, SIGHUP, SIGTERM, SIG_DFL
 from glob import glob
+from threading import Thread, Lock, current_thread, main_thread
+from weakref import WeakKeyDictionary
+import asyncio
 
 # installs
 import posix_ipc as ipc
 import numpy as np
 
+# the shm file layout, shared with the C++ library
+from KPIC_shm_schema import atod, dtoa, mtkeys, hdr_fmt, ring_fmt, slot_fmt, RING_MAGIC
+
 #The directory where semaphores are stored (set by system, this variable is 
 #   used for checking, not for creation.
 SEM_DIR = "/dev/shm"
 
+# File timestamps are only updated once per kernel tick, so a semaphore created
+#   in the same tick as an earlier change to SEM_DIR wouldn't change its mtime.
+#   Subscriber lists are rescanned until SEM_DIR has been quiet for this long.
+SEM_DIR_SETTLE_NS = 20000000
+
+# String shms hold one character per element, either as UTF-32 (<U1, 4 bytes
+#   per character) or as UTF-8 bytes (S1). nel is the length of the string.
+STR_DTYPES = (np.dtype("<U1"), np.dtype("S1"))
+
 # ------------------------------------------------------
-#          list of available data types
+#      structures used to decode the binary shm file
 # ------------------------------------------------------
-# Dictionaries to translate between metadata type and numpy type
-atod = { 1 : np.dtype("uint8"), 2 : np.dtype("int8"), 3 : np.dtype("uint16"), 
-         4 : np.dtype("int16"), 5 : np.dtype("uint32"), 6 : np.dtype("int32"),
-         7 : np.dtype("uint64"), 8 : np.dtype("int64"), 9 : np.dtype("float32"),
-         10 : np.dtype("float64"), 11 : np.dtype("complex64"), 
-         12 : np.dtype("complex128"), 13 : np.dtype("<U1")}  
-dtoa = { value : key for (key, value) in atod.items() } 
-
-# the size of each of the data types
-asize = { 1 : 1, 2 : 1, 3 : 2, 4 : 2, 5 : 4, 6 : 4, 7 : 8, 8 : 8, 9 : 8, 
-          10 : 16, 11 : 16, 12 : 32, 13 : 4} 
+# mtkeys, hdr_fmt, ring_fmt, slot_fmt, and the data type dictionaries (atod
+#   and dtoa) are defined by KPIC_shm_schema. Element sizes come from the 
+#   numpy dtype's itemsize.
+
+# precompiled header format
+hdr_struct = struct.Struct(hdr_fmt)
+
+# the offset of each metadata key in the header, and the number of values 
+#   it unpacks to
+hdr_offsets = {}
+hdr_counts = {}
+_offset = 0
+for _key, _fmt in zip(mtkeys, hdr_fmt.split(' ')):
+    hdr_offsets[_key] = _offset
+    hdr_counts[_key] = len(struct.unpack(_fmt, bytes(struct.calcsize(_fmt))))
+    _offset += struct.calcsize(_fmt)
 
 # ------------------------------------------------------
-# list of metadata keys for the shm structure (global)
+#         sequence word for lock-free (seqlock) reads
 # ------------------------------------------------------
-mtkeys = ['imname', 'crtime_sec', 'crtime_nsec', 'atime_sec', 'atime_nsec', 
-          'cnt0', 'nel', 'size', 'naxis', 'atype', 'mmap', 'croppable']
+# Writers of mmapped shms make 'seq' odd before touching the shm and even
+#   again once they are done. It never returns to 0 after the first write, so 
+#   a seq of 0 with a non-zero cnt0 means the writer doesn't support seqlock.
+# The number of times a seqlock reader retries before falling back to the lock
+SEQ_RETRIES = 100
+
+# How often (in seconds) a Shm checks whether its file was replaced (e.g. by
+#   a restarted control script), and if so reopens its backing and lock. The
+#   check is a stat, so it's rate limited rather than done on every access.
+REVALIDATE_S = 0.5
 
 # ------------------------------------------------------
-#    string used to decode the binary shm structure
+#            resources shared between Shm objects
 # ------------------------------------------------------
-# See the following link for format character translation:
-#    https://docs.python.org/2/library/struct.html#format-characters
-hdr_fmt = '80s Q Q Q Q Q I 3H B B B B 2x'
+class _Backing:
+    ''' ------------------------------------------------------------------
+    The file descriptor and mmap of one shm file. Every Shm object of the 
+    same file in this process shares one _Backing (see Shm._attach).
+    ------------------------------------------------------------------ '''
+
+    def __init__(self, fname:str):
+        self.fname = fname
+        try: 
+            self.fd = os.open(fname, os.O_RDWR)
+            self.prot = PROT_READ | PROT_WRITE
+        except PermissionError: 
+            self.fd = os.open(fname, os.O_RDONLY)
+            self.prot = PROT_READ
+        self.ino = os.fstat(self.fd).st_ino
+        self.buf = None
+        # the number of Shm objects using this backing
+        self.refs = 0
+
+    def map(self) -> Mmap:
+        '''Returns an mmap of the whole file, mapping it on first use'''
+
+        if self.buf is None:
+            buf_len = os.fstat(self.fd).st_size
+            self.buf = Mmap(self.fd, buf_len, MAP_SHARED, self.prot)
+        return self.buf
+
+    def release(self):
+        '''Drops a reference, closing the backing when it was the last'''
+
+        self.refs -= 1
+        if self.refs > 0: return
+
+        if _backings.get(self.fname) is self: del _backings[self.fname]
+        if self.buf is not None:
+            try: self.buf.close()
+            except Exception as ouch: 
+                info("Exception on close: {}".format(ouch))
+        try: os.close(self.fd)
+        except Exception as ouch: 
+            info("Exception on close: {}".format(ouch))
+
+# backings of the files opened by this process, by absolute path. An entry is
+#   replaced when the file at its path is recreated.
+_backings = {}
+# lock semaphores by name, with the inode of the shm file they were opened
+#   for (None for shms without a file). Control scripts unlink their lock
+#   semaphores when they exit, so a lock is reopened when its shm file is
+#   recreated, rather than kept for the life of the process.
+_locks = {}
+# guards _backings and _locks
+_registry_lock = Lock()
+
+# Shm objects that own a semaphore. Their semaphores are released when the
+#   process gets SIGHUP or SIGTERM (to wake up anything waiting on them) and 
+#   unlinked at exit.
+_sem_owners = set()
+_atexit_registered = False
+_signals_installed = False
+
+def _lock(imname:str, ino:int=None) -> ipc.Semaphore:
+    '''Returns the lock semaphore of the shm with the given imname, whose
+    file has inode ino. The semaphore is opened again if the file has been
+    replaced since it was last opened.'''
+
+    with _registry_lock:
+        if imname not in _locks or _locks[imname][0] != ino:
+            _locks[imname] = (ino, ipc.Semaphore("/"+imname+"_lock", 
+                flags=ipc.O_CREAT, initial_value=1))
+        return _locks[imname][1]
+
+def _install_cleanup():
+    '''Registers cleanup of Shm objects once per process'''
+
+    global _atexit_registered, _signals_installed
+
+    if not _atexit_registered:
+        register(_close_sem_owners) #handles ctrl-c and exceptions
+        _atexit_registered = True
+
+    # signal handlers can only be set from the main thread, and handlers set 
+    #   by the script itself take priority
+    if not _signals_installed and current_thread() is main_thread():
+        for signum in [SIGHUP, SIGTERM]: #tmux kill-ses and terminate calls
+            if getsignal(signum) in [SIG_DFL, None]: 
+                signal(signum, _signal_handler)
+        _signals_installed = True
+
+def _close_sem_owners():
+    for shm in list(_sem_owners): shm.close()
+
+def _signal_handler(signum, stack):
+    for shm in list(_sem_owners): shm.signal_handler(signum, stack)
+
+def _chars(data, dtype:np.dtype) -> np.ndarray:
+    ''' ------------------------------------------------------------------
+    Converts a string, bytes, or an array of strings into a flat array of 
+    single characters of dtype (one of STR_DTYPES) without a python loop.
+    Arrays of strings are joined into one string.
+    ------------------------------------------------------------------ '''
+
+    if not isinstance(data, (str, bytes)):
+        data = np.ravel(data)
+        data = b"".join(data) if data.dtype.kind == "S" else "".join(data)
+
+    if dtype == np.dtype("S1"):
+        if isinstance(data, str): data = data.encode()
+        return np.frombuffer(data, dtype)
+
+    if isinstance(data, bytes): data = data.decode()
+    return np.frombuffer(data.encode("utf-32-le"), dtype)
+
+def _string(data:np.ndarray) -> str:
+    ''' ------------------------------------------------------------------
+    Converts an array of single characters (one of STR_DTYPES) back into 
+    a string
+    ------------------------------------------------------------------ '''
+
+    if data.dtype == np.dtype("S1"): 
+        return data.tobytes().decode(errors = "replace")
+    return data.tobytes().decode("utf-32-le")
 
 class Shm:
 
@@ -55,8 +201,11 @@ class Shm:
     class SemaphoreError(Exception):
         pass
 
+    class TimeoutError(TimeoutError):
+        pass
+
     def __init__(self, fname:str, data:np.ndarray=None, mmap:bool=False, croppable:bool=False,
-                 sem:bool=False):
+                 sem:bool=False, seqlock:bool=False):
         ''' --------------------------------------------------------------
         Constructor for a SHM (shared memory) object.
 
@@ -64,35 +213,45 @@ class Shm:
         ----------
         - fname: name of the shared memory file structure
         - data: some array (1, 2 or 3D of data). If an existing file backing is
-            pointed to by fname, data will be ignored
+            pointed to by fname, data will be ignored. A str is stored as
+            <U1 characters and bytes as UTF-8 (S1) characters.
         - mmap: whether this shm should be mmapped. Mmapping speeds up read
             and write but takes up memory.
         - croppable: whether this data is croppable or a constant size
         - sem: whether this instance of the shm should create a semaphore
+        - seqlock: whether reads of this instance should skip the lock and
+            use the sequence word instead (only affects mmapped shms). 
+            Writers are never blocked by seqlock readers.
 
         If data is provided, but a file with the given name already exists,
            the data will be ignored and the existing file will be used.
         -------------------------------------------------------------- '''
 
-        # if a string as passed in, convert it to a numpy array
-        if type(data) is str:
-            data = np.array([char for char in data], np.dtype("<U1"))
+        # if a string as passed in, convert it to an array of characters
+        if isinstance(data, (str, bytes)):
+            data = _chars(data, STR_DTYPES[isinstance(data, bytes)])
             croppable = True
-        elif data is not None and str(data.dtype) == "<U1": croppable = True
-        elif data is not None and str(data.dtype).find("<U") == 0:
-            # in this case, we have a string but it's not broken into chars
-            # so reform array into string
-            nel = 1
-            for dim in data.shape:
-                if dim != 0: nel *= dim
-            data.reshape((nel,))
-            data = ("{}"*nel).format(*data) 
-            # and then put back in an array
-            data = np.array([char for char in data], np.dtype("<U1")) 
+        elif data is not None and data.dtype.kind in "US":
+            # break strings into characters (a no-op for <U1 and S1 arrays)
+            data = _chars(data, STR_DTYPES[data.dtype.kind == "S"])
             croppable = True
 
         self.fname = fname
         self.mmap = None
+        self.buf = None
+        # file descriptor and mmap shared with other Shms (see _attach)
+        self._backing = None
+        # lock semaphore (see lock), the inode of the file it's for, and when
+        #   the file was last checked for replacement (see _revalidate)
+        self._lock = None
+        self._lock_ino = None
+        self._checked = monotonic()
+        self.seqlock = seqlock
+        # cached read-only array backed by the mmap (see _view)
+        self._mview = None
+        # open subscriber semaphores and the SEM_DIR mtime they were found at
+        self._subs = []
+        self._subs_mtime = None
 
         # --------------------------------------------------------------------
         #                dictionary containing the metadata
@@ -108,7 +267,8 @@ class Shm:
                        'naxis' : 0,
                        'atype': 0,
                        'mmap'  : 0,
-                       'croppable' : 0}
+                       'croppable' : 0,
+                       'seq' : 0}
 
         # if file doesn't exist, see if we need to make it
         if not os.path.isfile(fname):
@@ -125,15 +285,14 @@ class Shm:
         # if the file exists, load info
         if os.path.isfile(fname):
             info("reading from existing %s" % (fname,))
+            # if another Shm already mapped this file, read from its mmap
+            self.buf = self._attach().buf
+            self.mmap = self.buf is not None
             # read metadata
             self.read_meta_data()
 
             # mmap or dont, as requested
-            if self.mmap:
-                with open(self.fname, "rb+") as file_:
-                    # get size of file to mmap
-                    buf_len = os.fstat(file_.fileno()).st_size
-                    self.buf = Mmap(file_.fileno(), buf_len, MAP_SHARED)
+            if self.mmap: self.buf = self._backing.map()
         # otherwise, we want a semaphore so make imname
         else:
             spl = self.fname.split("/")
@@ -143,19 +302,17 @@ class Shm:
             # unless there is no directory
             else: self.mtdata["imname"] = spl[-1].split(".")[0]
 
-        #Create lock semaphore
-        self.lock = ipc.Semaphore("/"+self.mtdata["imname"]+"_lock",
-            flags=ipc.O_CREAT, initial_value=1)
+        #Connect to lock semaphore
+        self._lock_ino = self._backing.ino if self._backing is not None else None
+        self._lock = _lock(self.mtdata["imname"], self._lock_ino)
+
+        #automatically perform cleanup
+        _install_cleanup()
 
         #If requested, make semaphore for this instance
         self.sem = None
         if sem: self.find_sem()
 
-        #automatically perform cleanup
-        register(self.close) #handles ctrl-c and exceptions
-        signal(SIGHUP, self.signal_handler) #handles tmux kill-ses
-        signal(SIGTERM, self.signal_handler) #handles terminate calls
-
     def find_sem(self):
         '''--------------------------------------------------------------
         Tries to connect to an unused semaphore of this shm if this shm 
@@ -172,6 +329,7 @@ class Shm:
             #   error if a semaphore with the given name already exists 
             try:
                 self.sem = ipc.Semaphore(semName, flags=ipc.O_CREX)
+                _sem_owners.add(self)
                 break
             except ipc.ExistentialError: pass
 
@@ -216,9 +374,16 @@ class Shm:
         self.mtdata['mmap']         = mmap
         self.mtdata['croppable']    = croppable
         
-        # ---------------------------------------------------------
-        #          reconstruct a SHM metadata buffer
-        # ---------------------------------------------------------
+        with open(self.fname, "wb+") as backing:
+            backing.write(self._pack_meta()+self._payload(data))
+
+        self.post_sems()
+
+    def _pack_meta(self) -> bytes:
+        ''' --------------------------------------------------------------
+        Packs the mtdata dictionary into a SHM metadata buffer
+        -------------------------------------------------------------- '''
+
         fmts = hdr_fmt.split(' ')
         minibuf = ''.encode()
         for i, fmt in enumerate(fmts):
@@ -236,10 +401,18 @@ class Shm:
                 else:
                     minibuf += struct.pack(fmt, self.mtdata[mtkeys[i]])
 
-        with open(self.fname, "wb+") as backing:
-            backing.write(minibuf+data.astype(data.dtype).tostring())
+        return minibuf
 
-        self.post_sems()
+    def _payload(self, data:np.ndarray) -> bytes:
+        ''' --------------------------------------------------------------
+        Returns the bytes that follow the metadata in a new file backing
+
+        Parameters:
+        ----------
+        - data: the data the shm is being created with
+        -------------------------------------------------------------- '''
+
+        return data.astype(data.dtype).tostring()
 
     def read_meta_data(self):
         ''' --------------------------------------------------------------
@@ -247,46 +420,116 @@ class Shm:
         Populate the shm object mtdata dictionary.
         Sets offsets based on the format variable above
         -------------------------------------------------------------- '''
-        offset = 0
-        fmts = hdr_fmt.split(' ')
-        with open(self.fname, "rb") as backing:
-            buf = backing.read()
-            for i, fmt in enumerate(fmts):
-                # ignore padding bytes
-                if fmt.endswith("x"): 
-                    hlen = struct.calcsize(fmt)
-                    struct.unpack(fmt, buf[offset:offset+hlen])
-                    offset += hlen
-                    continue
-
-                if mtkeys[i] == "cnt0": self.c0_offset = offset
-                elif mtkeys[i] == "atime_sec": self.atime_offset = offset
-                elif mtkeys[i] == "size": self.sz_offset = offset
-
-                hlen = struct.calcsize(fmt)
-                # we have to handle name differently because unpacking doesn't
-                #   work correctly on unused bits
-                if i == 0:
-                    #copy the name part of the metadata except 0 bits 
-                    name = [c for c in buf[:int(fmt[:fmt.find("s")])] if c!=0]
-                    dec = struct.unpack("{}s".format(len(name)), bytes(name))
-                    self.mtdata['imname'] = dec[0].decode()
-                else:
-                    item = struct.unpack(fmt, buf[offset:offset+hlen])
-                    #if the length is only one, we just want value
-                    if len(item) == 1: self.mtdata[mtkeys[i]] = item[0]
-                    #otherwise we want the whole tuple
-                    else: self.mtdata[mtkeys[i]] = item
-                
-                offset += hlen
+
+        # only the header is read, straight from the mmap if there is one
+        if self.mmap and self.buf is not None:
+            vals = hdr_struct.unpack_from(self.buf, 0)
+        else:
+            vals = hdr_struct.unpack(self._pread(hdr_struct.size, 0))
+
+        idx = 0
+        for key in mtkeys:
+            cnt = hdr_counts[key]
+            #if the length is only one, we just want value
+            if cnt == 1: self.mtdata[key] = vals[idx]
+            #otherwise we want the whole tuple
+            else: self.mtdata[key] = vals[idx:idx+cnt]
+            idx += cnt
+
+        # name is null padded
+        self.mtdata['imname'] = self.mtdata['imname'].split(b"\0")[0].decode()
+
+        self.c0_offset = hdr_offsets["cnt0"]
+        self.atime_offset = hdr_offsets["atime_sec"]
+        self.sz_offset = hdr_offsets["size"]
+        self.seq_offset = hdr_offsets["seq"]
 
         # offset for data
-        self.im_offset = offset
+        self.im_offset = hdr_struct.size
 
         self.mmap = bool(self.mtdata["mmap"])
         self.croppable = bool(self.mtdata["croppable"])
         self.npdtype = atod[self.mtdata["atype"]]
 
+    def _attach(self) -> _Backing:
+        ''' --------------------------------------------------------------
+        Points this Shm at the shared backing of the file at fname, opening
+        a new one if the file hasn't been opened by this process or has 
+        been replaced since.
+        -------------------------------------------------------------- '''
+
+        path = os.path.abspath(self.fname)
+        # raises FileNotFoundError if the file was deleted, as open would
+        ino = os.stat(path).st_ino
+        if self._backing is not None and self._backing.ino == ino: 
+            return self._backing
+
+        with _registry_lock:
+            backing = _backings.get(path)
+            if backing is None or backing.ino != ino:
+                backing = _Backing(path)
+                _backings[path] = backing
+            backing.refs += 1
+            if self._backing is not None: self._backing.release()
+            self._backing = backing
+
+        return backing
+
+    @property
+    def lock(self) -> ipc.Semaphore:
+        ''' --------------------------------------------------------------
+        The lock semaphore of the shm. If the file at fname has been
+        replaced (e.g. its control script restarted, unlinking the old
+        lock), the lock of the new file is returned (see _revalidate).
+        -------------------------------------------------------------- '''
+
+        self._revalidate()
+        return self._lock
+
+    def _revalidate(self):
+        ''' --------------------------------------------------------------
+        Checks, at most every REVALIDATE_S seconds, whether the file at
+        fname has been replaced. If it has, the header is read again, the
+        new file is mapped (if mmapped) and its lock is opened, so reads
+        and writes go to the new file rather than the old mapping.
+        -------------------------------------------------------------- '''
+
+        # shms without a file have nothing to check
+        if self._lock_ino is None: return
+        now = monotonic()
+        if now - self._checked < REVALIDATE_S: return
+        self._checked = now
+
+        # a deleted file keeps the old mapping and lock until it's recreated
+        try: ino = os.stat(self.fname).st_ino
+        except OSError: return
+        if ino == self._lock_ino: return
+
+        # as in __init__, the header is read from the new file before mapping
+        self._mview = None
+        self.buf = self._attach().buf
+        self.read_meta_data()
+        self.buf = self._backing.map() if self.mmap else None
+
+        self._lock = _lock(self.mtdata["imname"], self._backing.ino)
+        self._lock_ino = self._backing.ino
+
+    def _fileno(self) -> int:
+        ''' --------------------------------------------------------------
+        Returns a file descriptor for the file backing, reopening it if the
+        file at fname has been replaced.
+        -------------------------------------------------------------- '''
+
+        return self._attach().fd
+
+    def _pread(self, n:int, offset:int) -> bytes:
+        ''' --------------------------------------------------------------
+        Reads n bytes at offset from the file backing (without reading
+        the rest of the file)
+        -------------------------------------------------------------- '''
+
+        return os.pread(self._fileno(), n, offset)
+
     def close(self):
         ''' --------------------------------------------------------------
         Clean close of a SHM data structure link
@@ -294,22 +537,38 @@ class Shm:
         Clean close of buffer, release the file descriptor.
         -------------------------------------------------------------- '''
 
-        # if we mmapped, close the mmap buffer
-        if self.mmap:
-            try: self.buf.close()
+        # drop our view of the mmap so it can be closed
+        self._mview = None
+
+        # release the file descriptor and mmap, closing them if no other Shm
+        #   is using them
+        if self._backing is not None:
+            with _registry_lock: self._backing.release()
+            self._backing = None
+
+        # close the subscriber semaphores
+        for sem in self._subs:
+            try: sem.close()
             except Exception as ouch: 
                 info("Exception on close: {}".format(ouch))
+        self._subs = []
+        self._subs_mtime = None
 
         # if a semaphore was created for this process, unlink it
+        self._release_sem()
+
+    def _release_sem(self):
+        '''Unlinks and closes this instance's semaphore, freeing its
+        subscriber slot'''
+
         if self.sem is not None: 
             try: 
                 self.sem.unlink()
                 self.sem.close()
             except Exception as ouch: 
                 info("Exception on close: {}".format(ouch))
-
-        # unregister this method to avoid duplicate closes
-        unregister(self.close)
+            self.sem = None
+        _sem_owners.discard(self)
 
     def signal_handler(self, signum, stack):
         if self.sem is not None:
@@ -318,35 +577,48 @@ class Shm:
 
     def post_sems(self):
         '''------------------------------------------------------------------
-        Connects to any semaphores in SEM_DIR named with this shm's imname
-           and updates them.
+        Updates any semaphores in SEM_DIR named with this shm's imname
 
         NOTE: This assumes the naming convention used by CentOS. Before using
            check that a) SEM_DIR is correct and b) if a semaphore is named
            '/xyz' then it is stored as 'sem.xyz'
 
-        The reason that semaphores are opened and closed rather than stored is
-           to ensure that semaphores recycled between postings are handled
-           correctly. 
+        The subscriber semaphores are kept open between postings. Creating or
+           unlinking a semaphore changes the mtime of SEM_DIR, so the list is
+           only rebuilt when that changes (see _scan_sems), which also
+           handles semaphores recycled between postings.
+        -------------------------------------------------------------------'''
+
+        mtime = os.stat(SEM_DIR).st_mtime_ns
+        if mtime != self._subs_mtime or time_ns() - mtime < SEM_DIR_SETTLE_NS:
+            self._scan_sems()
+            self._subs_mtime = mtime
+
+        for sem in self._subs:
+            # increment semaphore
+            sem.release()
+
+    def _scan_sems(self):
+        '''------------------------------------------------------------------
+        Closes the cached subscriber semaphores and connects to the ones 
+           currently in SEM_DIR
         -------------------------------------------------------------------'''
 
+        for sem in self._subs:
+            try: sem.close()
+            except ipc.ExistentialError: pass
+        self._subs = []
+
         # look for any files in the semaphore directory following the convention
         #    for naming based on the name of this image
-        sems = glob(SEM_DIR+"/sem."+self.mtdata["imname"]+"_sem*")
-
-        # connect to sem, increment it, close it
-        for sem in sems:
+        for sem in glob(SEM_DIR+"/sem."+self.mtdata["imname"]+"_sem*"):
             # strip directories from filename
             sem_nm = sem[sem.rfind("/")+1:]
             # remove sem. at beginning and add '/'
             sem_nm = "/"+sem_nm[4:]
-            # connect to semaphore
-            sem = ipc.Semaphore(sem_nm, ipc.O_CREAT)
-            # increment semaphore
-            sem.release()
-            # close semaphore
-            sem.close()
-
+            # connect to semaphore, unless it was removed since the glob
+            try: self._subs.append(ipc.Semaphore(sem_nm))
+            except ipc.ExistentialError: pass
 
     def load(self) -> bool:
         '''___________________________________________________________________
@@ -367,11 +639,7 @@ class Shm:
         self.read_meta_data()
 
         # mmap or dont, as metadata reflects
-        if self.mmap:
-            with open(self.fname, "rb+") as file_:
-                # get size of file to mmap
-                buf_len = os.fstat(file_.fileno()).st_size
-                self.buf = Mmap(file_.fileno(), buf_len, MAP_SHARED)
+        if self.mmap: self.buf = self._attach().map()
 
         return True
 
@@ -382,14 +650,10 @@ class Shm:
         sec_o = self.atime_offset
         nsec_o = sec_o + 8
         if self.mmap:
-            with self.lock:
-                sec = struct.unpack('Q', self.buf[sec_o:nsec_o])[0]
-                nsec = struct.unpack("Q", self.buf[nsec_o:nsec_o+8])[0]
+            sec, nsec = self._read_mmap(lambda: struct.unpack_from('2Q', self.buf, sec_o))
         else:
-            with self.lock, open(self.fname, "rb") as file_:
-                buf = file_.read()
-                sec = struct.unpack('Q', buf[sec_o:nsec_o])[0]
-                nsec = struct.unpack("Q", buf[nsec_o:nsec_o+8])[0]
+            with self.lock:
+                sec, nsec = struct.unpack('2Q', self._pread(16, sec_o))
 
         self.mtdata['atime_sec'] = sec
         self.mtdata['atime_nsec'] = nsec
@@ -401,12 +665,10 @@ class Shm:
         -------------------------------------------------------------- '''
         c0   = self.c0_offset
         if self.mmap: 
-            with self.lock:
-                cntr = struct.unpack('Q', self.buf[c0:c0+8])[0]
+            cntr = self._read_mmap(lambda: struct.unpack_from('Q', self.buf, c0)[0])
         else:
-            with self.lock, open(self.fname, "rb") as file_:
-                buf = file_.read()
-                cntr = struct.unpack('Q', buf[c0:c0+8])[0]
+            with self.lock:
+                cntr = struct.unpack('Q', self._pread(8, c0))[0]
 
         self.mtdata['cnt0'] = cntr
         return(cntr)
@@ -418,22 +680,20 @@ class Shm:
 
         offset = self.sz_offset
         if self.mmap: 
-            with self.lock:
-                # get most recent size
-                sz = struct.unpack('3H', self.buf[offset:offset+6])[:]
-                # get most recent naxis
-                nax = struct.unpack("B", self.buf[offset+6:offset+7])[0]
+            # get most recent size and naxis
+            sz, nax = self._read_mmap(lambda: (struct.unpack_from('3H', self.buf, offset),
+                struct.unpack_from("B", self.buf, offset+6)[0]))
         else:
-            with self.lock, open(self.fname, "rb") as file_:
-                buf = file_.read()
-                sz = struct.unpack('3H', buf[offset:offset+6])[:]
-                nax = struct.unpack("B", buf[offset+6:offset+7])[0]
+            with self.lock:
+                buf = self._pread(7, offset)
+            sz = struct.unpack_from('3H', buf)
+            nax = struct.unpack_from("B", buf, 6)[0]
 
         self.mtdata["size"] = sz
         self.mtdata["naxis"] = nax
         return(sz)
 
-    def get_data(self, check=False, reform=False):
+    def get_data(self, check=False, reform=False, copy=True, timeout:float=None):
         ''' --------------------------------------------------------------
         Returns the data part of the shared memory 
 
@@ -441,14 +701,19 @@ class Shm:
         ----------
         - check: integer (last index) if not False, waits image update
         - reform: boolean, if True, reshapes the array in a 2-3D format
-                    or into a string if dypte is <U1
+                    or into a string if dtype is <U1 or S1
+        - copy: boolean, if False and this shm is mmapped, returns a 
+                    read-only view backed directly by the mmap instead of
+                    a copy. The view is not protected by the lock, so its 
+                    contents will change as the shm is written to. Use 
+                    copy_into or copy=True if the data will be modified.
+        - timeout: seconds to wait for an update if check is set (None
+                    waits forever). Shm.TimeoutError is raised if there
+                    was no update in time.
         -------------------------------------------------------------- '''
 
         #wait for new data
-        if check: 
-            if self.sem is None: self.find_sem()
-
-            self.sem.acquire()
+        if check: self._acquire_sem(timeout)
 
         # try to get beginning of image
         try:
@@ -458,74 +723,315 @@ class Shm:
             self.load()
             i0 = self.im_offset
 
+        # reopen the file if it was replaced, before its size is used
+        self._revalidate()
         if self.mtdata["croppable"]:
             self.read_meta_data()
 
+        nel = self.mtdata["nel"]
         # short name for the end of the data
-        i1 = i0 + self.mtdata["nel"]*asize[self.mtdata["atype"]]
+        i1 = i0 + nel*self.npdtype.itemsize
         # short name for the cnt0 offset
         c0   = self.c0_offset
 
         #Use a context manager so lock is released if process is killed
-        if self.mmap:
-            with self.lock:
-                data = np.fromstring(self.buf[i0:i1],dtype=self.npdtype)
-                cntr = struct.unpack('Q', self.buf[c0:c0+8])[0]
+        if self.mmap and not copy:
+            data = self._view(nel)
+            cntr = self._read_mmap(lambda: struct.unpack_from('Q', self.buf, c0)[0])
+        elif self.mmap:
+            data, cntr = self._read_mmap(lambda: (np.frombuffer(self.buf, self.npdtype, nel, i0).copy(),
+                struct.unpack_from('Q', self.buf, c0)[0]))
         else:
-            with self.lock, open(self.fname, "rb") as file_:
-                buf = file_.read()
-                data = np.fromstring(buf[i0:i1],dtype=self.npdtype)
-                cntr = struct.unpack('Q', buf[c0:c0+8])[0]
+            # read from cnt0 to the end of the data in one go
+            with self.lock:
+                buf = self._pread(i1 - c0, c0)
+            data = np.frombuffer(buf, self.npdtype, nel, i0 - c0)
+            cntr = struct.unpack_from('Q', buf)[0]
 
         # update counter
         self.mtdata["cnt0"] = cntr
 
         # if requested, reshape data
         if reform:
-            if self.npdtype == "<U1":
-                data = ("{}"*self.mtdata["nel"]).format(*data)
+            if self.npdtype in STR_DTYPES:
+                data = _string(data)
             else:
-                rsz = self.mtdata['size'][:self.mtdata['naxis']]
-                # if there's an x and y axis, flip them (row, column vs width, height)
-                if self.mtdata['naxis'] >= 2:
-                    rsz = (rsz[1], rsz[0], *rsz[2:len(rsz)]) 
-                data = np.reshape(data, rsz)
+                data = np.reshape(data, self._shape())
 
         return data
 
-    def set_data(self, data:np.ndarray, atime:float=None):
+    def copy_into(self, out:np.ndarray, check=False, timeout:float=None):
+        ''' --------------------------------------------------------------
+        Copies the data part of the shared memory into an existing array,
+        avoiding the allocation done by get_data.
+
+        Parameters:
+        ----------
+        - out: a C-contiguous array of this shm's dtype with (at least) as
+                many elements as the shm currently holds. It may be 1D or
+                shaped as get_data(reform=True) would return.
+        - check: if True, waits for an image update as in get_data
+        - timeout: seconds to wait if check is set, as in get_data
+        Returns:
+        ----------
+        - np.ndarray: out, or a view of it, shaped as get_data(reform=True)
+                would shape it
+        -------------------------------------------------------------- '''
+
+        #wait for new data
+        if check: self._acquire_sem(timeout)
+
+        # try to get beginning of image
+        try:
+            i0 = self.im_offset
+        # Attribute Error means we haven't loaded the shm
+        except AttributeError:
+            self.load()
+            i0 = self.im_offset
+
+        # reopen the file if it was replaced, before its size is used
+        self._revalidate()
+        if self.mtdata["croppable"]:
+            self.read_meta_data()
+
+        nel = self.mtdata["nel"]
+        if out.dtype != self.npdtype:
+            raise ValueError("out must have dtype {}".format(self.npdtype))
+        if not out.flags.c_contiguous or out.size < nel:
+            raise ValueError("out must be C-contiguous with at least {} elements".format(nel))
+
+        # flat view of the part of out that will be written to
+        dest = out.reshape(-1)[:nel]
+        # short name for the cnt0 offset
+        c0   = self.c0_offset
+
+        if self.mmap:
+            def read():
+                np.copyto(dest, self._view(nel))
+                return struct.unpack_from('Q', self.buf, c0)[0]
+            cntr = self._read_mmap(read)
+        else:
+            fd = self._fileno()
+            with self.lock:
+                os.preadv(fd, [memoryview(dest).cast("B")], i0)
+                cntr = struct.unpack('Q', os.pread(fd, 8, c0))[0]
+
+        # update counter
+        self.mtdata["cnt0"] = cntr
+
+        if out.size == nel and out.shape == self._shape(): return out
+        return dest.reshape(self._shape())
+
+    def _acquire_sem(self, timeout:float=None):
+        ''' --------------------------------------------------------------
+        Waits for this instance's semaphore to be posted. Raises 
+        Shm.TimeoutError if it isn't posted within timeout seconds (None 
+        waits forever).
+        -------------------------------------------------------------- '''
+
+        if self.sem is None: self.find_sem()
+
+        try: self.sem.acquire(timeout)
+        except ipc.BusyError:
+            msg = "No update of {} in {} s.".format(self.fname, timeout)
+            raise Shm.TimeoutError(msg)
+
+    def wait_for_update(self, after:int=None, timeout:float=None) -> bool:
+        ''' --------------------------------------------------------------
+        Blocks until the counter of this shm differs from after, waking up 
+        on this instance's semaphore rather than polling.
+
+        Parameters:
+        ----------
+        - after: the counter to wait past. If None, the counter from the 
+            last read by this instance (mtdata["cnt0"]) is used. Read the
+            counter before triggering the update to avoid missing it.
+        - timeout: the maximum time to wait in seconds (None waits forever)
+        Returns:
+        ----------
+        - bool: True if the shm was updated, False if the wait timed out
+
+        If this instance has no semaphore, a subscriber semaphore is claimed
+        for the wait and released when it ends, so occasional waits (e.g.
+        from a GUI) don't hold one of the shm's 100 slots for the life of
+        the process.
+        -------------------------------------------------------------- '''
+
+        if after is None: after = self.mtdata["cnt0"]
+        if timeout is not None: end = monotonic() + timeout
+
+        # claim a semaphore before checking the counter so no update is missed
+        claimed = self.sem is None
+        if claimed: self.find_sem()
+        try:
+            # clear out posts from earlier updates, so every wake up below 
+            #   happened after the counter was checked
+            try:
+                while True: self.sem.acquire(0)
+            except ipc.BusyError: pass
+
+            while self.get_counter() == after:
+                if timeout is None: self.sem.acquire()
+                else:
+                    left = end - monotonic()
+                    if left <= 0: return False
+                    try: self.sem.acquire(left)
+                    except ipc.BusyError: pass
+
+            return True
+        finally:
+            if claimed: self._release_sem()
+
+    async def next_update(self, after:int=None, timeout:float=None) -> int:
+        ''' --------------------------------------------------------------
+        Coroutine version of wait_for_update. Waits without blocking the 
+        event loop until the counter of this shm differs from after. 
+
+        All shms awaited in one event loop share a single helper thread 
+        (see _AsyncWatcher).
+
+        Parameters:
+        ----------
+        - after: the counter to wait past (None uses mtdata["cnt0"])
+        - timeout: the maximum time to wait in seconds (None waits forever)
+        Returns:
+        ----------
+        - int: the new counter. Shm.TimeoutError is raised on timeout.
+        -------------------------------------------------------------- '''
+
+        if after is None: after = self.mtdata["cnt0"]
+
+        loop = asyncio.get_running_loop()
+        watcher = _AsyncWatcher.get(loop)
+        # subscribe before checking the counter so no update is missed
+        watcher.watch(self)
+
+        cntr = self.get_counter()
+        if cntr != after: return cntr
+
+        fut = loop.create_future()
+        watcher.waiters.append((self, after, fut))
+        try: return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            msg = "No update of {} in {} s.".format(self.fname, timeout)
+            raise Shm.TimeoutError(msg)
+
+    async def frames(self, reform=False):
+        ''' --------------------------------------------------------------
+        Asynchronous iterator over the data of this shm, yielding each 
+        time it is updated (starting with the next update):
+
+            async for data in shm.frames(): ...
+
+        Updates that happen while the caller is busy are coalesced, only 
+        the latest data is returned. Use a RingShm to get every frame.
+
+        Parameters:
+        ----------
+        - reform: if True, data is reshaped as in get_data
+        -------------------------------------------------------------- '''
+
+        while True:
+            await self.next_update()
+            # get_data updates mtdata["cnt0"] to the counter of the data
+            yield self.get_data(reform=reform)
+
+    def _read_mmap(self, read):
+        ''' --------------------------------------------------------------
+        Performs a read from the mmap, either under the lock or, if this
+        instance uses seqlock, without it. Seqlock reads are retried if a
+        write happened during the read and fall back to the lock if the
+        shm is busy for SEQ_RETRIES attempts or the writer doesn't support
+        seqlock.
+
+        Parameters:
+        ----------
+        - read: a function with no arguments that reads from self.buf
+        Returns:
+        ----------
+        - whatever read returns
+        -------------------------------------------------------------- '''
+
+        self._revalidate()
+        if self.seqlock:
+            so = self.seq_offset
+            c0 = self.c0_offset
+            for _ in range(SEQ_RETRIES):
+                seq = struct.unpack_from('H', self.buf, so)[0]
+                # a write is in progress
+                if seq & 1: continue
+                # writer doesn't bump seq so we can't trust it
+                if seq == 0 and struct.unpack_from('Q', self.buf, c0)[0] != 0: break
+                res = read()
+                # if seq didn't change, no write happened during the read
+                if struct.unpack_from('H', self.buf, so)[0] == seq: return res
+
+        with self.lock:
+            return read()
+
+    def _shape(self, size:tuple=None, naxis:int=None) -> tuple:
+        ''' --------------------------------------------------------------
+        Returns the shape that get_data(reform=True) gives to the data
+
+        Parameters:
+        ----------
+        - size: the size to use instead of the one in mtdata
+        - naxis: the naxis to use instead of the one in mtdata
+        -------------------------------------------------------------- '''
+
+        if size is None: size = self.mtdata['size']
+        if naxis is None: naxis = self.mtdata['naxis']
+
+        rsz = size[:naxis]
+        # if there's an x and y axis, flip them (row, column vs width, height)
+        if naxis >= 2:
+            rsz = (rsz[1], rsz[0], *rsz[2:len(rsz)]) 
+        return tuple(rsz)
+
+    def _view(self, nel:int) -> np.ndarray:
+        ''' --------------------------------------------------------------
+        Returns a flat, read-only array backed by the mmap. The view is
+        cached and only rebuilt when the number of elements changes.
+
+        Parameters:
+        ----------
+        - nel: the number of elements the view should cover
+        -------------------------------------------------------------- '''
+
+        if self._mview is None or self._mview.size != nel:
+            self._mview = np.frombuffer(self.buf, self.npdtype, nel, self.im_offset)
+            self._mview.flags.writeable = False
+        return self._mview
+
+    def set_data(self, data:np.ndarray, atime:float=None, cnt0:int=None):
         ''' --------------------------------------------------------------
         Upload new data to the SHM file.
 
         Parameters:
         ----------
-        - data:  the array to upload to SHM
-        - time:  the time (UNIX epoch seconds) that the data was acquired
+        - data:  the array to upload to SHM. Strings are converted to
+                    this shm's string dtype.
+        - time:  the time (UNIX epoch seconds) that the data was acquired,
+                    or a (sec, nsec) tuple to store it exactly
+        - cnt0:  the counter to store instead of incrementing the current
+                    one (e.g. to mirror another shm)
         Note:
         ----
         -------------------------------------------------------------- '''
 
-        # if a string as passed in, convert it to a numpy array
-        if type(data) is str:
-            data = np.array([char for char in data], np.dtype("<U1"))
-        # if array of strings, break into array of chars
-        elif str(data.dtype).find("<U") == 0 and str(data.dtype) != "<U1":
-            # in this case, we have a string but it's not broken into chars
-            # so reform array into string
-            nel = 1
-            for dim in data.shape:
-                if dim != 0: nel *= dim
-            data.reshape((nel,))
-            data = ("{}"*nel).format(*data) 
-            # and then put back in an array
-            data = np.array([char for char in data], np.dtype("<U1")) 
+        # if a string or array of strings was passed in, break it into chars
+        if isinstance(data, (str, bytes)) or data.dtype.kind in "US":
+            dtype = self.npdtype if self.npdtype in STR_DTYPES else STR_DTYPES[0]
+            data = _chars(data, dtype)
        
         #We want to keep acquired time current so get time if none was provided
         if atime is None: atime = time()
-        #get the seconds part of the time
-        sec = int(atime)
-        #get the nanoseconds part of the time
-        nsec = int((atime%1) * 10**9)
+        if isinstance(atime, tuple): sec, nsec = atime
+        else:
+            #get the seconds part of the time
+            sec = int(atime)
+            #get the nanoseconds part of the time
+            nsec = int((atime%1) * 10**9)
 
         resize = False
         # if the size of the new data doesn't match current size, change it
@@ -551,7 +1057,7 @@ class Shm:
         # start of the data
         i0 = self.im_offset
         # end of the data
-        i1 = i0 + self.mtdata["nel"]*asize[self.mtdata["atype"]] 
+        i1 = i0 + self.mtdata["nel"]*self.npdtype.itemsize
         # start of cnt0
         c0 = self.c0_offset
         # start of atime
@@ -559,13 +1065,19 @@ class Shm:
 
         if self.mmap:
             with self.lock:
+                # make seq odd to tell seqlock readers that a write is in progress
+                so = self.seq_offset
+                seq = struct.unpack_from('H', self.buf, so)[0]
+                if not seq & 1: seq += 1
+                struct.pack_into('H', self.buf, so, seq)
                 # write the data
                 self.buf[i0:i1] = data.tostring()
                 # write the two atime parts
                 self.buf[at:at+8] = struct.pack('Q', sec)
                 self.buf[at+8:at+16] = struct.pack('Q', nsec)
                 # get last cnt0
-                cntr = struct.unpack('Q', self.buf[c0:c0+8])[0] + 1
+                if cnt0 is None: cntr = struct.unpack('Q', self.buf[c0:c0+8])[0] + 1
+                else: cntr = cnt0
                 # write cnt0 increment
                 self.buf[c0:c0+8]   = struct.pack('Q', cntr)
                 # if necessary, write size and nel
@@ -573,27 +1085,25 @@ class Shm:
                     # nel is the 4 bytes before size
                     self.buf[self.sz_offset-4:self.sz_offset] = struct.pack("I", self.mtdata["nel"])
                     self.buf[self.sz_offset:self.sz_offset+6] = struct.pack("3H", *self.mtdata["size"])
+                # make seq even again (skipping 0) to mark the write as done
+                struct.pack_into('H', self.buf, so, ((seq + 1) & 0xFFFF) or 2)
         else:
-            with self.lock, open(self.fname, "rb+") as file_:
-                # get file contents
-                buf = list(file_.read())
-                # write the data
-                buf[i0:i1] = data.tostring()
-                # write the two atime parts
-                buf[at:at+8] = struct.pack('Q', sec)
-                buf[at+8:at+16] = struct.pack('Q', nsec)
+            fd = self._fileno()
+            # only the changed parts of the file are written
+            data = np.ascontiguousarray(data)
+            with self.lock:
                 # get last cnt0
-                cntr = struct.unpack('Q', bytes(buf)[c0:c0+8])[0] + 1
-                # write cnt0 increment
-                buf[c0:c0+8]   = struct.pack('Q', cntr)
+                if cnt0 is None: cntr = struct.unpack('Q', os.pread(fd, 8, c0))[0] + 1
+                else: cntr = cnt0
+                # write the data
+                os.pwrite(fd, memoryview(data).cast("B"), i0)
+                # write atime and cnt0 increment (they're adjacent)
+                os.pwrite(fd, struct.pack('3Q', sec, nsec, cntr), at)
                 # if necessary, write size and nel
                 if resize:
                     # nel is the 4 bytes before size
-                    buf[self.sz_offset-4:self.sz_offset] = struct.pack("I", self.mtdata["nel"])
-                    buf[self.sz_offset:self.sz_offset+6] = struct.pack("3H", *self.mtdata["size"])
-                # write updates
-                file_.seek(0)
-                file_.write(bytes(buf))
+                    os.pwrite(fd, struct.pack("I3H", self.mtdata["nel"], *self.mtdata["size"]),
+                        self.sz_offset-4)
 
         #update metadata
         self.mtdata['atime_sec'] = sec
@@ -604,5 +1114,550 @@ class Shm:
 
         return
 
+class RingShm(Shm):
+    ''' ------------------------------------------------------------------
+    A shared memory that holds the last N frames written to it instead of
+    just the latest one. Each slot carries its own counter and atime, so a 
+    reader can ask for every frame since the last one it has seen.
+
+    Ring buffers are always mmapped. Slots are read without the lock: a 
+    writer zeroes a slot's counter before overwriting it, so a frame that 
+    is overwritten while being read is detected and dropped.
+    ------------------------------------------------------------------ '''
+
+    def __init__(self, fname:str, data:np.ndarray=None, nslots:int=16, 
+                 croppable:bool=False, sem:bool=False):
+        ''' --------------------------------------------------------------
+        Constructor for a ring buffer SHM object.
+
+        Parameters:
+        ----------
+        - fname: name of the shared memory file structure
+        - data: an array the size of the largest frame to be stored. If an 
+            existing file backing is pointed to by fname, data will be ignored
+        - nslots: the number of frames to keep (ignored if file exists)
+        - croppable: whether frames smaller than data can be stored
+        - sem: whether this instance of the shm should create a semaphore
+        -------------------------------------------------------------- '''
+
+        self.nslots = nslots
+        super().__init__(fname, data, mmap=True, croppable=croppable, sem=sem,
+                         seqlock=True)
+
+    def _payload(self, data:np.ndarray) -> bytes:
+        ''' --------------------------------------------------------------
+        Returns the ring header, empty slot headers, and empty slots
+
+        Parameters:
+        ----------
+        - data: an array the size of the largest frame to be stored
+        -------------------------------------------------------------- '''
+
+        # keep slots 8-byte aligned
+        stride = -(-data.nbytes // 8) * 8
+        return struct.pack(ring_fmt, RING_MAGIC, self.nslots, stride) \
+            + bytes(struct.calcsize(slot_fmt)*self.nslots + stride*self.nslots)
+
+    def read_meta_data(self):
+        ''' --------------------------------------------------------------
+        Reads the metadata and the ring header.
+        -------------------------------------------------------------- '''
+
+        super().read_meta_data()
+
+        rlen = struct.calcsize(ring_fmt)
+        ring_hdr = self._pread(rlen, self.im_offset)
+        # plain shms can have less data than a ring header
+        if len(ring_hdr) < rlen:
+            raise Shm.ExistentialError("{} is not a ring buffer.".format(self.fname))
+        magic, self.nslots, self.stride = struct.unpack(ring_fmt, ring_hdr)
+        if magic != RING_MAGIC:
+            raise Shm.ExistentialError("{} is not a ring buffer.".format(self.fname))
+
+        # offset of the first slot header and of the first slot
+        self.slot_offset = self.im_offset + rlen
+        self.slot_len = struct.calcsize(slot_fmt)
+        self.data_offset = self.slot_offset + self.slot_len*self.nslots
+
+    def _read_slot(self, cnt:int, out:np.ndarray=None):
+        ''' --------------------------------------------------------------
+        Reads the frame with the given counter if it is still in the ring
+
+        Parameters:
+        ----------
+        - cnt: the counter of the frame to read (1 is the first frame)
+        - out: if not None, an array to copy the frame into
+        Returns:
+        ----------
+        - (np.ndarray, float, tuple): the flat frame, its atime, and the shape
+            it should be given, or None if the frame has been overwritten
+        -------------------------------------------------------------- '''
+
+        idx = (cnt - 1) % self.nslots
+        so = self.slot_offset + idx*self.slot_len
+        c0, sec, nsec, nel, *size, naxis = struct.unpack_from(slot_fmt, self.buf, so)
+        if c0 != cnt: return None
+
+        i0 = self.data_offset + idx*self.stride
+        frame = np.frombuffer(self.buf, self.npdtype, nel, i0)
+        if out is None: frame = frame.copy()
+        else:
+            if out.dtype != self.npdtype or not out.flags.c_contiguous or out.size < nel:
+                raise ValueError("out must be C-contiguous with dtype {} and at least {} elements".format(
+                    self.npdtype, nel))
+            np.copyto(out.reshape(-1)[:nel], frame)
+            frame = out.reshape(-1)[:nel]
+
+        # if the counter changed, the slot was overwritten while we were reading
+        if struct.unpack_from('Q', self.buf, so)[0] != cnt: return None
+
+        return frame, sec + nsec*(10**(-9)), self._shape(size, naxis)
+
+    def get_since(self, cnt:int=None, check=False, reform=True, timeout:float=None):
+        ''' --------------------------------------------------------------
+        Returns every frame written since the given counter that is still
+        in the ring.
+
+        Parameters:
+        ----------
+        - cnt: the counter of the last frame already seen. If None, the
+            counter of the last frame returned by this instance is used, 
+            so consecutive calls return consecutive frames.
+        - check: if True, waits until there's at least one new frame
+        - reform: if True, frames are reshaped as in Shm.get_data
+        - timeout: seconds to wait if check is set (None waits forever). If
+            nothing was written in time, no frames are returned.
+        Returns:
+        ----------
+        - (list, np.ndarray, np.ndarray): the frames, their counters, and 
+            their atimes. Frames that were overwritten before they could be 
+            read show up as gaps in the counters.
+        -------------------------------------------------------------- '''
+
+        if cnt is None: cnt = self.mtdata["cnt0"]
+
+        head = self.get_counter()
+        # the ring was recreated since cnt was read
+        if head < cnt: cnt = 0
+
+        if check and head <= cnt:
+            self.wait_for_update(cnt, timeout)
+            head = self.mtdata["cnt0"]
+
+        frames, cnts, times = [], [], []
+        for c in range(max(cnt + 1, head - self.nslots + 1), head + 1):
+            slot = self._read_slot(c)
+            if slot is None: continue
+            frame, atime, shape = slot
+            frames.append(np.reshape(frame, shape) if reform else frame)
+            cnts.append(c)
+            times.append(atime)
+
+        # remember the last frame returned
+        self.mtdata["cnt0"] = head
+
+        return frames, np.array(cnts, np.uint64), np.array(times)
+
+    def get_data(self, check=False, reform=False, copy=True, timeout:float=None):
+        ''' --------------------------------------------------------------
+        Returns the latest frame in the ring
+
+        Parameters:
+        ----------
+        - check: if True, waits for a new frame
+        - reform: boolean, if True, reshapes the frame in a 2-3D format
+        - copy: ignored, frames in the ring are always copied
+        - timeout: seconds to wait if check is set, as in Shm.get_data
+        -------------------------------------------------------------- '''
+
+        if check: self._acquire_sem(timeout)
+
+        # if a frame is overwritten mid read, the next one will be newer
+        slot = None
+        while slot is None:
+            cntr = self.get_counter()
+            if cntr == 0: return np.zeros(0, self.npdtype)
+            slot = self._read_slot(cntr)
+
+        frame, _, shape = slot
+        return np.reshape(frame, shape) if reform else frame
+
+    def copy_into(self, out:np.ndarray, check=False, timeout:float=None):
+        ''' --------------------------------------------------------------
+        Copies the latest frame in the ring into an existing array
+
+        Parameters:
+        ----------
+        - out: a C-contiguous array of this shm's dtype with at least as 
+            many elements as the largest frame in the ring
+        - check: if True, waits for a new frame
+        - timeout: seconds to wait if check is set, as in Shm.get_data
+        Returns:
+        ----------
+        - np.ndarray: a view of out, shaped as get_data(reform=True) would 
+            shape the frame
+        -------------------------------------------------------------- '''
+
+        if check: self._acquire_sem(timeout)
+
+        slot = None
+        while slot is None:
+            cntr = self.get_counter()
+            if cntr == 0: return out.reshape(-1)[:0]
+            slot = self._read_slot(cntr, out)
+
+        frame, _, shape = slot
+        return frame.reshape(shape)
+
+    async def frames(self, reform=True):
+        ''' --------------------------------------------------------------
+        Asynchronous iterator over every frame written to the ring from 
+        now on (see Shm.frames). Frames are only missed if the caller 
+        falls more than nslots frames behind.
+
+        Parameters:
+        ----------
+        - reform: if True, frames are reshaped as in Shm.get_data
+        -------------------------------------------------------------- '''
+
+        while True:
+            cnt = self.mtdata["cnt0"]
+            await self.next_update(cnt)
+            frames, _, _ = self.get_since(cnt, reform=reform)
+            for frame in frames: yield frame
+
+    def set_data(self, data:np.ndarray, atime:float=None):
+        ''' --------------------------------------------------------------
+        Writes a new frame to the next slot of the ring
+
+        Parameters:
+        ----------
+        - data:  the frame to write. Must not have more elements than
+            the ring was created with
+        - atime: the time (UNIX epoch seconds) that the data was acquired
+        -------------------------------------------------------------- '''
+
+        if atime is None: atime = time()
+        sec = int(atime)
+        nsec = int((atime%1) * 10**9)
+
+        # size follows the (width, height) convention of Shm.set_data
+        sz = list(data.shape[:3])
+        if len(sz) >= 2: sz[0], sz[1] = sz[1], sz[0]
+        sz += [0]*(3-len(sz))
+
+        if data.size > self.mtdata["nel"] or \
+            (not self.mtdata["croppable"] and data.size != self.mtdata["nel"]):
+            raise ValueError("Frame of {} elements doesn't fit in ring of {}.".format(
+                data.size, self.mtdata["nel"]))
+
+        data = np.ascontiguousarray(data, self.npdtype)
+
+        c0 = self.c0_offset
+        at = self.atime_offset
+        so = self.seq_offset
+        with self.lock:
+            cntr = struct.unpack_from('Q', self.buf, c0)[0] + 1
+            idx = (cntr - 1) % self.nslots
+            slot = self.slot_offset + idx*self.slot_len
+            i0 = self.data_offset + idx*self.stride
+            # invalidate the slot so readers know it's being overwritten
+            struct.pack_into('Q', self.buf, slot, 0)
+            np.copyto(np.frombuffer(self.buf, self.npdtype, data.size, i0), data.reshape(-1))
+            struct.pack_into(slot_fmt[2:], self.buf, slot+8, sec, nsec, data.size, *sz, data.ndim)
+            # the slot is valid again
+            struct.pack_into('Q', self.buf, slot, cntr)
+
+            # update the header, bumping seq for seqlock readers
+            seq = struct.unpack_from('H', self.buf, so)[0]
+            if not seq & 1: seq += 1
+            struct.pack_into('H', self.buf, so, seq)
+            struct.pack_into('3Q', self.buf, at, sec, nsec, cntr)
+            struct.pack_into('H', self.buf, so, ((seq + 1) & 0xFFFF) or 2)
+
+        self.mtdata['atime_sec'] = sec
+        self.mtdata['atime_nsec'] = nsec
+        self.mtdata["cnt0"] = cntr
+
+        self.post_sems()
+
+class ShmMux:
+    ''' ------------------------------------------------------------------
+    Waits for updates to any of several shms with a single semaphore. 
+
+    For each shm added, a subscriber name (/<imname>_semXX) is hard linked 
+    to the backing of the mux's semaphore in SEM_DIR, so every writer posts
+    the mux semaphore directly. If linking isn't possible, the shm gets its 
+    own semaphore and a helper thread that forwards its posts.
+
+    ShmMux can be used wherever a semaphore fed by linksem was used:
+    acquire() blocks until something was posted and release() wakes a 
+    waiter (e.g. from a signal handler).
+    ------------------------------------------------------------------ '''
+
+    def __init__(self):
+        ''' --------------------------------------------------------------
+        Creates the semaphore the shms will be multiplexed into.
+        -------------------------------------------------------------- '''
+
+        self.sem = ipc.Semaphore(None, flags = ipc.O_CREX)
+        self.shms = []
+        # the counter of each shm the last time changed() was called
+        self._seen = {}
+        # the subscriber name linked to self.sem for each shm, by id
+        self._links = {}
+
+        register(self.close)
+
+    def add(self, shm:Shm):
+        ''' --------------------------------------------------------------
+        Subscribes the mux to updates of shm.
+        -------------------------------------------------------------- '''
+
+        src = SEM_DIR + "/sem." + self.sem.name[1:]
+        for x in range(0, 100):
+            link = "{}/sem.{}_sem{:02d}".format(SEM_DIR, shm.mtdata["imname"], x)
+            try: 
+                os.link(src, link)
+                self._links[id(shm)] = link
+                break
+            except FileExistsError: pass
+            except OSError:
+                # semaphores aren't stored as expected, so forward the shm's
+                #   own semaphore instead
+                if shm.sem is None: shm.find_sem()
+                Thread(target = self._forward, args = (shm.sem,), 
+                       daemon = True).start()
+                break
+        else: 
+            msg = "No free Semaphore available. Please clean processes."
+            raise Shm.SemaphoreError(msg)
+
+        self.shms.append(shm)
+        self._seen[id(shm)] = shm.mtdata["cnt0"]
+
+    def remove(self, shm:Shm):
+        ''' --------------------------------------------------------------
+        Unsubscribes the mux from updates of shm (e.g. before replacing it
+        with a Shm of a recreated file). The shm isn't closed.
+        -------------------------------------------------------------- '''
+
+        link = self._links.pop(id(shm), None)
+        if link is not None:
+            try: os.remove(link)
+            except OSError as ouch: 
+                info("Exception on remove: {}".format(ouch))
+
+        self.shms = [other for other in self.shms if other is not shm]
+        self._seen.pop(id(shm), None)
+
+    def _forward(self, sem):
+        '''Posts the mux semaphore whenever sem is posted (as linksem does)'''
+
+        try:
+            while True:
+                sem.acquire()
+                if self.sem.value < 1: self.sem.release()
+        except ipc.ExistentialError: pass
+
+    def acquire(self, timeout:float=None) -> bool:
+        ''' --------------------------------------------------------------
+        Waits until one of the shms is updated or release is called. Posts
+           that arrived before the wait finished are consumed, so several 
+           updates only wake the caller once.
+
+        Inputs:
+            timeout = seconds to wait for (None waits forever)
+        Returns:
+            bool = False if the wait timed out, True otherwise
+        -------------------------------------------------------------- '''
+
+        try: self.sem.acquire(timeout)
+        except ipc.BusyError: return False
+        # a signal interrupted the wait, wake up as release would
+        except ipc.SignalError: return True
+
+        # drain any other posts
+        try:
+            while True: self.sem.acquire(0)
+        except ipc.BusyError: pass
+
+        return True
+
+    def release(self):
+        '''Wakes up a process waiting in acquire or wait'''
+
+        self.sem.release()
+
+    def changed(self) -> list:
+        ''' --------------------------------------------------------------
+        Returns the shms whose counters changed since the last call (or
+           since they were added)
+        -------------------------------------------------------------- '''
+
+        changed = []
+        for shm in self.shms:
+            # leave shm.mtdata["cnt0"] alone, callers compare against it
+            cnt0 = shm.mtdata["cnt0"]
+            try: cnt = shm.get_counter()
+            except (OSError, ValueError): continue
+            finally: shm.mtdata["cnt0"] = cnt0
+
+            if cnt != self._seen[id(shm)]:
+                self._seen[id(shm)] = cnt
+                changed.append(shm)
+
+        return changed
+
+    def wait(self, timeout:float=None) -> list:
+        ''' --------------------------------------------------------------
+        Waits until one of the shms is updated (see acquire) and returns 
+           the shms that changed. The list is empty if the wait timed out 
+           or was interrupted by release.
+        -------------------------------------------------------------- '''
+
+        if not self.acquire(timeout): return []
+        return self.changed()
+
+    def close(self):
+        ''' --------------------------------------------------------------
+        Removes the subscriber names and the mux semaphore.
+        -------------------------------------------------------------- '''
+
+        for link in self._links.values():
+            try: os.remove(link)
+            except Exception as ouch: 
+                info("Exception on close: {}".format(ouch))
+        self._links = {}
+
+        try: 
+            self.sem.unlink()
+            self.sem.close()
+        except Exception as ouch: 
+            info("Exception on close: {}".format(ouch))
+
+        unregister(self.close)
+
+class ShmGroup:
+    ''' ------------------------------------------------------------------
+    Reads a set of shms as one consistent snapshot.
+
+    Each snapshot reads the counters of all members, rereads the data of 
+    the members whose counters changed since the last snapshot, and then 
+    checks the counters again. If a member was written to in the meantime
+    the pass is repeated, so the values returned were all current at the 
+    same moment.
+    ------------------------------------------------------------------ '''
+
+    def __init__(self, shms:dict):
+        ''' --------------------------------------------------------------
+        Parameters:
+        ----------
+        - shms: a dictionary of names to Shm objects (or to the file names
+            of shms, which will be opened)
+        -------------------------------------------------------------- '''
+
+        self.shms = {name: shm if isinstance(shm, Shm) else Shm(shm) 
+                     for (name, shm) in shms.items()}
+        # the counter and data of each member as of the last snapshot
+        self._cnts = {name: None for name in self.shms}
+        self._data = {}
+
+    def _counters(self) -> dict:
+        '''Returns the current counter of every member'''
+
+        return {name: shm.get_counter() for (name, shm) in self.shms.items()}
+
+    def snapshot(self) -> dict:
+        ''' --------------------------------------------------------------
+        Returns a dictionary of names to the data of each member. 
+
+        Data of unchanged members is reused between snapshots, so the 
+           arrays are read-only; copy them before modifying.
+
+        If the members keep changing, the last pass is returned after 
+           SEQ_RETRIES attempts.
+        -------------------------------------------------------------- '''
+
+        cnts = self._counters()
+        for _ in range(SEQ_RETRIES):
+            for (name, shm) in self.shms.items():
+                if cnts[name] != self._cnts[name]:
+                    data = shm.get_data()
+                    data.flags.writeable = False
+                    self._data[name] = data
+                    # counter read together with the data
+                    self._cnts[name] = shm.mtdata["cnt0"]
+
+            # consistent if nothing changed while we were reading
+            cnts = self._counters()
+            if cnts == self._cnts: break
+
+        return dict(self._data)
+
+class _AsyncWatcher:
+    ''' ------------------------------------------------------------------
+    Wakes up the coroutines of one event loop that are waiting for shm 
+    updates (see Shm.next_update). Every shm awaited in the loop is added
+    to one ShmMux, which a single helper thread waits on. When it's posted,
+    the waiters are checked against their shm's counter in the loop.
+    ------------------------------------------------------------------ '''
+
+    # the watcher of each event loop
+    _watchers = WeakKeyDictionary()
+
+    @classmethod
+    def get(cls, loop:asyncio.AbstractEventLoop):
+        '''Returns the watcher of loop, starting one if needed'''
+
+        if loop not in cls._watchers: cls._watchers[loop] = cls(loop)
+        return cls._watchers[loop]
+
+    def __init__(self, loop:asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.mux = ShmMux()
+        # ids of the shms added to the mux
+        self._watched = set()
+        # (shm, counter to wait past, future) of every waiting coroutine
+        self.waiters = []
+
+        Thread(target = self._run, daemon = True).start()
+
+    def watch(self, shm:Shm):
+        '''Makes sure updates of shm wake up the helper thread'''
+
+        if id(shm) not in self._watched:
+            self.mux.add(shm)
+            self._watched.add(id(shm))
+
+    def _run(self):
+        '''Helper thread: hands every wake up of the mux to the loop'''
+
+        while True:
+            self.mux.acquire()
+            # the loop was closed
+            try: self.loop.call_soon_threadsafe(self._dispatch)
+            except RuntimeError: break
+
+    def _dispatch(self):
+        '''Resolves the futures whose shms were updated (runs in the loop)'''
+
+        cnts = {}
+        waiting = []
+        for (shm, after, fut) in self.waiters:
+            # cancelled or timed out
+            if fut.done(): continue
+
+            try:
+                if id(shm) not in cnts: cnts[id(shm)] = shm.get_counter()
+            except OSError as ouch: 
+                fut.set_exception(ouch)
+                continue
+
+            if cnts[id(shm)] != after: fut.set_result(cnts[id(shm)])
+            else: waiting.append((shm, after, fut))
+
+        self.waiters = waiting
+
 # =================================================================
 # =================================================================
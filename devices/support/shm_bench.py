@@ -0,0 +1,280 @@
+'''---------------------------------------------------------------------------
+Benchmarks for KPIC_shmlib
+
+Usage: python shm_bench.py [-n ITERATIONS] [-d DIRECTORY] [-s SUBSCRIBERS]
+                           [-r READERS] [--cpp BINARY] [-o OUTPUT]
+
+KPIC_shmlib must be importable (e.g. PYTHONPATH=Python). Shms are created in
+DIRECTORY (default /tmp/shm_bench) and deleted when the benchmark is done.
+
+Measures the latency of set_data, get_data, copy_into and get_counter for
+payloads from one element to a full 640x512 int16 frame, for file-backed,
+mmapped, and mmapped seqlock shms. set_data is also measured with 0 to
+SUBSCRIBERS semaphore subscribers, and both sides with 0 to READERS other
+processes reading the shm in a loop. If the C++ benchmark is built (make
+shm_bench_cpp), the same shms are read and written through KPIC_shmlib.cpp.
+
+A table is printed to stderr and the results are written as JSON to OUTPUT
+(stdout by default), so that runs can be compared between shmlib versions.
+---------------------------------------------------------------------------'''
+
+from argparse import ArgumentParser
+from time import perf_counter, time, sleep
+from datetime import datetime
+from multiprocessing import Process, Event
+import os, sys, struct, json, platform, subprocess
+
+import numpy as np
+
+from KPIC_shmlib import Shm
+
+# payloads to measure: one element up to a full frame of the tracking camera
+SIZES = {"1": (1,), "256": (256,), "128x128": (128, 128), "640x512": (512, 640)}
+DTYPE = np.dtype(np.int16)
+
+# ways of accessing the shm: (mmap the shm, read with seqlock)
+MODES = {"file": (False, False), "mmap": (True, False), "seqlock": (True, True)}
+
+def legacy_set_data(shm:Shm, data:np.ndarray):
+    '''Writes data to a non-mmapped shm the way Shm.set_data did before
+    positional writes: by reading the whole file into a list, splicing in
+    the changes, and writing the whole file back.'''
+
+    atime = time()
+    sec = int(atime)
+    nsec = int((atime%1) * 10**9)
+
+    i0 = shm.im_offset
+    i1 = i0 + data.nbytes
+    c0 = shm.c0_offset
+    at = shm.atime_offset
+
+    with shm.lock, open(shm.fname, "rb+") as file_:
+        buf = list(file_.read())
+        buf[i0:i1] = data.tobytes()
+        buf[at:at+8] = struct.pack('Q', sec)
+        buf[at+8:at+16] = struct.pack('Q', nsec)
+        cntr = struct.unpack('Q', bytes(buf)[c0:c0+8])[0] + 1
+        buf[c0:c0+8] = struct.pack('Q', cntr)
+        file_.seek(0)
+        file_.write(bytes(buf))
+
+    shm.mtdata["cnt0"] = cntr
+    shm.post_sems()
+
+def time_calls(func, n:int) -> np.ndarray:
+    '''Calls func n times and returns the duration of each call in seconds'''
+
+    times = np.empty(n)
+    for i in range(n):
+        start = perf_counter()
+        func()
+        times[i] = perf_counter() - start
+    return times
+
+def record(bench:str, op:str, times:np.ndarray, nbytes:int, size:str,
+           mode:str, lang:str="python", subs:int=0, readers:int=0) -> dict:
+    '''Summarizes the durations (in s) of n calls as one result. Times from
+    other programs can be passed as a dict with median_us and p99_us.'''
+
+    if isinstance(times, dict):
+        n = None
+        median, p99, mean = times["median_us"], times["p99_us"], None
+    else:
+        n = len(times)
+        median, p99, mean = np.percentile(times*1e6, [50, 99]).tolist() + \
+            [float(np.mean(times)*1e6)]
+
+    return {"bench": bench, "op": op, "lang": lang, "size": size,
+            "nbytes": nbytes, "mode": mode, "subs": subs, "readers": readers,
+            "n": n, "median_us": median, "p99_us": p99, "mean_us": mean,
+            "mb_per_s": nbytes / median if median else None}
+
+def print_record(rec:dict):
+    '''Prints one result as a row of the table on stderr'''
+
+    print("{bench:<12}{op:<16}{lang:<8}{size:<10}{mode:<9}{subs:>5}{readers:>8}"
+          "{median_us:>12.1f}{p99_us:>12.1f}".format(**rec), file = sys.stderr)
+
+def make_shm(dir_:str, name:str, shape:tuple, mmap:bool) -> tuple:
+    '''Creates a shm of the given shape in dir_ and returns it with its data'''
+
+    fname = "{}/{}.shm".format(dir_, name)
+    if os.path.isfile(fname): os.remove(fname)
+    data = np.arange(np.prod(shape), dtype = DTYPE).reshape(shape)
+    return Shm(fname, data = data, mmap = mmap), data
+
+def remove_shm(*shms:Shm):
+    '''Closes shms and deletes their file (they must share one file)'''
+
+    for shm in shms: shm.close()
+    os.remove(shms[0].fname)
+
+def bench_ops(dir_:str, n:int) -> list:
+    '''Times each operation for every payload size and access mode'''
+
+    results = []
+    for size, shape in SIZES.items():
+        for mode, (mmap, seqlock) in MODES.items():
+            writer, data = make_shm(dir_, "ops", shape, mmap)
+            # readers and writers are usually different instances
+            reader = Shm(writer.fname, seqlock = seqlock)
+            out = np.empty(shape, DTYPE)
+            ops = {"set_data": lambda: writer.set_data(data),
+                   "get_data": lambda: reader.get_data(),
+                   "copy_into": lambda: reader.copy_into(out),
+                   "get_counter": lambda: reader.get_counter()}
+            if mmap:
+                ops["get_data_view"] = lambda: reader.get_data(copy = False)
+            try:
+                for op, func in ops.items():
+                    nbytes = 8 if op == "get_counter" else data.nbytes
+                    results.append(record("ops", op, time_calls(func, n),
+                        nbytes, size, mode))
+                    print_record(results[-1])
+            finally:
+                remove_shm(writer, reader)
+    return results
+
+def bench_legacy(dir_:str, n:int) -> list:
+    '''Times the legacy full-file rewrite that set_data replaced, for
+    comparison with the file mode of bench_ops'''
+
+    results = []
+    for size in ("1", "640x512"):
+        shm, data = make_shm(dir_, "legacy", SIZES[size], False)
+        try:
+            times = time_calls(lambda: legacy_set_data(shm, data), n)
+        finally:
+            remove_shm(shm)
+        results.append(record("legacy", "set_data", times, data.nbytes, size, "file"))
+        print_record(results[-1])
+    return results
+
+def bench_subscribers(dir_:str, n:int, max_subs:int) -> list:
+    '''Times set_data of a full frame with 0 to max_subs semaphore
+    subscribers to post'''
+
+    counts = sorted({0, 1, max_subs} | {2**i for i in range(max_subs.bit_length())})
+    counts = [cnt for cnt in counts if cnt <= max_subs]
+
+    results = []
+    for mode in ("file", "mmap"):
+        writer, data = make_shm(dir_, "subs", SIZES["640x512"], MODES[mode][0])
+        subs = []
+        try:
+            for cnt in counts:
+                while len(subs) < cnt: subs.append(Shm(writer.fname, sem = True))
+                times = time_calls(lambda: writer.set_data(data), n)
+                results.append(record("subscribers", "set_data", times,
+                    data.nbytes, "640x512", mode, subs = cnt))
+                print_record(results[-1])
+        finally:
+            remove_shm(writer, *subs)
+    return results
+
+def read_loop(fname:str, seqlock:bool, stop):
+    '''Reads the shm at fname until stop is set (run in a child process)'''
+
+    shm = Shm(fname, seqlock = seqlock)
+    while not stop.is_set(): shm.get_data()
+    shm.close()
+
+def bench_contention(dir_:str, n:int, max_readers:int) -> list:
+    '''Times set_data and get_data of a full frame while 0 to max_readers
+    other processes read the shm as fast as they can'''
+
+    results = []
+    for mode, (mmap, seqlock) in MODES.items():
+        writer, data = make_shm(dir_, "contention", SIZES["640x512"], mmap)
+        reader = Shm(writer.fname, seqlock = seqlock)
+        try:
+            for cnt in range(max_readers + 1):
+                stop = Event()
+                procs = [Process(target = read_loop, args = (writer.fname,
+                    seqlock, stop), daemon = True) for _ in range(cnt)]
+                for proc in procs: proc.start()
+                # let the readers get going
+                if procs: sleep(.2)
+                try:
+                    for op, func in (("set_data", lambda: writer.set_data(data)),
+                                     ("get_data", lambda: reader.get_data())):
+                        results.append(record("contention", op, time_calls(func, n),
+                            data.nbytes, "640x512", mode, readers = cnt))
+                        print_record(results[-1])
+                finally:
+                    stop.set()
+                    for proc in procs: proc.join()
+        finally:
+            remove_shm(writer, reader)
+    return results
+
+def bench_cpp(dir_:str, n:int, binary:str) -> list:
+    '''Runs the C++ benchmark on shms created here, then checks that the
+    data and counter it left are what Python expects'''
+
+    results = []
+    for size, shape in SIZES.items():
+        for mode in ("file", "mmap"):
+            shm, data = make_shm(dir_, "cpp", shape, MODES[mode][0])
+            try:
+                cnt = shm.get_counter()
+                out = subprocess.run([binary, shm.fname, str(n)], check = True,
+                    stdout = subprocess.PIPE, universal_newlines = True).stdout
+                # C++ writes back what it read n times
+                if shm.get_counter() != cnt + n or \
+                   not np.array_equal(shm.get_data(), data.ravel()):
+                    raise RuntimeError("C++ benchmark corrupted {}".format(shm.fname))
+            finally:
+                remove_shm(shm)
+            for op, times in json.loads(out).items():
+                nbytes = 8 if op == "get_counter" else data.nbytes
+                results.append(record("interop", op, times, nbytes, size, mode,
+                    lang = "c++"))
+                results[-1]["n"] = n
+                print_record(results[-1])
+    return results
+
+def metadata(args) -> dict:
+    '''Returns a description of the machine and code that was measured'''
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        rev = subprocess.run(["git", "-C", here, "rev-parse", "HEAD"],
+            stdout = subprocess.PIPE, stderr = subprocess.DEVNULL,
+            universal_newlines = True).stdout.strip() or None
+    except OSError: rev = None
+
+    return {"date": datetime.now().isoformat(), "host": platform.node(),
+            "platform": platform.platform(), "python": platform.python_version(),
+            "numpy": np.__version__, "git_rev": rev, "iterations": args.n,
+            "dtype": DTYPE.name, "cpu_count": os.cpu_count()}
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description = "Benchmark KPIC_shmlib")
+    parser.add_argument("-n", type = int, default = 200, help = "calls per measurement")
+    parser.add_argument("-d", default = "/tmp/shm_bench", help = "directory for test shms")
+    parser.add_argument("-s", type = int, default = 8, help = "most semaphore subscribers")
+    parser.add_argument("-r", type = int, default = 2, help = "most concurrent reader processes")
+    parser.add_argument("--cpp", default = os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), "shm_bench_cpp"), help = "C++ benchmark binary")
+    parser.add_argument("-o", help = "file to write JSON results to (default stdout)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.d): os.mkdir(args.d)
+
+    print("{:<12}{:<16}{:<8}{:<10}{:<9}{:>5}{:>8}{:>12}{:>12}".format("bench",
+        "op", "lang", "size", "mode", "subs", "readers", "median (us)",
+        "p99 (us)"), file = sys.stderr)
+
+    results = bench_ops(args.d, args.n)
+    results += bench_legacy(args.d, args.n)
+    results += bench_subscribers(args.d, args.n, args.s)
+    results += bench_contention(args.d, args.n, args.r)
+    if os.path.isfile(args.cpp): results += bench_cpp(args.d, args.n, args.cpp)
+    else: print("{} not found, skipping C++ benchmark".format(args.cpp), file = sys.stderr)
+
+    doc = {"meta": metadata(args), "results": results}
+    if args.o is None: json.dump(doc, sys.stdout, indent = 1)
+    else:
+        with open(args.o, "w") as file_: json.dump(doc, file_, indent = 1)
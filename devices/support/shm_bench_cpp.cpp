@@ -0,0 +1,79 @@
+/*
+ * Benchmark of the C++ side of KPIC_shmlib, run by shm_bench.py on shms it
+ *   creates to time the Python/C++ interop path.
+ *
+ * Usage: shm_bench_cpp SHM_PATH ITERATIONS
+ *
+ * Opens the shm at SHM_PATH, times ITERATIONS calls each of getCounter,
+ *   get_data and set_data (writing back the data that was read), and prints
+ *   one line of JSON with the median and 99th percentile of each in us.
+ */
+
+#include <time.h>       // adds clock_gettime
+#include <stdlib.h>     // adds atoi
+#include <stdio.h>      // adds printf
+#include <string>       // adds string
+#include <vector>       // adds vector
+#include <algorithm>    // adds sort
+
+#include "KPIC_shmlib.hpp"
+
+// returns the current time in us
+double now_us(){
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1e6 + ts.tv_nsec / 1e3;
+}
+
+// prints "name": {"median_us": x, "p99_us": y} for a list of durations
+void print_stats(const char *name, std::vector<double> &times){
+    std::sort(times.begin(), times.end());
+    double median = times[times.size() / 2];
+    double p99 = times[(times.size() * 99) / 100];
+    printf("\"%s\": {\"median_us\": %.3f, \"p99_us\": %.3f}", name, median, p99);
+}
+
+int main(int argc, char *argv[]){
+    if (argc != 3) {
+        fprintf(stderr, "Usage: %s SHM_PATH ITERATIONS\n", argv[0]);
+        return 1;
+    }
+
+    int n = atoi(argv[2]);
+    if (n <= 0) {
+        fprintf(stderr, "ITERATIONS must be positive\n");
+        return 1;
+    }
+
+    Shm shm(argv[1]);
+    std::vector<char> data(shm.DATA_SIZE);
+    std::vector<double> cnt_t(n), get_t(n), set_t(n);
+
+    for (int i = 0; i < n; i++) {
+        double start = now_us();
+        shm.getCounter();
+        cnt_t[i] = now_us() - start;
+    }
+
+    for (int i = 0; i < n; i++) {
+        double start = now_us();
+        shm.get_data(data.data());
+        get_t[i] = now_us() - start;
+    }
+
+    for (int i = 0; i < n; i++) {
+        double start = now_us();
+        shm.set_data(data.data());
+        set_t[i] = now_us() - start;
+    }
+
+    printf("{");
+    print_stats("get_counter", cnt_t);
+    printf(", ");
+    print_stats("get_data", get_t);
+    printf(", ");
+    print_stats("set_data", set_t);
+    printf("}\n");
+
+    return 0;
+}
@@ -0,0 +1,128 @@
+'''---------------------------------------------------------------------------
+Conformance check of the python and C++ shm libraries
+
+Usage: python shm_conformance.py [-d DIRECTORY] [--cpp BINARY]
+
+KPIC_shmlib must be importable (e.g. PYTHONPATH=Python) and the C++ side
+must be built (make shm_conformance_cpp). For every data type in
+KPIC_shm_schema, for 1 to 3 axes, with and without mmap, a shm is written
+by each library and read back by the other. The header fields and the data
+bytes have to match exactly.
+
+Shms are created in DIRECTORY (default /tmp/shm_conformance) and deleted
+afterwards. Exits with 1 if any check failed.
+---------------------------------------------------------------------------'''
+
+from argparse import ArgumentParser
+import os, sys, json, subprocess
+
+import numpy as np
+
+from KPIC_shmlib import Shm
+from KPIC_shm_schema import DTYPES, atod
+
+# shapes of the C++ size field (dimension 0 first)
+SHAPES = [(5,), (4, 3), (4, 3, 2)]
+
+# header fields compared between the two libraries
+FIELDS = ["imname", "cnt0", "nel", "size", "naxis", "atype", "mmap", "croppable"]
+
+def pattern(atype:int, nel:int) -> np.ndarray:
+    '''Returns the test data for a data type: letters for strings and
+    (i*37 + 11) % 256 for byte i of anything else (as shm_conformance_cpp)'''
+
+    dtype = atod[atype]
+    if dtype.kind in "US":
+        chars = [chr(ord("a") + i % 26) for i in range(nel)]
+        if dtype.kind == "S": chars = [char.encode() for char in chars]
+        return np.array(chars, dtype)
+
+    raw = (np.arange(nel * dtype.itemsize) * 37 + 11) % 256
+    return np.frombuffer(raw.astype(np.uint8).tobytes(), dtype)
+
+def header(shm:Shm) -> dict:
+    '''Returns the header fields of shm that are compared'''
+
+    shm.read_meta_data()
+    mtdata = dict(shm.mtdata, size = list(shm.mtdata["size"]))
+    return {key:mtdata[key] for key in FIELDS}
+
+def compare(name:str, got:dict, expected:dict) -> list:
+    '''Returns a message for each field that differs'''
+
+    return ["{}: {} is {}, expected {}".format(name, key, got.get(key), value)
+            for key, value in expected.items() if got.get(key) != value]
+
+def python_to_cpp(fname:str, binary:str, atype:int, shape:tuple, mmap:bool) -> list:
+    '''Writes a shm with python and reads it with C++'''
+
+    # python stores the numpy shape in size, so reverse the C++ order
+    data = pattern(atype, int(np.prod(shape))).reshape(shape[::-1])
+    shm = Shm(fname, data = data, mmap = mmap)
+    try:
+        shm.set_data(data)
+        out = subprocess.run([binary, "read", fname], check = True,
+            stdout = subprocess.PIPE, universal_newlines = True).stdout
+        got = json.loads(out)
+        expected = header(Shm(fname))
+        expected["data"] = data.tobytes().hex()
+        # the python and C++ clocks are read separately, so compare atime as is
+        expected["atime"] = [shm.mtdata["atime_sec"], shm.mtdata["atime_nsec"]]
+    finally:
+        shm.close()
+        os.remove(fname)
+
+    name = "python -> C++ {} {} mmap={}".format(atod[atype], shape, mmap)
+    return compare(name, got, expected)
+
+def cpp_to_python(fname:str, binary:str, atype:int, shape:tuple, mmap:bool) -> list:
+    '''Writes a shm with C++ and reads it with python'''
+
+    subprocess.run([binary, "write", fname, str(atype), str(int(mmap))] +
+        [str(dim) for dim in shape], check = True)
+    shm = Shm(fname)
+    try:
+        got = header(shm)
+        got["data"] = shm.get_data().tobytes().hex()
+    finally:
+        shm.close()
+        os.remove(fname)
+
+    nel = int(np.prod(shape))
+    dirname, base = fname.split("/")[-2:]
+    expected = {"imname": dirname + base.split(".")[0], "cnt0": 1, "nel": nel,
+        "size": list(shape) + [0]*(3 - len(shape)), "naxis": len(shape),
+        "atype": atype, "mmap": int(mmap), "croppable": 0,
+        "data": pattern(atype, nel).tobytes().hex()}
+
+    name = "C++ -> python {} {} mmap={}".format(atod[atype], shape, mmap)
+    return compare(name, got, expected)
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description = "Check that the python and C++ shm "
+        "libraries agree on the shm layout")
+    parser.add_argument("-d", default = "/tmp/shm_conformance", help = "directory for test shms")
+    parser.add_argument("--cpp", default = os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), "shm_conformance_cpp"), help = "C++ side binary")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.cpp):
+        print("{} not found, build it with 'make shm_conformance_cpp'".format(args.cpp))
+        sys.exit(1)
+    if not os.path.isdir(args.d): os.mkdir(args.d)
+
+    fname = "{}/conform.shm".format(args.d)
+    failures = []
+    checks = 0
+    for atype in DTYPES:
+        # strings are always one dimensional
+        shapes = SHAPES[:1] if atod[atype].kind in "US" else SHAPES
+        for shape in shapes:
+            for mmap in (False, True):
+                for check in (python_to_cpp, cpp_to_python):
+                    failures += check(fname, args.cpp, atype, shape, mmap)
+                    checks += 1
+
+    for failure in failures: print(failure)
+    print("{} checks, {} fields differ".format(checks, len(failures)))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,91 @@
+/*
+ * The C++ side of shm_conformance.py, which checks that shms written by one
+ *   of the python and C++ libraries are read correctly by the other.
+ *
+ * Usage: shm_conformance_cpp write PATH DTYPE MMAP DIM [DIM [DIM]]
+ *        shm_conformance_cpp read PATH
+ *
+ * write creates a shm with the given data type, mmap flag and dimensions and
+ *   sets its data once (so cnt0 is 1). The data is the pattern described in
+ *   shm_conformance.py.
+ * read prints the header and data (as hex) of an existing shm as JSON.
+ */
+
+#include <stdlib.h>     // adds atoi
+#include <stdio.h>      // adds printf
+#include <string>       // adds string
+#include <cstring>      // adds strcmp
+#include <vector>       // adds vector
+
+#include "KPIC_shmlib.hpp"
+
+// fills data with the test pattern for a data type
+void fill_pattern(std::vector<char> &data, uint8_t dtype, size_t nel){
+    if (dtype == 13) {
+        for (size_t i = 0; i < nel; i++) {
+            char32_t c = 'a' + i % 26;
+            memcpy(&data[i * sizeof(c)], &c, sizeof(c));
+        }
+    } else if (dtype == 14) {
+        for (size_t i = 0; i < nel; i++) { data[i] = 'a' + i % 26; }
+    } else {
+        for (size_t i = 0; i < data.size(); i++) { data[i] = (i * 37 + 11) % 256; }
+    }
+}
+
+int write_shm(int argc, char *argv[]){
+    uint8_t dtype = atoi(argv[3]);
+    bool do_mmap = atoi(argv[4]);
+    uint8_t dims = argc - 5;
+    uint16_t size[3] = {0, 0, 0};
+    size_t nel = 1;
+    for (int i = 0; i < dims; i++) {
+        size[i] = atoi(argv[5 + i]);
+        nel *= size[i];
+    }
+
+    size_t unit;
+    if (get_size(&unit, dtype) == -1) {
+        fprintf(stderr, "Unknown data type %d\n", dtype);
+        return 1;
+    }
+
+    std::vector<char> data(unit * nel);
+    fill_pattern(data, dtype, nel);
+
+    Shm shm(argv[2], size, dims, dtype, data.data(), do_mmap, false, false);
+    shm.set_data(data.data());
+    return 0;
+}
+
+int read_shm(char *argv[]){
+    Shm shm(argv[2]);
+    shm.getMetaData();
+    std::vector<unsigned char> data(shm.DATA_SIZE);
+    shm.get_data(data.data());
+
+    im_metadata &mt = shm.mtdata;
+    printf("{\"imname\": \"%s\", ", mt.name);
+    printf("\"crtime\": [%ld, %ld], ", (long) mt.crtime.tv_sec, mt.crtime.tv_nsec);
+    printf("\"atime\": [%ld, %ld], ", (long) mt.atime.tv_sec, mt.atime.tv_nsec);
+    printf("\"cnt0\": %llu, \"nel\": %u, ", (unsigned long long) mt.cnt0, mt.nel);
+    printf("\"size\": [%u, %u, %u], ", mt.size[0], mt.size[1], mt.size[2]);
+    printf("\"naxis\": %u, \"atype\": %u, \"mmap\": %u, \"croppable\": %u, ",
+        mt.naxis, mt.dtype, mt.mmap, mt.croppable);
+    printf("\"data\": \"");
+    for (unsigned char byte : data) { printf("%02x", byte); }
+    printf("\"}\n");
+    return 0;
+}
+
+int main(int argc, char *argv[]){
+    if (argc >= 6 && argc <= 8 && strcmp(argv[1], "write") == 0) {
+        return write_shm(argc, argv);
+    } else if (argc == 3 && strcmp(argv[1], "read") == 0) {
+        return read_shm(argv);
+    }
+
+    fprintf(stderr, "Usage: %s write PATH DTYPE MMAP DIM [DIM [DIM]]\n", argv[0]);
+    fprintf(stderr, "       %s read PATH\n", argv[0]);
+    return 1;
+}
@@ -0,0 +1,509 @@
+'''---------------------------------------------------------------------------
+Mirroring of shms over TCP
+
+A Server publishes a set of shms on a TCP port. A Client connects to it and
+recreates the shms it asks for as local shms with the same data, counter and
+atime as the originals, so GUIs and other consumers can run on another host
+without talking to the devices.
+
+The server runs a thread per client that waits for updates of the client's
+shms (see ShmMux) and sends each shm no more often than its rate limit.
+Updates in between are coalesced into the next frame, so the mirror always
+catches up to the latest value but can skip counters. Ring buffer shms (see
+RingShm) are mirrored as plain shms holding their latest frame.
+
+Frames are encoded with one of:
+    raw   - the data as is
+    zlib  - the data compressed with zlib
+    delta - the data XORed with the last frame sent of that shm, compressed
+            with zlib. Images that change little compress much better this
+            way. A zlib frame is sent every KEYFRAME frames and whenever the
+            shape or data type changes.
+
+Protocol: the client sends one line of JSON ({"shms": [names]}, or null for
+every published shm) and the server answers with one line of JSON listing
+the shms it will send. After that, the server only sends frames: the length
+of a JSON header and of the payload (two network order uint32), the header
+and the payload.
+
+Mirrored shms are created under the same path as the originals, except that
+the name of their directory starts with the client's prefix (e.g. with
+prefix "m", /tmp/Track_Cam/RAW.shm becomes /tmp/mTrack_Cam/RAW.shm). The
+prefix keeps the lock and subscriber semaphores of a mirror apart from
+those of the original when both are on one host. A client on another host
+uses no prefix, so that its mirrors have the paths the GUIs read.
+---------------------------------------------------------------------------'''
+
+from threading import Thread
+from time import sleep, monotonic
+from logging import info, warning
+import os, json, socket, select, struct, zlib
+
+import numpy as np
+
+from KPIC_shmlib import Shm, RingShm, ShmMux
+from KPIC_shm_schema import atod, dtoa
+
+# the length of the header and of the payload of a frame
+FRAME_FMT = "!II"
+
+# the number of delta frames between full frames
+KEYFRAME = 100
+
+ENCODINGS = ("raw", "zlib", "delta")
+
+def local_path(fname:str, prefix:str) -> str:
+    ''' --------------------------------------------------------------
+    Returns the path a shm is mirrored to (see module docstring)
+    -------------------------------------------------------------- '''
+
+    dirname, base = os.path.split(fname)
+    head, last = os.path.split(dirname)
+    return os.path.join(head, prefix + last, base)
+
+def _recv_exactly(conn:socket.socket, nbytes:int) -> bytes:
+    '''Reads nbytes from conn, raises ConnectionError if it's closed first'''
+
+    buf = bytearray(nbytes)
+    view = memoryview(buf)
+    got = 0
+    while got < nbytes:
+        n = conn.recv_into(view[got:])
+        if n == 0: raise ConnectionError("Connection closed")
+        got += n
+    return bytes(buf)
+
+def _recv_line(conn:socket.socket) -> bytes:
+    '''Reads up to a newline from conn (used for the handshake only)'''
+
+    line = b""
+    while not line.endswith(b"\n"):
+        char = conn.recv(1)
+        if not char: raise ConnectionError("Connection closed")
+        line += char
+    return line
+
+def encode(data:np.ndarray, prev:np.ndarray, enc:str) -> tuple:
+    ''' --------------------------------------------------------------
+    Encodes the data of a frame
+
+    Parameters:
+    ----------
+    - data: the flat data to send
+    - prev: the last data sent with this encoding, or None to force a
+        full frame (ignored unless enc is delta)
+    - enc: one of ENCODINGS
+    Returns:
+    ----------
+    - (str, bytes): the encoding actually used, and the payload
+    -------------------------------------------------------------- '''
+
+    raw = data.tobytes()
+    if enc == "raw": return "raw", raw
+    if enc == "delta" and prev is not None and prev.dtype == data.dtype \
+            and prev.size == data.size:
+        diff = np.bitwise_xor(data.view(np.uint8), prev.view(np.uint8))
+        return "delta", zlib.compress(diff.tobytes(), 1)
+    return "zlib", zlib.compress(raw, 1)
+
+def decode(payload:bytes, enc:str, dtype:np.dtype, prev:np.ndarray) -> np.ndarray:
+    ''' --------------------------------------------------------------
+    Decodes a payload made by encode
+
+    Parameters:
+    ----------
+    - payload: the payload received
+    - enc: the encoding from the frame header
+    - dtype: the data type of the data
+    - prev: the last data decoded for this shm (needed for delta)
+    Returns:
+    ----------
+    - np.ndarray: the flat data
+    -------------------------------------------------------------- '''
+
+    if enc == "raw": return np.frombuffer(payload, dtype)
+    raw = zlib.decompress(payload)
+    if enc == "zlib": return np.frombuffer(raw, dtype)
+    if enc == "delta":
+        if prev is None or prev.nbytes != len(raw):
+            raise ValueError("Delta frame without the frame it's based on")
+        diff = np.frombuffer(raw, np.uint8)
+        return np.bitwise_xor(diff, prev.view(np.uint8)).view(dtype)
+    raise ValueError("Unknown encoding {}".format(enc))
+
+def _read(shm:Shm) -> tuple:
+    ''' --------------------------------------------------------------
+    Reads the data of a shm along with the counter and atime it was
+    written with
+
+    Returns:
+    ----------
+    - (np.ndarray, int, tuple, list, int): the flat data, cnt0, atime
+        (sec, nsec), size and naxis
+    -------------------------------------------------------------- '''
+
+    # if a write lands between the data and atime reads, read again rather
+    #   than send an atime that doesn't go with the data
+    for _ in range(3):
+        if isinstance(shm, RingShm):
+            cnt0 = shm.get_counter()
+            data = shm.get_data(reform = True)
+            # the slot's shape is reformed, flip it back to a size
+            shape = data.shape
+            size = (shape[1], shape[0], *shape[2:]) if data.ndim >= 2 else shape
+            naxis = data.ndim
+            data = data.ravel()
+        else:
+            data = shm.get_data()
+            cnt0 = shm.mtdata["cnt0"]
+            size, naxis = shm.mtdata["size"], shm.mtdata["naxis"]
+        shm.get_time()
+        atime = (shm.mtdata["atime_sec"], shm.mtdata["atime_nsec"])
+        if shm.get_counter() == cnt0: break
+
+    size = [int(dim) for dim in size] + [0]*(3 - len(size))
+    return data, cnt0, atime, size, int(naxis)
+
+class _Session(Thread):
+    ''' ------------------------------------------------------------------
+    Sends updates of the shms a client asked for until it disconnects
+    ------------------------------------------------------------------ '''
+
+    def __init__(self, server, conn:socket.socket, addr:tuple):
+        super().__init__(daemon = True)
+        self.server = server
+        self.conn = conn
+        self.addr = addr
+        self.mux = ShmMux()
+        # opened shms, the inodes of their files and the names they're
+        #   published under
+        self.shms = {}
+        self.inodes = {}
+        self.names = {}
+        # the shms with updates that haven't been sent yet
+        self.pending = set()
+        # when each shm was last sent (monotonic), and the data sent (for delta)
+        self.last = {}
+        self.prev = {}
+        self.nframes = {}
+        self.wanted = []
+        self._last_scan = None
+        self.sent = 0
+
+    def run(self):
+        try:
+            hello = json.loads(_recv_line(self.conn))
+            wanted = hello.get("shms") or list(self.server.fnames)
+            self.wanted = [name for name in wanted if name in self.server.fnames]
+            self.conn.sendall(json.dumps({"shms": self.wanted}).encode() + b"\n")
+            info("{} mirroring {}".format(self.addr, ", ".join(self.wanted)))
+
+            self._open()
+            while self.server.alive and not self._hung_up(): self.poll()
+        except (OSError, ValueError) as ouch:
+            info("{} disconnected: {}".format(self.addr, ouch))
+        finally:
+            self.close()
+
+    def _hung_up(self) -> bool:
+        '''Checks (without waiting) if the client closed the connection'''
+
+        readable, _, _ = select.select([self.conn], [], [], 0)
+        # clients don't send anything after the handshake
+        return bool(readable) and not self.conn.recv(1)
+
+    def _open(self):
+        '''Opens the shms that exist and haven't been opened yet, and
+        reopens the ones whose files were recreated'''
+
+        self._last_scan = monotonic()
+        for name in self.wanted:
+            fname = self.server.fnames[name]
+            try: ino = os.stat(fname).st_ino
+            except OSError: continue
+            if name in self.shms:
+                if self.inodes[name] == ino: continue
+                self._drop(name)
+
+            try: shm = RingShm(fname)
+            except Shm.ExistentialError:
+                try: shm = Shm(fname, seqlock = True)
+                except (OSError, ValueError) as ouch:
+                    info("Couldn't open {}: {}".format(fname, ouch))
+                    continue
+            except (OSError, ValueError) as ouch:
+                info("Couldn't open {}: {}".format(fname, ouch))
+                continue
+
+            self.shms[name] = shm
+            self.inodes[name] = ino
+            self.names[id(shm)] = name
+            self.last[name] = -np.inf
+            self.nframes[name] = 0
+            self.mux.add(shm)
+            # send the value it has now
+            self.pending.add(name)
+
+    def _drop(self, name:str):
+        '''Closes a shm whose file was recreated (e.g. its device
+        restarted), so that it can be opened again'''
+
+        info("{} was recreated, reopening it".format(self.server.fnames[name]))
+        shm = self.shms.pop(name)
+        del self.inodes[name]
+        del self.names[id(shm)]
+        # the new file can have another shape or type, start with a full frame
+        self.prev.pop(name, None)
+        self.pending.discard(name)
+        self.mux.remove(shm)
+        shm.close()
+
+    def poll(self):
+        ''' --------------------------------------------------------------
+        Sends the pending updates that are due, then waits for more (at
+        most until the next pending update is due)
+        -------------------------------------------------------------- '''
+
+        now = monotonic()
+        timeout = 1.
+        for name in list(self.pending):
+            due = self.last[name] + self.server.periods.get(name, 0.)
+            if now >= due:
+                self.pending.discard(name)
+                self.last[name] = now
+                self._send(name)
+            else: timeout = min(timeout, due - now)
+
+        for shm in self.mux.wait(timeout):
+            self.pending.add(self.names[id(shm)])
+
+        if monotonic() - self._last_scan >= self.server.rescan_s: self._open()
+
+    def _send(self, name:str):
+        '''Sends the current data of a shm as a frame'''
+
+        shm = self.shms[name]
+        try: data, cnt0, atime, size, naxis = _read(shm)
+        # the shm was deleted (e.g. its control script stopped)
+        except (OSError, ValueError): return
+        # a ring buffer that hasn't been written to has nothing to mirror
+        if not data.size: return
+
+        enc = self.server.encodings.get(name, "raw")
+        prev = self.prev.get(name)
+        if self.nframes[name] % KEYFRAME == 0: prev = None
+        enc, payload = encode(data, prev, enc)
+        if enc != "raw": self.prev[name] = data
+        self.nframes[name] += 1
+
+        header = json.dumps({"name": name, "path": self.server.fnames[name],
+            "cnt0": int(cnt0), "atime": atime, "atype": dtoa[shm.npdtype],
+            "size": size, "naxis": naxis, "mmap": bool(shm.mmap),
+            "croppable": bool(shm.mtdata["croppable"]), "enc": enc}).encode()
+        self.conn.sendall(struct.pack(FRAME_FMT, len(header), len(payload)) + header)
+        self.conn.sendall(payload)
+        self.sent += 1
+
+    def close(self):
+        self.mux.close()
+        for shm in self.shms.values(): shm.close()
+        try: self.conn.close()
+        except OSError: pass
+        info("{}: sent {} frames".format(self.addr, self.sent))
+
+class Server:
+    ''' ------------------------------------------------------------------
+    Publishes shms to mirror clients. Shms that don't exist yet are retried
+    every rescan_s seconds, so the server can be started before the devices,
+    and shms whose files were recreated since they were opened are reopened.
+    ------------------------------------------------------------------ '''
+
+    def __init__(self, shms:dict, host:str="", port:int=5571, rates:dict=None,
+                 encodings:dict=None, rescan_s:float=10.):
+        ''' --------------------------------------------------------------
+        Parameters:
+        ----------
+        - shms: a dictionary of published names to shm file names
+        - host: the address to listen on ("" for all interfaces)
+        - port: the port to listen on
+        - rates: the maximum updates per second sent of each shm, by name.
+            Shms that aren't in rates (or are 0) are sent on every update.
+        - encodings: the encoding of each shm, by name (see ENCODINGS).
+            Shms that aren't in encodings are sent raw.
+        - rescan_s: seconds between attempts to open missing shms (and
+            checks for recreated ones)
+        -------------------------------------------------------------- '''
+
+        self.fnames = dict(shms)
+        self.periods = {name: 1/rate for (name, rate) in (rates or {}).items() if rate}
+        self.encodings = dict(encodings or {})
+        for (name, enc) in self.encodings.items():
+            if enc not in ENCODINGS:
+                raise ValueError("Unknown encoding {} for {}".format(enc, name))
+        self.rescan_s = rescan_s
+
+        self.alive = True
+        self.sessions = []
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen()
+        # so poll can notice alive being cleared
+        self.sock.settimeout(1.)
+
+    def poll(self):
+        '''Waits up to a second for a client and starts a session for it'''
+
+        self.sessions = [sess for sess in self.sessions if sess.is_alive()]
+        try: conn, addr = self.sock.accept()
+        except socket.timeout: return
+
+        conn.settimeout(None)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sess = _Session(self, conn, addr)
+        self.sessions.append(sess)
+        sess.start()
+
+    def close(self):
+        '''Stops accepting clients and ends every session'''
+
+        self.alive = False
+        self.sock.close()
+        for sess in self.sessions:
+            # wake the session up so it sees alive is False
+            try: sess.mux.release()
+            except Exception: pass
+            sess.join(5)
+
+class Client:
+    ''' ------------------------------------------------------------------
+    Recreates shms published by a Server locally. Reconnects (every
+    retry_s seconds) if the connection is lost.
+    ------------------------------------------------------------------ '''
+
+    def __init__(self, host:str, port:int=5571, names:list=None, prefix:str="m",
+                 retry_s:float=5.):
+        ''' --------------------------------------------------------------
+        Parameters:
+        ----------
+        - host: the address of the server
+        - port: the port of the server
+        - names: the published names of the shms to mirror (None for all)
+        - prefix: the prefix of the mirrored shms' directories (see
+            local_path). Can only be "" if the client runs on another host.
+        - retry_s: seconds between attempts to connect
+        -------------------------------------------------------------- '''
+
+        self.addr = (host, port)
+        self.names = names
+        self.prefix = prefix
+        self.retry_s = retry_s
+
+        self.alive = True
+        self.conn = None
+        # the mirrored shms, their capacity in elements and last data, by name
+        self.shms = {}
+        self.capacity = {}
+        self.prev = {}
+        self.received = 0
+
+    def connect(self) -> list:
+        ''' --------------------------------------------------------------
+        Connects to the server and returns the names it will send
+        -------------------------------------------------------------- '''
+
+        conn = socket.create_connection(self.addr)
+        try:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn.sendall(json.dumps({"shms": self.names}).encode() + b"\n")
+            names = json.loads(_recv_line(conn))["shms"]
+        except Exception:
+            conn.close()
+            raise
+
+        self.conn = conn
+        # a delta frame is never sent before a full one on a new connection
+        self.prev = {}
+        info("Connected to {}, mirroring {}".format(self.addr, ", ".join(names)))
+        return names
+
+    def poll(self):
+        ''' --------------------------------------------------------------
+        Receives one frame and writes it to its mirror, connecting first if
+        needed. Connection errors close the connection and, unless the
+        client was closed, wait retry_s seconds.
+        -------------------------------------------------------------- '''
+
+        try:
+            if self.conn is None: self.connect()
+            hlen, plen = struct.unpack(FRAME_FMT,
+                _recv_exactly(self.conn, struct.calcsize(FRAME_FMT)))
+            header = json.loads(_recv_exactly(self.conn, hlen))
+            payload = _recv_exactly(self.conn, plen)
+        except (OSError, ValueError) as ouch:
+            # close may have taken the connection already
+            conn, self.conn = self.conn, None
+            if conn is not None:
+                warning("Lost connection to {}: {}".format(self.addr, ouch))
+                conn.close()
+            if self.alive: sleep(self.retry_s)
+            return
+
+        self._write(header, payload)
+
+    def _write(self, header:dict, payload:bytes):
+        '''Writes a frame to the local shm, creating the shm if needed'''
+
+        name = header["name"]
+        dtype = atod[header["atype"]]
+        data = decode(payload, header["enc"], dtype, self.prev.get(name))
+        self.prev[name] = data
+
+        size, naxis = header["size"], header["naxis"]
+        shm = self.shms.get(name)
+        if shm is None or shm.npdtype != dtype or data.size > self.capacity[name] \
+                or (not shm.mtdata["croppable"] and list(shm.mtdata["size"]) != size):
+            shm = self._create(header, data)
+
+        if shm.mtdata["croppable"]:
+            # set_data takes the size from the shape of croppable data, with
+            #   the x and y axes flipped as in get_data(reform=True)
+            shape = size[:naxis]
+            if naxis >= 2: shape = (shape[1], shape[0], *shape[2:])
+            data = data.reshape(shape)
+        shm.set_data(data, atime = tuple(header["atime"]), cnt0 = header["cnt0"])
+        self.received += 1
+
+    def _create(self, header:dict, data:np.ndarray) -> Shm:
+        '''(Re)creates the mirror of a shm to fit data'''
+
+        name = header["name"]
+        fname = local_path(header["path"], self.prefix)
+        old = self.shms.pop(name, None)
+        if old is not None: old.close()
+        # a mirror left by a previous run can have another size or type
+        if os.path.exists(fname): os.remove(fname)
+        os.makedirs(os.path.dirname(fname), exist_ok = True)
+
+        size, naxis = header["size"], header["naxis"]
+        # Shm stores the shape of data as its size
+        shm = Shm(fname, data = data.reshape(size[:naxis]), mmap = header["mmap"],
+            croppable = header["croppable"])
+        self.shms[name] = shm
+        self.capacity[name] = data.size
+        info("Mirroring {} to {}".format(name, fname))
+        return shm
+
+    def close(self):
+        '''Disconnects and closes the mirrored shms (the files are kept)'''
+
+        self.alive = False
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            # wakes up poll if it's waiting for a frame
+            try: conn.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+            conn.close()
+        for shm in self.shms.values(): shm.close()
+        info("Received {} frames".format(self.received))
@@ -0,0 +1,269 @@
+'''---------------------------------------------------------------------------
+A cache of Tracking Camera biases and bad pixel maps, keyed by camera
+configuration
+
+Finding the bias for a configuration means formatting its file name (see
+TC_cmds.b_fname), falling back to the full frame bias if there isn't one for
+the crop, reading the FITS file, covering the tag pixels, cropping and
+computing the bad pixel map. CalibCache does this once per bias file:
+
+    - the bias (tag pixels covered) and bad pixel map of each bias file are
+      saved as .npy files in cache_dir (/tmp/Calib_Cache) and memory mapped,
+      so every processing script shares one copy, and only the first one to
+      need a file computes it. The arrays are recomputed if the FITS file
+      is rewritten (e.g. by TC_cmds.save_dark). They're stored as DTYPE,
+      the data type frames are processed in, so that subtracting them
+      doesn't promote (or read) float64.
+    - the last few configurations looked up are kept in memory (least
+      recently used first out) along with their cropped views, so going
+      back to a configuration costs a dictionary lookup.
+
+Usage:
+    calib = CalibCache(tc.b_dir, tc.b_fname)
+    cal = calib.get(tc._get_header())
+    im -= cal.bias
+    im *= cal.bpm
+---------------------------------------------------------------------------'''
+
+from collections import OrderedDict
+from time import monotonic
+from logging import info
+import os
+
+from astropy.io import fits
+import numpy as np
+
+# coefficient for bad pixel filter
+BPM_FILT = 3.5
+
+# the data type of the cached biases and bad pixel maps
+DTYPE = np.float32
+
+# the keys of a camera header that pick a bias (see TC_cmds._get_header)
+KEY_FIELDS = ("fps", "tint", "ndr", "t_setp", "crop_LB", "crop_RB", "crop_UB", "crop_BB")
+
+def bad_pixel_map(frame:np.ndarray) -> np.ndarray:
+    ''' --------------------------------------------------------------
+    Returns a map that's 0 for pixels more than BPM_FILT standard
+    deviations from the median of frame and 1 elsewhere
+    -------------------------------------------------------------- '''
+
+    bpm = np.ones_like(frame)
+    std = np.std(frame)
+    mu = np.median(frame)
+    bpm[frame > mu + BPM_FILT*std] = 0
+    bpm[frame < mu - BPM_FILT*std] = 0
+    return bpm
+
+def crop_frame(frame:np.ndarray, crop:tuple) -> np.ndarray:
+    ''' --------------------------------------------------------------
+    Returns a view of the part of a full frame inside a crop window
+
+    Parameters:
+    ----------
+    - frame: a full (uncropped) frame
+    - crop: the window as in TC_cmds.get_crop (col min, col max, row min,
+        row max, all inclusive), or all 0s for the full frame
+    -------------------------------------------------------------- '''
+
+    lb, rb, ub, bb = crop
+    if not any(crop): return frame
+    return frame[ub:bb+1, lb:rb+1]
+
+class Calib:
+    ''' ------------------------------------------------------------------
+    The calibration frames of one camera configuration. The arrays are
+    read-only and shared, copy them before modifying them.
+
+    Attributes:
+        key     = the configuration (see KEY_FIELDS)
+        fname   = the bias file used
+        header  = the header of the bias file, with the CROP fields set to
+                  the configuration's crop
+        bias    = the bias, cropped to the configuration's crop
+        bpm     = the bad pixel map, cropped the same way
+        cropped = whether the bias was cropped from a full frame bias
+    ------------------------------------------------------------------ '''
+
+    def __init__(self, key:tuple, fname:str, header:fits.Header, bias:np.ndarray,
+                 bpm:np.ndarray, cropped:bool):
+        self.key = key
+        self.fname = fname
+        self.header = header
+        self.bias = bias
+        self.bpm = bpm
+        self.cropped = cropped
+        # when the bias file was last checked (monotonic) and its mtime
+        self.checked = monotonic()
+        self.mtime = None
+
+class CalibCache:
+    ''' ------------------------------------------------------------------
+    Finds (and remembers) the bias and bad pixel map of camera
+    configurations
+    ------------------------------------------------------------------ '''
+
+    def __init__(self, b_dir:str, b_fname:str, size:int=16,
+                 cache_dir:str="/tmp/Calib_Cache", check_s:float=10.):
+        ''' --------------------------------------------------------------
+        Parameters:
+        ----------
+        - b_dir: the directory biases are saved in (TC_cmds.b_dir)
+        - b_fname: the format of bias file names (TC_cmds.b_fname)
+        - size: the number of configurations kept in memory
+        - cache_dir: where the precomputed arrays are shared between
+            processes
+        - check_s: seconds a configuration is trusted before checking that
+            its bias file hasn't changed (or, if it had no bias, that one
+            hasn't been saved)
+        -------------------------------------------------------------- '''
+
+        self.b_dir = b_dir if b_dir.endswith("/") else b_dir + "/"
+        self.b_fname = b_fname
+        self.size = size
+        self.cache_dir = cache_dir
+        self.check_s = check_s
+
+        # configurations by key, least recently used first. Configurations
+        #   without a bias map to the monotonic time they were looked up
+        self._entries = OrderedDict()
+        # memory mapped (header, bias, bpm) of bias files by (fname, mtime)
+        self._files = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(header) -> tuple:
+        ''' --------------------------------------------------------------
+        Returns the configuration of a camera header (e.g. from
+        TC_cmds._get_header), formatted as in bias file names
+        -------------------------------------------------------------- '''
+
+        fps, tint, ndr, temp, *crop = [header[field] for field in KEY_FIELDS]
+        return (int(round(fps)), float(tint), int(ndr), float(temp), *[int(val) for val in crop])
+
+    def _fname(self, key:tuple, crop:tuple) -> str:
+        '''Formats the bias file name of a configuration with the given crop'''
+
+        fps, tint, ndr, temp = key[:4]
+        lb, rb, ub, bb = crop
+        return self.b_dir + self.b_fname.format(fps = fps, tint = tint, ndr = ndr,
+            temp = temp, lb = lb, rb = rb, ub = ub, bb = bb)
+
+    def get(self, header) -> Calib:
+        ''' --------------------------------------------------------------
+        Returns the calibration frames of the configuration in a camera
+        header.
+
+        Raises FileNotFoundError if there is no bias for the configuration
+        (neither for its crop nor full frame).
+        -------------------------------------------------------------- '''
+
+        key = self.key(header)
+        entry = self._entries.get(key)
+        now = monotonic()
+
+        if entry is not None and (now - (entry if isinstance(entry, float) else entry.checked)) < self.check_s:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if isinstance(entry, float): raise FileNotFoundError("No bias for {}".format(key))
+            return entry
+
+        # the entry is old, make sure the bias file is still the same
+        if isinstance(entry, Calib):
+            try: mtime = os.stat(entry.fname).st_mtime_ns
+            except OSError: mtime = None
+            if mtime == entry.mtime:
+                entry.checked = now
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        self.misses += 1
+        try: entry = self._load(key)
+        except FileNotFoundError:
+            self._store(key, now)
+            raise
+        self._store(key, entry)
+        return entry
+
+    def _store(self, key:tuple, entry):
+        '''Adds an entry, dropping the least recently used ones if full'''
+
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size: self._entries.popitem(last = False)
+
+        # forget bias files no configuration uses anymore
+        used = {(ent.fname, ent.mtime) for ent in self._entries.values() if isinstance(ent, Calib)}
+        for fkey in list(self._files):
+            if fkey not in used: del self._files[fkey]
+
+    def _load(self, key:tuple) -> Calib:
+        '''Finds the bias file of a configuration and crops its frames'''
+
+        crop = key[4:]
+        fname = self._fname(key, crop)
+        cropped = False
+        if not os.path.isfile(fname):
+            fname = self._fname(key, (0, 0, 0, 0))
+            cropped = True
+            if not os.path.isfile(fname):
+                raise FileNotFoundError("No bias for {}".format(key))
+
+        mtime = os.stat(fname).st_mtime_ns
+        if (fname, mtime) not in self._files:
+            self._files[(fname, mtime)] = self._precomputed(fname, mtime)
+        header, bias, bpm = self._files[(fname, mtime)]
+
+        header = header.copy()
+        if cropped:
+            bias, bpm = crop_frame(bias, crop), crop_frame(bpm, crop)
+            for (field, val) in zip(KEY_FIELDS[4:], crop): header[field] = val
+
+        entry = Calib(key, fname, header, bias, bpm, cropped)
+        entry.mtime = mtime
+        return entry
+
+    def _precomputed(self, fname:str, mtime:int) -> tuple:
+        ''' --------------------------------------------------------------
+        Returns the header, bias and bad pixel map of a bias file, memory
+        mapped from cache_dir (computing and saving them first if no
+        process has yet)
+        -------------------------------------------------------------- '''
+
+        stem = "{}/{}.{}.{}".format(self.cache_dir, os.path.basename(fname)[:-5],
+            mtime, np.dtype(DTYPE).name)
+        paths = [stem + ".bias.npy", stem + ".bpm.npy"]
+
+        with fits.open(fname) as f:
+            header = f[0].header.copy()
+            if all(os.path.isfile(path) for path in paths):
+                return (header, *[np.load(path, mmap_mode = "r") for path in paths])
+            bias = f[0].data.astype(DTYPE)
+
+        info("Computing bad pixel map of {}".format(fname))
+        # if the bias contains the first four pixels, copy over them (tags)
+        try:
+            if header["CROP_UB"] == 0 and header["CROP_LB"] < 4:
+                tags = int(4 - header["CROP_LB"])
+                bias[0, :tags] = bias[0, tags]
+        except KeyError: pass
+        bpm = bad_pixel_map(bias)
+
+        os.makedirs(self.cache_dir, exist_ok = True)
+        # remove the arrays of older versions of the file
+        prefix = os.path.basename(fname)[:-5] + "."
+        for old in os.listdir(self.cache_dir):
+            if old.startswith(prefix) and not old.startswith(os.path.basename(stem)):
+                try: os.remove(os.path.join(self.cache_dir, old))
+                except OSError: pass
+
+        # write to temporary names so other processes never see half a file
+        for (path, arr) in zip(paths, (bias, bpm)):
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp, "wb") as file_: np.save(file_, arr)
+            os.replace(tmp, path)
+
+        return (header, *[np.load(path, mmap_mode = "r") for path in paths])
@@ -0,0 +1,127 @@
+'''---------------------------------------------------------------------------
+Lookup tables for scaling frames for display
+
+Displayed frames are int16, so a display scale (log, square root) and range
+(the values shown, others are clipped) are a function of 65536 values. A
+DisplayLUT computes that function once per scale and range, as a table,
+and scales a frame with a single np.take: the frame, viewed as uint16,
+indexes the table. This costs the same for every scale, allocates nothing
+once the frame shape is known, and gives the same output for the same input.
+
+The scaled range is stretched linearly onto [0, OUT_MAX], so a log or
+square root scale keeps as many display levels as a linear one (pixels
+outside a scale's domain, e.g. negative values on a log scale, are 0).
+
+Usage:
+    lut = DisplayLUT()
+    disp = lut.apply(im, LOG, lo = 0, hi = 4000)
+---------------------------------------------------------------------------'''
+
+from collections import OrderedDict
+
+import numpy as np
+
+# the scales of the vis process (see Scale in Track_Cam_vis_process.ini)
+NONE = 0
+LOG = 1
+SQRT = 2
+SCALES = (NONE, LOG, SQRT)
+
+# the value the top of a scaled range is displayed as (the bottom is 0)
+OUT_MAX = 2**15 - 1
+
+# the smallest value in the domain of each scale
+_FLOOR = {LOG: 1, SQRT: 0}
+
+# every int16 value, at the index of its uint16 view
+_VALUES = np.arange(2**16, dtype = np.uint16).view(np.int16)
+
+def make_table(scale:int, lo:int=0, hi:int=0) -> np.ndarray:
+    ''' --------------------------------------------------------------
+    Returns the table of a display scale and range
+
+    Parameters:
+    ----------
+    - scale: one of SCALES
+    - lo, hi: the range shown. Values are clipped to [lo, hi] and
+        [f(lo), f(hi)] (f being the scale) is mapped linearly onto
+        [0, OUT_MAX]. If lo isn't below hi, NONE leaves values as they
+        are and the other scales show every value in their domain.
+    Returns:
+    ----------
+    - np.ndarray: the scaled int16 values (rounded), indexed by the
+        uint16 view of the value
+    -------------------------------------------------------------- '''
+
+    if scale not in SCALES: raise ValueError("Unknown scale {}".format(scale))
+    if scale == NONE and not lo < hi: return _VALUES.copy()
+    if not lo < hi: lo, hi = _FLOOR[scale], OUT_MAX
+
+    # values below the domain of the scale are shown as 0
+    vals = _VALUES.astype(np.float64)
+    if scale != NONE:
+        lo = max(lo, _FLOOR[scale])
+        if hi <= lo: return np.zeros(_VALUES.size, np.int16)
+    np.clip(vals, lo, hi, out = vals)
+
+    func = {NONE: lambda x: x, LOG: np.log10, SQRT: np.sqrt}[scale]
+    f_lo, f_hi = func(float(lo)), func(float(hi))
+    out = (func(vals) - f_lo) * (OUT_MAX / (f_hi - f_lo))
+    return np.rint(out).astype(np.int16)
+
+class DisplayLUT:
+    ''' ------------------------------------------------------------------
+    Scales frames for display with cached lookup tables
+    ------------------------------------------------------------------ '''
+
+    def __init__(self, size:int=8):
+        ''' --------------------------------------------------------------
+        Parameters:
+        ----------
+        - size: the number of tables (scale and range) kept
+        -------------------------------------------------------------- '''
+
+        self.size = size
+        # tables by (scale, lo, hi), least recently used first
+        self._tables = OrderedDict()
+        # the int16 frame and the scaled frame, reused while the shape holds
+        self._index = np.zeros(0, np.int16)
+        self._out = np.zeros(0, np.int16)
+
+    def table(self, scale:int, lo:int=0, hi:int=0) -> np.ndarray:
+        '''Returns the table of a scale and range (see make_table)'''
+
+        key = (int(scale), int(lo), int(hi)) if lo < hi else (int(scale), 0, 0)
+        if key in self._tables: self._tables.move_to_end(key)
+        else:
+            self._tables[key] = make_table(*key)
+            while len(self._tables) > self.size: self._tables.popitem(last = False)
+        return self._tables[key]
+
+    def apply(self, im:np.ndarray, scale:int, lo:int=0, hi:int=0) -> np.ndarray:
+        ''' --------------------------------------------------------------
+        Scales a frame for display
+
+        Parameters:
+        ----------
+        - im: the frame. Frames that aren't int16 are clipped to the
+            int16 range and truncated (into a buffer, im isn't modified)
+        - scale, lo, hi: as in make_table
+        Returns:
+        ----------
+        - np.ndarray: the scaled int16 frame, reused by the next call
+        -------------------------------------------------------------- '''
+
+        table = self.table(scale, lo, hi)
+
+        if self._out.shape != im.shape:
+            self._index = np.zeros(im.shape, np.int16)
+            self._out = np.zeros(im.shape, np.int16)
+
+        if im.dtype == np.int16: index = im
+        else:
+            # values are clipped before they're cast, so the cast is safe
+            np.clip(im, -2**15, 2**15 - 1, out = self._index, casting = "unsafe")
+            index = self._index
+
+        return np.take(table, index.view(np.uint16), out = self._out)
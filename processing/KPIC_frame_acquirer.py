@@ -0,0 +1,208 @@
+'''---------------------------------------------------------------------------
+A thread that drains a camera shm into a bounded ring of frames
+
+Processing that reads the camera shm itself misses every frame that arrives
+while it's busy. An Acquirer reads each frame as soon as it's written (see
+Shm copy_into) into one of a fixed set of preallocated buffers and queues
+it, so a processing loop can take frames at its own pace:
+
+    acq = Acquirer(cam.Img.fname, capacity = 16)
+    acq.start()
+    frame = acq.get()       # the oldest frame not processed yet
+    ...                     # the frame can be modified until it's released
+    acq.release()
+
+The ring holds at most capacity frames. If processing falls further behind,
+the oldest queued frame is dropped to make room (processing always catches
+up to the camera) and counted in dropped. Frames the acquirer itself didn't
+read in time show up as counter gaps and are counted in missed. stats()
+returns both, to be published to a shm.
+---------------------------------------------------------------------------'''
+
+from threading import Thread, Condition, Event
+from collections import deque
+from logging import info
+
+import numpy as np
+
+from KPIC_shmlib import Shm
+
+class Acquirer(Thread):
+    ''' ------------------------------------------------------------------
+    Reads every frame of a shm into a bounded ring of preallocated buffers
+    ------------------------------------------------------------------ '''
+
+    # the order of stats()
+    STATS = ("acquired", "missed", "dropped", "queued", "capacity")
+
+    def __init__(self, fname:str, capacity:int=16, timeout:float=1.):
+        ''' --------------------------------------------------------------
+        Parameters:
+        ----------
+        - fname: the camera shm
+        - capacity: the number of frames that can be queued
+        - timeout: seconds between checks for close while no frames come
+        -------------------------------------------------------------- '''
+
+        super().__init__(daemon = True)
+        self.shm = Shm(fname, seqlock = True)
+        self.capacity = capacity
+        self.timeout = timeout
+
+        # capacity queued frames, plus the one being read and the one being
+        #   processed. Buffers are flat and grow if the frames do
+        nel = self.shm.mtdata["nel"]
+        self._bufs = [np.zeros(nel, self.shm.npdtype) for _ in range(capacity + 2)]
+        # the buffer being written, the free buffers and the queued frames
+        #   (buffer index, frame view, counter)
+        self._writing = 0
+        self._free = list(range(1, capacity + 2))
+        self._queue = deque()
+        # the buffer of the frame returned by get, until it's released
+        self._reading = None
+        self._cond = Condition()
+
+        self._run = Event()
+        self._run.set()
+        # the number of pauses, so that a frame read across a pause is dropped
+        self._pauses = 0
+        self.alive = True
+
+        # the counter of the last frame returned by get
+        self.cnt = None
+
+        self.acquired = 0
+        self.missed = 0
+        self.dropped = 0
+        self._last_cnt = None
+
+    def run(self):
+        while self.alive:
+            if not self._run.wait(self.timeout): continue
+
+            pauses = self._pauses
+            try: frame = self._read()
+            except Shm.TimeoutError: continue
+            except (OSError, ValueError) as ouch:
+                # the camera shm went away (e.g. the camera disconnected)
+                info("Couldn't read {}: {}".format(self.shm.fname, ouch))
+                self._run.wait(self.timeout)
+                continue
+            if frame is None: continue
+
+            cnt = self.shm.mtdata["cnt0"]
+            with self._cond:
+                # paused since the read started (and maybe resumed), the
+                #   buffer is kept for the next frame
+                if pauses != self._pauses or not self._run.is_set(): continue
+
+                if self._last_cnt is not None and cnt > self._last_cnt + 1:
+                    self.missed += cnt - self._last_cnt - 1
+                self._last_cnt = cnt
+                self.acquired += 1
+
+                self._queue.append((self._writing, frame, cnt))
+                # processing is behind, drop the oldest frame
+                if len(self._queue) > self.capacity:
+                    self._writing = self._queue.popleft()[0]
+                    self.dropped += 1
+                else: self._writing = self._free.pop()
+                self._cond.notify()
+
+    def _read(self) -> np.ndarray:
+        '''Waits for a frame and copies it into the buffer being written'''
+
+        buf = self._bufs[self._writing]
+        try: frame = self.shm.copy_into(buf, True, self.timeout)
+        # the frame is bigger than the buffer (or of another type), the
+        #   frame was already waited for
+        except ValueError:
+            self.shm.read_meta_data()
+            buf = np.zeros(self.shm.mtdata["nel"], self.shm.npdtype)
+            self._bufs[self._writing] = buf
+            frame = self.shm.copy_into(buf)
+
+        # paused while waiting, don't queue a frame from before the pause
+        if not self._run.is_set(): return None
+        return frame
+
+    def get(self, timeout:float=None) -> np.ndarray:
+        ''' --------------------------------------------------------------
+        Returns the oldest queued frame, waiting for one if needed. The
+        previous frame returned is released if it wasn't already.
+
+        Parameters:
+        ----------
+        - timeout: seconds to wait (None waits until a frame comes or the
+            acquirer is closed)
+        Returns:
+        ----------
+        - np.ndarray: the frame (shaped as get_data(reform=True)), which
+            belongs to the caller until release or the next get. None if
+            no frame came in time.
+        -------------------------------------------------------------- '''
+
+        with self._cond:
+            self._release()
+            if not self._cond.wait_for(lambda: self._queue or not self.alive, timeout):
+                return None
+            if not self._queue: return None
+
+            self._reading, frame, self.cnt = self._queue.popleft()
+            return frame
+
+    def release(self):
+        '''Gives the buffer of the frame returned by get back to the ring'''
+
+        with self._cond: self._release()
+
+    def _release(self):
+        if self._reading is not None:
+            self._free.append(self._reading)
+            self._reading = None
+
+    def clear(self):
+        '''Drops every queued frame (without counting them as dropped)'''
+
+        with self._cond:
+            while self._queue: self._free.append(self._queue.popleft()[0])
+
+    def pause(self):
+        ''' --------------------------------------------------------------
+        Stops reading frames and empties the ring, e.g. while processing is
+        off, so that stale frames aren't processed and aren't counted as
+        dropped. Frames written while paused aren't counted as missed.
+        -------------------------------------------------------------- '''
+
+        self._run.clear()
+        with self._cond:
+            self._pauses += 1
+            self._last_cnt = None
+        self.clear()
+
+    def resume(self):
+        '''Starts reading frames again after pause'''
+
+        self._run.set()
+
+    @property
+    def queued(self) -> int:
+        '''The number of frames waiting to be processed'''
+
+        return len(self._queue)
+
+    def stats(self) -> np.ndarray:
+        '''Returns the counters, in the order of STATS'''
+
+        with self._cond:
+            return np.array([self.acquired, self.missed, self.dropped,
+                len(self._queue), self.capacity], np.uint64)
+
+    def close(self):
+        '''Stops the thread and wakes up get'''
+
+        self.alive = False
+        self._run.set()
+        with self._cond: self._cond.notify_all()
+        if self.is_alive(): self.join(2 * self.timeout)
+        self.shm.close()
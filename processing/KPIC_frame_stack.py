@@ -0,0 +1,272 @@
+'''---------------------------------------------------------------------------
+A preallocated stack of the last N camera frames with their median and mean
+
+Frames are copied from a shm straight into a staging buffer (see Shm
+copy_into), so no arrays are allocated per frame. Each frame pushed replaces
+the oldest one in a ring, and:
+
+    mean   - is kept as a running sum: the new frame is added and the oldest
+             subtracted, so a push costs O(1) per pixel.
+    median - is computed when asked for, by a sorting network run on whole
+             frames: a fixed sequence of elementwise min/max calls into
+             preallocated buffers (Batcher's merge exchange, keeping only the
+             comparators the middle value depends on). Above NETWORK_MAX
+             frames, np.median is used instead.
+
+Usage:
+    stack = FrameStack(5)
+    frame = stack.stage(Img)    # wait for a frame and copy it in
+    frame[0][:4] = frame[0][4]  # the staged frame can be fixed up in place
+    stack.push()
+    im = stack.median()
+
+The stack is cleared if the frame shape or data type changes (e.g. the
+camera's crop changed). Changing the number of frames (resize) keeps the
+newest ones.
+
+The median and mean are float32 by default, which holds the median of int16
+frames exactly and is half the size of float64 for the processing that
+follows (see out_dtype).
+
+See frame_stack_bench.py for timings against np.median.
+---------------------------------------------------------------------------'''
+
+from functools import lru_cache
+from math import ceil, log2
+
+import numpy as np
+
+from KPIC_shmlib import Shm
+
+# the largest stack the median is computed with a sorting network for (the
+#   network is several times faster than np.median up to this size)
+NETWORK_MAX = 32
+
+def _merge_exchange(n:int) -> list:
+    '''Returns the comparators (i, j), i < j, of Batcher's merge exchange
+    sort of n values (Knuth, TAOCP vol. 3, 5.2.2 algorithm M)'''
+
+    pairs = []
+    if n < 2: return pairs
+    t = ceil(log2(n))
+    p = 2**(t - 1)
+    while p > 0:
+        q, r, d = 2**(t - 1), 0, p
+        while True:
+            pairs += [(i, i + d) for i in range(n - d) if i & p == r]
+            if q == p: break
+            d, q, r = q - p, q // 2, p
+        p //= 2
+    return pairs
+
+@lru_cache(maxsize = None)
+def _median_network(n:int) -> tuple:
+    ''' --------------------------------------------------------------
+    Returns the comparators of a sorting network for n values that the
+    middle value(s) depend on, as (i, j, need_min, need_max): the minimum
+    of values i and j goes to i if need_min, the maximum to j if need_max
+    -------------------------------------------------------------- '''
+
+    need = {n // 2} if n % 2 else {n // 2 - 1, n // 2}
+    ops = []
+    for i, j in reversed(_merge_exchange(n)):
+        need_min, need_max = i in need, j in need
+        if need_min or need_max:
+            ops.append((i, j, need_min, need_max))
+            need |= {i, j}
+    return tuple(reversed(ops))
+
+class FrameStack:
+    ''' ------------------------------------------------------------------
+    The last nframes frames of a camera, with their median and mean
+    ------------------------------------------------------------------ '''
+
+    def __init__(self, nframes:int, shape:tuple=(), dtype=np.int16,
+                 out_dtype=np.float32):
+        ''' --------------------------------------------------------------
+        Parameters:
+        ----------
+        - nframes: the number of frames kept
+        - shape: the shape of the frames (changed by the first frame staged
+            if it doesn't match)
+        - dtype: the data type of the frames (as shape)
+        - out_dtype: the data type of the median and mean
+        -------------------------------------------------------------- '''
+
+        self.nframes = int(nframes)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.out_dtype = np.dtype(out_dtype)
+        # flat buffer frames are read into before being pushed
+        self._staging = np.zeros(int(np.prod(self.shape)), self.dtype)
+        self._staged = None
+        self.reset()
+
+    def reset(self, shape:tuple=None, nframes:int=None, dtype=None):
+        ''' --------------------------------------------------------------
+        Empties the stack, optionally changing its frame shape, length or
+        data type. Buffers are only allocated here.
+        -------------------------------------------------------------- '''
+
+        if shape is not None: self.shape = tuple(shape)
+        if nframes is not None: self.nframes = int(nframes)
+        if dtype is not None: self.dtype = np.dtype(dtype)
+        if self.nframes < 1: raise ValueError("A stack needs at least one frame")
+
+        nel = int(np.prod(self.shape))
+        if self._staging.dtype != self.dtype or self._staging.size < nel:
+            self._staging = np.zeros(nel, self.dtype)
+            self._staged = None
+
+        # frames in the order they were pushed (a ring), and their sum
+        self.frames = np.zeros((self.nframes,) + self.shape, self.dtype)
+        self.total = np.zeros(self.shape, self._acc)
+
+        # the buffers of the sorting network (allocated by the first median,
+        #   stacks that are only averaged don't need them), and the outputs
+        #   of median and mean
+        self._work = None
+        self._median = np.zeros(self.shape, self.out_dtype)
+        self._mean = np.zeros(self.shape, self.out_dtype)
+
+        # the number of frames in the stack, and the slot of the oldest
+        self.count = 0
+        self.head = 0
+
+    @property
+    def _acc(self) -> np.dtype:
+        '''The data type of the running sum (integers are summed exactly)'''
+
+        return np.dtype(np.int64 if self.dtype.kind in "iub" else np.float64)
+
+    def resize(self, nframes:int):
+        ''' --------------------------------------------------------------
+        Changes the number of frames kept, keeping the newest frames (as
+        many as fit)
+        -------------------------------------------------------------- '''
+
+        nframes = int(nframes)
+        if nframes < 1: raise ValueError("A stack needs at least one frame")
+        if nframes == self.nframes: return
+
+        # the frames kept, oldest first (the newest is just before head)
+        keep = min(self.count, nframes)
+        slots = [(self.head - keep + i) % self.nframes for i in range(keep)]
+        kept = self.frames[slots]
+
+        self.nframes = nframes
+        self.frames = np.zeros((nframes,) + self.shape, self.dtype)
+        self.frames[:keep] = kept
+        self.total = kept.sum(0, dtype = self._acc)
+
+        self.count = keep
+        self.head = keep % nframes
+
+    @property
+    def full(self) -> bool:
+        '''Whether the stack holds nframes frames'''
+
+        return self.count == self.nframes
+
+    def stage(self, shm:Shm, check=True, timeout:float=None) -> np.ndarray:
+        ''' --------------------------------------------------------------
+        Copies the data of a shm into the staging buffer, to be added by
+        push. The stack is reset if the frame doesn't match it.
+
+        Parameters:
+        ----------
+        - shm: the shm to read (e.g. the camera image)
+        - check: if True, waits for a new frame as in Shm.get_data
+        - timeout: seconds to wait if check is set, as in Shm.get_data
+        Returns:
+        ----------
+        - np.ndarray: the staged frame (shaped as get_data(reform=True)),
+            which can be modified before it's pushed
+        -------------------------------------------------------------- '''
+
+        if shm.npdtype != self.dtype: self.reset(dtype = shm.npdtype)
+
+        try: frame = shm.copy_into(self._staging, check, timeout)
+        # the frame is bigger than any seen so far, make room (the frame was
+        #   already waited for)
+        except ValueError:
+            shm.read_meta_data()
+            self._staging = np.zeros(shm.mtdata["nel"], self.dtype)
+            frame = shm.copy_into(self._staging)
+
+        if frame.shape != self.shape: self.reset(shape = frame.shape)
+        self._staged = frame
+        return frame
+
+    def push(self, frame:np.ndarray=None):
+        ''' --------------------------------------------------------------
+        Adds the staged frame (or frame, if given) to the stack, replacing
+        the oldest frame once the stack is full.
+        -------------------------------------------------------------- '''
+
+        if frame is not None:
+            frame = np.asarray(frame)
+            if frame.dtype != self.dtype or frame.shape != self.shape:
+                self.reset(shape = frame.shape, dtype = frame.dtype)
+            dest = self._staging[:frame.size].reshape(frame.shape)
+            np.copyto(dest, frame)
+            self._staged = dest
+
+        new = self._staged
+        if new is None: raise ValueError("No frame was staged")
+        self._staged = None
+
+        slot = self.frames[self.head]
+        if self.full: self.total -= slot
+        else: self.count += 1
+
+        self.total += new
+        np.copyto(slot, new)
+        self.head = (self.head + 1) % self.nframes
+
+    def median(self) -> np.ndarray:
+        ''' --------------------------------------------------------------
+        Returns the median of the frames in the stack, as np.median(frames,
+        0) would. The array is reused by the next call.
+        -------------------------------------------------------------- '''
+
+        if not self.count: raise ValueError("The stack is empty")
+        if self.count > NETWORK_MAX:
+            return np.median(self.frames[:self.count], 0, out = self._median)
+
+        # copy the frames into the work buffers (the order doesn't matter)
+        if self._work is None or len(self._work) < self.count + 1:
+            self._work = [np.empty(self.shape, self.dtype)
+                          for _ in range(self.count + 1)]
+        rows, tmp = self._work[:self.count], self._work[self.count]
+        for row, frame in zip(rows, self.frames): np.copyto(row, frame)
+
+        for i, j, need_min, need_max in _median_network(self.count):
+            a, b = rows[i], rows[j]
+            if need_min and need_max:
+                np.minimum(a, b, out = tmp)
+                np.maximum(a, b, out = b)
+                rows[i], tmp = tmp, a
+            elif need_min: np.minimum(a, b, out = a)
+            else: np.maximum(a, b, out = b)
+
+        mid = self.count // 2
+        if self.count % 2: np.copyto(self._median, rows[mid])
+        else:
+            np.add(rows[mid - 1], rows[mid], out = self._median,
+                dtype = self.out_dtype)
+            self._median *= 0.5
+        # rows is a copy, the buffers swapped in it are put back
+        self._work[:self.count + 1] = rows + [tmp]
+        return self._median
+
+    def mean(self) -> np.ndarray:
+        ''' --------------------------------------------------------------
+        Returns the mean of the frames in the stack. The array is reused by
+        the next call.
+        -------------------------------------------------------------- '''
+
+        if not self.count: raise ValueError("The stack is empty")
+
+        np.divide(self.total, self.count, out = self._mean)
+        return self._mean
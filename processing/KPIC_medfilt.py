@@ -0,0 +1,141 @@
+'''---------------------------------------------------------------------------
+Median filters for camera frames
+
+scipy.signal.medfilt sorts every window of every pixel, which takes tens of
+milliseconds on a full frame. This module filters the same way (the frame is
+padded with zeros, the output has the input's data type) with a choice of
+backends:
+
+    network - 3x3 only. A sorting network run on shifted views of the whole
+              frame: each column of three is sorted once (and shared by the
+              three windows it's in), then the median of a window is the
+              median of the largest low, the median middle and the smallest
+              high of its three columns. About twenty elementwise min/max
+              calls into preallocated buffers, no sorting.
+    ndimage - scipy.ndimage.median_filter, any kernel size
+    scipy   - scipy.signal.medfilt, the reference
+
+Usage:
+    im = medfilt(im)                        # 3x3, fastest backend
+    im = medfilt(im, 5)                     # 5x5 (ndimage)
+    im = medfilt(im, 3, backend = "scipy")
+
+See medfilt_bench.py for timings of each backend.
+---------------------------------------------------------------------------'''
+
+import numpy as np
+from scipy import ndimage, signal
+
+# scratch buffers of the sorting network by (shape, dtype), so that filtering
+#   frames of the same shape doesn't allocate (see _scratch)
+_buffers = {}
+
+def _scratch(shape:tuple, dtype:np.dtype) -> tuple:
+    '''Returns the padded frame and the buffers the sorting network uses for
+    frames of a shape and data type'''
+
+    key = (shape, dtype)
+    if key not in _buffers:
+        # a few shapes at most are ever used (the camera's crops)
+        if len(_buffers) > 8: _buffers.clear()
+        rows, cols = shape
+        padded = np.zeros((rows + 2, cols + 2), dtype)
+        # the low, middle and high of each column of three, and temporaries
+        cols_ = [np.empty((rows, cols + 2), dtype) for _ in range(4)]
+        wins = [np.empty((rows, cols), dtype) for _ in range(4)]
+        _buffers[key] = (padded, cols_, wins)
+    return _buffers[key]
+
+def _med3(a:np.ndarray, b:np.ndarray, c:np.ndarray, tmp:np.ndarray, out:np.ndarray) -> np.ndarray:
+    '''Writes the elementwise median of a, b and c into out (a and b are
+    modified)'''
+
+    np.minimum(a, b, out = tmp)
+    np.maximum(a, b, out = a)
+    np.minimum(a, c, out = a)
+    np.maximum(tmp, a, out = out)
+    return out
+
+def medfilt_network(im:np.ndarray, out:np.ndarray=None) -> np.ndarray:
+    ''' --------------------------------------------------------------
+    A 3x3 median filter with zero padding, as scipy.signal.medfilt(im)
+
+    Parameters:
+    ----------
+    - im: a 2D frame
+    - out: an array to write the result to (a new one if None)
+    Returns:
+    ----------
+    - np.ndarray: the filtered frame (out if given)
+    -------------------------------------------------------------- '''
+
+    im = np.asarray(im)
+    if im.ndim != 2: raise ValueError("Expected a 2D frame")
+    if out is None: out = np.empty_like(im)
+
+    padded, (lo, mid, hi, tmp), (w_lo, w_mid, w_hi, w_tmp) = _scratch(im.shape, im.dtype)
+    padded[1:-1, 1:-1] = im
+    up, center, down = padded[:-2], padded[1:-1], padded[2:]
+
+    # sort each column of three: lo <= mid <= hi
+    np.minimum(up, center, out = lo)
+    np.maximum(up, center, out = hi)
+    np.minimum(hi, down, out = mid)
+    np.maximum(hi, down, out = hi)
+    np.minimum(lo, mid, out = tmp)
+    np.maximum(lo, mid, out = mid)
+    lo, tmp = tmp, lo
+
+    # the largest low and the smallest high of the three columns of each window
+    np.maximum(lo[:, :-2], lo[:, 1:-1], out = w_lo)
+    np.maximum(w_lo, lo[:, 2:], out = w_lo)
+    np.minimum(hi[:, :-2], hi[:, 1:-1], out = w_hi)
+    np.minimum(w_hi, hi[:, 2:], out = w_hi)
+    # the median of the middles
+    np.copyto(w_mid, mid[:, :-2])
+    np.copyto(tmp[:, :-2], mid[:, 1:-1])
+    _med3(w_mid, tmp[:, :-2], mid[:, 2:], w_tmp, w_mid)
+
+    return _med3(w_lo, w_mid, w_hi, w_tmp, out)
+
+def medfilt_ndimage(im:np.ndarray, size:int=3, out:np.ndarray=None) -> np.ndarray:
+    '''A size x size median filter with zero padding (scipy.ndimage)'''
+
+    return ndimage.median_filter(im, size, output = out, mode = "constant", cval = 0)
+
+def medfilt_scipy(im:np.ndarray, size:int=3, out:np.ndarray=None) -> np.ndarray:
+    '''A size x size median filter with zero padding (scipy.signal.medfilt)'''
+
+    res = signal.medfilt(im, size)
+    if out is None: return res
+    np.copyto(out, res)
+    return out
+
+BACKENDS = ("auto", "network", "ndimage", "scipy")
+
+def medfilt(im:np.ndarray, size:int=3, backend:str="auto", out:np.ndarray=None) -> np.ndarray:
+    ''' --------------------------------------------------------------
+    Median filters a frame, as scipy.signal.medfilt(im, size)
+
+    Parameters:
+    ----------
+    - im: a 2D frame
+    - size: the (odd) width of the kernel
+    - backend: one of BACKENDS. auto uses network for 3x3 kernels and
+        ndimage otherwise
+    - out: an array to write the result to (a new one if None)
+    Returns:
+    ----------
+    - np.ndarray: the filtered frame, with the data type of im
+    -------------------------------------------------------------- '''
+
+    size = int(size)
+    if size < 1 or not size % 2: raise ValueError("Kernel size must be odd and positive")
+    if backend == "auto": backend = "network" if size == 3 else "ndimage"
+
+    if backend == "network":
+        if size != 3: raise ValueError("The network backend only does 3x3 kernels")
+        return medfilt_network(im, out)
+    elif backend == "ndimage": return medfilt_ndimage(im, size, out)
+    elif backend == "scipy": return medfilt_scipy(im, size, out)
+    else: raise ValueError("Unknown median filter backend {}".format(backend))
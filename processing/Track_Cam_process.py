@@ -22,6 +22,7 @@ class TC_process:
         is_processing
         is_log_scale
         is_sqrt_scale
+        get_range
         is_medfilt
         get_avg_cnt
         is_using_track
@@ -71,6 +72,7 @@ class TC_process:
 
         # get file paths for shms
         self.Vis_Scale = config.get("Shm Info", "Scale").split(",")[0]
+        self.Vis_Range = config.get("Shm Info", "Range").split(",")[0]
         self.Vis_Avg_cnt = config.get("Shm Info", "Scale").split(",")[0]
         self.Vis_Stat = config.get("Shm Info", "Stat").split(",")[0]
         self.Vis_Ref = config.get("Shm Info", "Ref").split(",")[0]
@@ -139,6 +141,19 @@ class TC_process:
 
         return self.Vis_Scale.get_data()[0] == 2
 
+    def get_range(self):
+        """A method to get the range of values displayed by visualizer processing
+
+        Returns:
+            tuple = (min, max), or None if values aren't clipped
+        """
+
+        self._check_alive_and_processing()
+
+        lo, hi = self.Vis_Range.get_data()[:2]
+        if lo < hi: return (int(lo), int(hi))
+        return None
+
     def is_medfilt(self):
         """Checks whether a median filter is being applied
 
@@ -282,6 +297,31 @@ class TC_process:
         # set new stat
         self.Vis_Stat.set_data(stat)
 
+    def set_range(self, lo:int=None, hi:int=None):
+        """A method to set the range of values displayed. Values outside of it
+            are clipped, and the scaled range is stretched over the display
+            range
+
+        NOTE: to display all values, call with no arguments
+
+        Args:
+            lo = the lowest value displayed
+            hi = the highest value displayed (must be above lo)
+        """
+
+        self._check_alive()
+
+        if lo is None and hi is None: lo, hi = 0, 0
+        elif lo is None or hi is None or not lo < hi:
+            raise ValueError("Range must be given as lo < hi.")
+
+        # the range is stored in the shm's integer type
+        bounds = np.iinfo(self.Vis_Range.npdtype)
+        if lo < bounds.min or hi > bounds.max:
+            raise ValueError("Range must be within [{}, {}].".format(bounds.min, bounds.max))
+
+        self.Vis_Range.set_data(np.array([lo, hi], self.Vis_Range.npdtype))
+
     def clear_scale(self):
         """A method to turn off log/sqrt scale"""
 
@@ -548,6 +588,7 @@ class TC_process:
         if type(self.Vis_Scale) is str:
             if os.path.isfile(self.Vis_Scale):
                 self.Vis_Scale = Shm(self.Vis_Scale)
+                self.Vis_Range = Shm(self.Vis_Range)
                 self.Vis_Avg_cnt = Shm(self.Vis_Avg_cnt)
                 self.Vis_Ref = Shm(self.Vis_Ref)
                 self.Vis_Bkgrd = Shm(self.Vis_Bkgrd)
@@ -555,6 +596,7 @@ class TC_process:
                 self.Vis_Error = Shm(self.Vis_Error)
         elif not os.path.isfile(self.Vis_Scale.fname):
             self.Vis_Scale = self.Vis_Scale.fname
+            self.Vis_Range = self.Vis_Range.fname
             self.Vis_Avg_cnt = self.Vis_Avg_cnt.fname
             self.Vis_Ref = self.Vis_Ref.fname
             self.Vis_Bkgrd = self.Vis_Bkgrd.fname
@@ -579,6 +621,8 @@ class TC_process:
             visavg   = the number of images averaged for one frame in vis process
                     (NOTE: these are rolling averages and only used if starting from the raw image)
             scale    = what kind of scale, if any, was used (None, log, sqrt)
+            vismin   = the lowest value displayed (N/A if values aren't clipped)
+            vismax   = the highest value displayed (N/A if values aren't clipped)
         Args:
             which = which kind of frame to make a header for (one of 'raw', 'vis', or 'visualizer)
         Returns:
@@ -598,6 +642,8 @@ class TC_process:
         vissubt = "N/A"
         visavg = "N/A"
         scl = "N/A"
+        vismin = "N/A"
+        vismax = "N/A"
 
         vis_stat     = self.Vis_Stat.get_data()[0]
         baseproc = bool(vis_stat & 2)
@@ -615,9 +661,12 @@ class TC_process:
             scl = "Log"
         elif scl == 2:
             scl = "Sqrt"
+        lo, hi = self.Vis_Range.get_data()[:2]
+        if lo < hi:
+            vismin, vismax = int(lo), int(hi)
 
         proc_info = fits.Header({"medfilt":medfilt, "baseproc":baseproc, "vissubt":vissubt,
-            "visavg":visavg, "scale":scl})
+            "visavg":visavg, "scale":scl, "vismin":vismin, "vismax":vismax})
 
         return self.tc._get_header() + proc_info
 
@@ -0,0 +1,95 @@
+'''---------------------------------------------------------------------------
+Benchmarks for KPIC_frame_stack
+
+Usage: python frame_stack_bench.py [-n ITERATIONS] [-N NFRAMES] [-o OUTPUT]
+
+Times, for each stack length in NFRAMES (default 3, 5, 10, 20, 30), what the
+tracking loop does per output: push N full 640x512 int16 frames and take
+their median. The same frames are timed with np.median(frames, 0) over the
+stack, and the medians are checked to be equal.
+
+A table is printed to stderr and the results are written as JSON to OUTPUT
+(stdout by default), as in shm_bench.py.
+---------------------------------------------------------------------------'''
+
+from argparse import ArgumentParser
+from time import perf_counter
+from datetime import datetime
+import os, sys, json, platform
+
+import numpy as np
+
+from KPIC_frame_stack import FrameStack, NETWORK_MAX
+
+# the tracking camera's full frame
+SHAPE = (512, 640)
+
+def time_calls(func, n:int) -> np.ndarray:
+    '''Calls func n times and returns the duration of each call in seconds'''
+
+    times = np.empty(n)
+    for i in range(n):
+        start = perf_counter()
+        func()
+        times[i] = perf_counter() - start
+    return times
+
+def frames(nframes:int) -> np.ndarray:
+    '''Returns frames of noise around a bias level, with some hot pixels'''
+
+    rng = np.random.default_rng(0)
+    ims = rng.normal(1000, 30, (nframes,) + SHAPE)
+    ims[rng.random(ims.shape) < 1e-3] = 16000
+    return ims.astype(np.int16)
+
+def bench(n:int, sizes:list) -> list:
+    '''Times the stack and np.median for each stack length'''
+
+    results = []
+    for nframes in sizes:
+        ims = frames(nframes)
+        stack = FrameStack(nframes, SHAPE)
+        out = np.empty(SHAPE, np.float32)
+
+        def run_stack():
+            for im in ims: stack.push(im)
+            return stack.median()
+
+        match = np.array_equal(run_stack(), np.median(ims, 0).astype(np.float32))
+        for method, func in (("stack", run_stack),
+                             ("np.median", lambda: np.median(ims, 0, out = out))):
+            times = time_calls(func, n)
+            med, p99 = np.percentile(times*1e3, [50, 99]).tolist()
+            results.append({"method": method, "nframes": nframes,
+                "network": method == "stack" and nframes <= NETWORK_MAX,
+                "shape": list(SHAPE), "n": n, "median_ms": med, "p99_ms": p99,
+                "mean_ms": float(np.mean(times)*1e3), "matches_numpy": bool(match)})
+            print("{method:<12}{nframes:>8}{median_ms:>14.2f}{p99_ms:>12.2f}"
+                  "{matches_numpy!s:>10}".format(**results[-1]), file = sys.stderr)
+    return results
+
+def metadata(args) -> dict:
+    '''Returns a description of the machine that was measured'''
+
+    return {"date": datetime.now().isoformat(), "host": platform.node(),
+            "platform": platform.platform(), "python": platform.python_version(),
+            "numpy": np.__version__, "iterations": args.n,
+            "cpu_count": os.cpu_count()}
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description = "Benchmark KPIC_frame_stack")
+    parser.add_argument("-n", type = int, default = 20, help = "calls per measurement")
+    parser.add_argument("-N", type = int, nargs = "+", default = [3, 5, 10, 20, 30],
+                        help = "stack lengths")
+    parser.add_argument("-o", help = "file to write JSON results to (default stdout)")
+    args = parser.parse_args()
+
+    print("{:<12}{:>8}{:>14}{:>12}{:>10}".format("method", "frames",
+        "median (ms)", "p99 (ms)", "exact"), file = sys.stderr)
+
+    doc = {"meta": metadata(args), "results": bench(args.n, args.N)}
+    if args.o is None: json.dump(doc, sys.stdout, indent = 1)
+    else:
+        with open(args.o, "w") as file_: json.dump(doc, file_, indent = 1)
+
+    if not all(res["matches_numpy"] for res in doc["results"]): sys.exit(1)
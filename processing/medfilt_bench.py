@@ -0,0 +1,93 @@
+'''---------------------------------------------------------------------------
+Benchmarks for KPIC_medfilt
+
+Usage: python medfilt_bench.py [-n ITERATIONS] [-k SIZES] [-o OUTPUT]
+
+Times every median filter backend on full 640x512 frames of int16 (camera
+frames), float32 and float64 (processed frames), for each kernel size in
+SIZES (default 3 and 5), and checks that each gives exactly what
+scipy.signal.medfilt does.
+
+A table is printed to stderr and the results are written as JSON to OUTPUT
+(stdout by default), as in shm_bench.py.
+---------------------------------------------------------------------------'''
+
+from argparse import ArgumentParser
+from time import perf_counter
+from datetime import datetime
+import os, sys, json, platform
+
+import numpy as np
+import scipy
+
+from KPIC_medfilt import medfilt, BACKENDS
+
+# the tracking camera's full frame
+SHAPE = (512, 640)
+DTYPES = (np.int16, np.float32, np.float64)
+
+def time_calls(func, n:int) -> np.ndarray:
+    '''Calls func n times and returns the duration of each call in seconds'''
+
+    times = np.empty(n)
+    for i in range(n):
+        start = perf_counter()
+        func()
+        times[i] = perf_counter() - start
+    return times
+
+def frame(dtype) -> np.ndarray:
+    '''Returns a frame of noise around a bias level, with some hot pixels'''
+
+    rng = np.random.default_rng(0)
+    im = rng.normal(1000, 30, SHAPE)
+    im[rng.random(SHAPE) < 1e-3] = 16000
+    return im.astype(dtype)
+
+def bench(n:int, sizes:list) -> list:
+    '''Times each backend for each data type and kernel size'''
+
+    results = []
+    for dtype in DTYPES:
+        im = frame(dtype)
+        out = np.empty_like(im)
+        for size in sizes:
+            ref = medfilt(im, size, "scipy")
+            for backend in BACKENDS[1:]:
+                if backend == "network" and size != 3: continue
+                match = np.array_equal(medfilt(im, size, backend), ref)
+                times = time_calls(lambda: medfilt(im, size, backend, out), n)
+                med, p99 = np.percentile(times*1e3, [50, 99]).tolist()
+                results.append({"backend": backend, "dtype": np.dtype(dtype).name,
+                    "size": size, "shape": list(SHAPE), "n": n, "median_ms": med,
+                    "p99_ms": p99, "mean_ms": float(np.mean(times)*1e3),
+                    "matches_scipy": bool(match)})
+                print("{backend:<10}{dtype:<10}{size:>6}{median_ms:>14.2f}"
+                      "{p99_ms:>12.2f}{matches_scipy!s:>10}".format(**results[-1]),
+                      file = sys.stderr)
+    return results
+
+def metadata(args) -> dict:
+    '''Returns a description of the machine that was measured'''
+
+    return {"date": datetime.now().isoformat(), "host": platform.node(),
+            "platform": platform.platform(), "python": platform.python_version(),
+            "numpy": np.__version__, "scipy": scipy.__version__,
+            "iterations": args.n, "cpu_count": os.cpu_count()}
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description = "Benchmark KPIC_medfilt")
+    parser.add_argument("-n", type = int, default = 20, help = "calls per measurement")
+    parser.add_argument("-k", type = int, nargs = "+", default = [3, 5], help = "kernel sizes")
+    parser.add_argument("-o", help = "file to write JSON results to (default stdout)")
+    args = parser.parse_args()
+
+    print("{:<10}{:<10}{:>6}{:>14}{:>12}{:>10}".format("backend", "dtype",
+        "size", "median (ms)", "p99 (ms)", "exact"), file = sys.stderr)
+
+    doc = {"meta": metadata(args), "results": bench(args.n, args.k)}
+    if args.o is None: json.dump(doc, sys.stdout, indent = 1)
+    else:
+        with open(args.o, "w") as file_: json.dump(doc, file_, indent = 1)
+
+    if not all(res["matches_scipy"] for res in doc["results"]): sys.exit(1)
@@ -0,0 +1,308 @@
+'''---------------------------------------------------------------------------
+Recording of shm updates for post-mortem debugging
+
+A Recorder subscribes to a set of shms and appends every update it sees (the
+counter, atime and data) to in-memory columns, one set per shm. Columns that
+are full or old are handed to a background thread that writes them as
+compressed chunks, partitioned by night (UTC date, as in the draw logs):
+
+    DATA/YYMMDD/TELEMETRY/<name>/<name>_<HHMMSS>_<cnt0>.npz
+
+where the date and HHMMSS are when the first row was recorded (atime can
+be 0 for shms that were never written) and cnt0 is that of the first row.
+Each chunk holds the columns cnt0 (uint64), atime (float64), nel (uint32),
+size (uint16, rows x 3) and data (the payloads of all rows concatenated).
+Use load to read a night back.
+
+Updates are read without blocking the writers of mmapped shms (see
+Shm seqlock) and file-backed shms are only locked while they're read; disk
+writes never happen on the thread that reads the shms. Updates that come
+faster than the recorder wakes up are coalesced, which shows up as gaps in
+cnt0. A shm whose file is recreated (e.g. its control script restarted) is
+reopened at the next rescan and starts a new chunk.
+---------------------------------------------------------------------------'''
+
+from threading import Thread
+from queue import Queue, Full
+from time import time, gmtime, strftime, monotonic
+from logging import info, warning
+from glob import glob
+import os
+
+import numpy as np
+
+from KPIC_shmlib import Shm, ShmMux
+
+class _Columns:
+    ''' ------------------------------------------------------------------
+    The rows recorded from one shm that haven't been written yet
+    ------------------------------------------------------------------ '''
+
+    def __init__(self):
+        self.cnt0 = []
+        self.atime = []
+        self.nel = []
+        self.size = []
+        self.data = []
+        # when the first row was added (monotonic and UNIX time)
+        self.start = None
+        self.wall = None
+
+    def __len__(self) -> int:
+        return len(self.cnt0)
+
+    def append(self, cnt0:int, atime:float, size:tuple, data:np.ndarray):
+        '''Adds a row'''
+
+        if self.start is None: 
+            self.start = monotonic()
+            self.wall = time()
+        self.cnt0.append(cnt0)
+        self.atime.append(atime)
+        self.nel.append(data.size)
+        self.size.append(size)
+        self.data.append(data)
+
+    def arrays(self) -> dict:
+        '''Returns the columns as arrays, ready to be saved'''
+
+        return {"cnt0": np.array(self.cnt0, np.uint64),
+                "atime": np.array(self.atime, np.float64),
+                "nel": np.array(self.nel, np.uint32),
+                "size": np.array(self.size, np.uint16).reshape(-1, 3),
+                "data": np.concatenate(self.data)}
+
+class _ChunkWriter(Thread):
+    ''' ------------------------------------------------------------------
+    Writes chunks handed to it by a Recorder, so that the recorder never
+    waits on the disk. A chunk is written to a temporary name and renamed
+    when complete, so a chunk file is never seen half written.
+    ------------------------------------------------------------------ '''
+
+    def __init__(self, max_pending:int):
+        super().__init__(daemon = True)
+        self.queue = Queue(max_pending)
+        self.written = 0
+        self.failed = 0
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None: break
+            path, columns = item
+            try: self.write(path, columns)
+            except OSError as ouch:
+                self.failed += 1
+                warning("Couldn't write {}: {}".format(path, ouch))
+
+    def write(self, path:str, columns:dict):
+        '''Saves columns as a compressed npz at path'''
+
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        # never overwrite a chunk (e.g. cnt0 restarting after a restart)
+        base, n = path[:-4], 1
+        while os.path.exists(path):
+            path = "{}_{}.npz".format(base, n)
+            n += 1
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as file_: np.savez_compressed(file_, **columns)
+        os.rename(tmp, path)
+        self.written += 1
+
+class Recorder:
+    ''' ------------------------------------------------------------------
+    Records every update of a set of shms to chunked, compressed files.
+    Shms that don't exist yet are retried every rescan_s seconds, so the
+    recorder can be started before the devices, and shms whose files were
+    recreated since they were opened are reopened.
+    ------------------------------------------------------------------ '''
+
+    def __init__(self, shms:dict, data_dir:str, chunk_rows:int=1000,
+                 flush_s:float=60., max_pending:int=64, rescan_s:float=10.):
+        ''' --------------------------------------------------------------
+        Parameters:
+        ----------
+        - shms: a dictionary of recording names to shm file names
+        - data_dir: the data directory the nightly folders are in
+        - chunk_rows: the number of rows of a shm written per chunk
+        - flush_s: seconds after which a partial chunk is written anyway
+        - max_pending: the number of chunks that can wait to be written.
+            If the disk falls behind further, chunks are dropped (and
+            counted in dropped) rather than using unbounded memory.
+        - rescan_s: seconds between attempts to open missing shms (and
+            checks for recreated ones)
+        -------------------------------------------------------------- '''
+
+        self.fnames = dict(shms)
+        self.data_dir = data_dir
+        self.chunk_rows = chunk_rows
+        self.flush_s = flush_s
+        self.rescan_s = rescan_s
+
+        self.mux = ShmMux()
+        # the shms that have been opened and the inodes of their files, by
+        #   recording name
+        self.shms = {}
+        self.inodes = {}
+        self.names = {}
+        self.columns = {name: _Columns() for name in self.fnames}
+        self._last_scan = None
+
+        self.recorded = 0
+        self.dropped = 0
+
+        self.writer = _ChunkWriter(max_pending)
+        self.writer.start()
+
+        self._open()
+
+    def _open(self):
+        '''Opens the shms that exist and haven't been opened yet, and
+        reopens the ones whose files were recreated'''
+
+        self._last_scan = monotonic()
+        for (name, fname) in self.fnames.items():
+            try: ino = os.stat(fname).st_ino
+            except OSError: continue
+            if name in self.shms:
+                if self.inodes[name] == ino: continue
+                self._drop(name)
+
+            try: shm = Shm(fname, seqlock = True)
+            except (OSError, ValueError) as ouch:
+                info("Couldn't open {}: {}".format(fname, ouch))
+                continue
+
+            self.shms[name] = shm
+            self.inodes[name] = ino
+            self.names[id(shm)] = name
+            self.mux.add(shm)
+            info("Recording {} as {}".format(fname, name))
+            # record the value it had when recording started
+            self._record(name, shm)
+
+    def _drop(self, name:str):
+        '''Writes the rows of a shm whose file was recreated and closes it,
+        so that it can be opened again'''
+
+        info("{} was recreated, reopening it".format(self.fnames[name]))
+        # cnt0 starts over in the new file, so it starts a new chunk
+        self.flush(name)
+        shm = self.shms.pop(name)
+        del self.inodes[name]
+        del self.names[id(shm)]
+        self.mux.remove(shm)
+        shm.close()
+
+    def _record(self, name:str, shm:Shm):
+        '''Reads the current data of shm and adds it to its columns'''
+
+        try:
+            # if a write lands between the data and atime reads, read again
+            #   rather than record an atime that doesn't go with the data
+            for _ in range(3):
+                data = shm.get_data()
+                cnt0 = shm.mtdata["cnt0"]
+                atime = shm.get_time()
+                if shm.get_counter() == cnt0: break
+        # the shm was deleted (e.g. its control script stopped)
+        except (OSError, ValueError): return
+
+        columns = self.columns[name]
+        # a shm replaced by one with another data type starts a new chunk
+        if len(columns) and columns.data[-1].dtype != data.dtype:
+            self.flush(name)
+            columns = self.columns[name]
+
+        columns.append(cnt0, atime, tuple(shm.mtdata["size"]), data)
+        self.recorded += 1
+        if len(columns) >= self.chunk_rows: self.flush(name)
+
+    def poll(self, timeout:float=1.):
+        ''' --------------------------------------------------------------
+        Waits up to timeout seconds for updates and records them. Also
+        writes old chunks and looks for missing shms when it's time to.
+        -------------------------------------------------------------- '''
+
+        for shm in self.mux.wait(timeout):
+            self._record(self.names[id(shm)], shm)
+
+        now = monotonic()
+        for (name, columns) in self.columns.items():
+            if len(columns) and now - columns.start >= self.flush_s:
+                self.flush(name)
+
+        if now - self._last_scan >= self.rescan_s: self._open()
+
+    def flush(self, name:str=None):
+        ''' --------------------------------------------------------------
+        Hands the rows of one recording (or all of them if name is None)
+        to the writer thread. Doesn't wait for them to be written.
+        -------------------------------------------------------------- '''
+
+        for name in (self.columns if name is None else [name]):
+            columns = self.columns[name]
+            if not len(columns): continue
+            self.columns[name] = _Columns()
+
+            gmt = gmtime(columns.wall)
+            # nirspec, etc. only take the last two digits of the year
+            night = strftime("%y%m%d", gmt)
+            fname = "{}_{}_{}.npz".format(name, strftime("%H%M%S", gmt), columns.cnt0[0])
+            path = os.path.join(self.data_dir, night, "TELEMETRY", name, fname)
+
+            try: self.writer.queue.put_nowait((path, columns.arrays()))
+            except Full:
+                self.dropped += 1
+                warning("Writer behind, dropped {} rows of {}".format(len(columns), name))
+
+    def close(self):
+        ''' --------------------------------------------------------------
+        Writes everything recorded so far and stops the writer thread
+        -------------------------------------------------------------- '''
+
+        self.flush()
+        self.writer.queue.put(None)
+        self.writer.join()
+        self.mux.close()
+        for shm in self.shms.values(): shm.close()
+        info("Recorded {} rows, wrote {} chunks, dropped {}, failed {}".format(
+            self.recorded, self.writer.written, self.dropped, self.writer.failed))
+
+def load(name:str, night:str, data_dir:str="/nfiudata") -> dict:
+    ''' --------------------------------------------------------------
+    Reads back everything recorded for name on a night.
+
+    Parameters:
+    ----------
+    - name: the recording name (e.g. FIU_TTM.Pos_D)
+    - night: the night folder (YYMMDD)
+    - data_dir: the data directory the nightly folders are in
+    Returns:
+    ----------
+    - dict: the columns of all chunks concatenated in time order, plus
+        offset, the index in data where each row's payload starts. Row i
+        is data[offset[i]:offset[i]+nel[i]].
+    -------------------------------------------------------------- '''
+
+    cols = {"cnt0": [], "atime": [], "nel": [], "size": [], "data": []}
+    path = os.path.join(data_dir, night, "TELEMETRY", name, "*.npz")
+    for fname in sorted(glob(path)):
+        with np.load(fname) as chunk:
+            for key in cols: cols[key].append(chunk[key])
+
+    if not cols["cnt0"]:
+        raise FileNotFoundError("No recording of {} on {}".format(name, night))
+
+    cols = {key: np.concatenate(val) for (key, val) in cols.items()}
+    cols["offset"] = np.zeros(len(cols["nel"]), np.int64)
+    cols["offset"][1:] = np.cumsum(cols["nel"][:-1])
+
+    # chunk names sort by time within a day, but make sure of it
+    order = np.argsort(cols["atime"], kind = "stable")
+    if np.any(order != np.arange(len(order))):
+        for key in ("cnt0", "atime", "nel", "size", "offset"):
+            cols[key] = cols[key][order]
+
+    return cols
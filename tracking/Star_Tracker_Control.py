@@ -11,11 +11,11 @@ import sys, os, logging
 
 # installs
 import numpy as np
-from scipy.signal import medfilt
 import nair
 
 # nfiuserver libraries
 from KPIC_shmlib import Shm
+from KPIC_medfilt import medfilt
 from FIU_TTM_cmds import FIU_TTM_cmds as TTM
 from Track_Cam_cmds import Track_Cam_cmds as TC
 from ktl import Service
@@ -1,5 +1,4 @@
 import sys
-from time import sleep
 
 sys.path.insert(1, "/kroot/src/kss/nirspec/nsfiu/dev/lib")
 from KPIC_shmlib import Shm
@@ -37,7 +36,7 @@ def set_pa(new_val:float, ret:bool=False):
     pa.set_data(data)
     if ret:
         cnt = pa.mtdata["cnt0"]
-        while(pa.get_counter() == cnt): sleep(2)
+        pa.wait_for_update(cnt)
         return pa.get_data()[1]
 
 def set_sep(new_val:float, ret:bool=False):
@@ -54,5 +53,5 @@ def set_sep(new_val:float, ret:bool=False):
     sep.set_data(data)
     if ret:
         cnt = sep.mtdata["cnt0"]
-        while(sep.get_counter() == cnt): sleep(2)
+        sep.wait_for_update(cnt)
         return sep.get_data()[1]